@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# Gitless - a version control system built on top of Git
+# Licensed under MIT
+
+"""Completers for tab completion of gl arguments.
+
+Completion runs on every tab press, so the completers here don't open the
+repository with pygit2. Ref names are read directly from the loose refs and
+the packed-refs file. Since the latter can get big, the names in it are cached
+on disk (in the Git dir) and only parsed again when packed-refs changes.
+"""
+
+import bisect
+import io
+import json
+import os
+import re
+
+_CACHE_FILE = 'GL_COMPLETION_CACHE'
+_CACHE_VERSION = 1
+
+# In-process memo of _packed_refs (a single completion can look at several
+# namespaces)
+_packed_refs_memo = {}
+
+_REMOTE_SECTION = re.compile(r'^\s*\[\s*remote\s+"(.+)"\s*\]', re.MULTILINE)
+
+
+def branches(prefix, **kwargs):
+    """Complete local and remote branch names."""
+    git_dir, common_dir = _git_dirs()
+    if not common_dir:
+        return []
+    return _ref_names(git_dir, common_dir, 'refs/heads/', prefix) + [
+        n for n in _ref_names(git_dir, common_dir, 'refs/remotes/', prefix)
+        if not n.endswith('/HEAD')]
+
+
+def tags(prefix, **kwargs):
+    """Complete tag names."""
+    git_dir, common_dir = _git_dirs()
+    if not common_dir:
+        return []
+    return _ref_names(git_dir, common_dir, 'refs/tags/', prefix)
+
+
+def remotes(prefix, **kwargs):
+    """Complete remote names."""
+    _, common_dir = _git_dirs()
+    if not common_dir:
+        return []
+    try:
+        with io.open(os.path.join(common_dir, 'config'), mode='r', encoding='utf-8') as f:
+            config = f.read()
+    except (IOError, UnicodeDecodeError):
+        return []
+    return [n for n in _REMOTE_SECTION.findall(config) if n.startswith(prefix)]
+
+
+def paths(prefix, **kwargs):
+    """Complete file paths (the Git dir is never offered)."""
+    from argcomplete.completers import FilesCompleter
+
+    return [
+        p for p in FilesCompleter()(prefix, **kwargs)
+        if p.rstrip('/\\') != '.git' and not p.startswith('.git' + os.sep)]
+
+
+# Private functions
+
+
+def _git_dirs():
+    """Return the Git dir and the common Git dir of the cwd's repository.
+
+    Both are None if the cwd is not inside a repository.
+    """
+    if 'GIT_DIR' in os.environ:
+        git_dir = os.path.abspath(os.environ['GIT_DIR'])
+    else:
+        git_dir = None
+        curr = os.getcwd()
+        while True:
+            candidate = os.path.join(curr, '.git')
+            if os.path.isdir(candidate):
+                git_dir = candidate
+                break
+            if os.path.isfile(candidate):  # worktree or submodule
+                with io.open(candidate, mode='r', encoding='utf-8') as f:
+                    content = f.read().strip()
+                if content.startswith('gitdir:'):
+                    git_dir = os.path.normpath(
+                        os.path.join(curr, content[len('gitdir:'):].strip()))
+                break
+            parent = os.path.dirname(curr)
+            if parent == curr:
+                break
+            curr = parent
+    if not git_dir:
+        return None, None
+
+    common_dir = git_dir
+    commondir_fp = os.path.join(git_dir, 'commondir')
+    if os.path.isfile(commondir_fp):
+        with io.open(commondir_fp, mode='r', encoding='utf-8') as f:
+            common_dir = os.path.normpath(os.path.join(git_dir, f.read().strip()))
+    return git_dir, common_dir
+
+
+def _ref_names(git_dir, common_dir, namespace, prefix):
+    """Return the names of the refs under namespace (e.g., 'refs/heads/').
+
+    Only names that start with prefix are returned, and they are returned
+    without the namespace.
+    """
+    packed = _packed_refs(git_dir, common_dir).get(namespace, [])
+    # packed is sorted, so the names that start with prefix are contiguous
+    start = bisect.bisect_left(packed, prefix)
+    end = start
+    while end < len(packed) and packed[end].startswith(prefix):
+        end += 1
+    names = set(packed[start:end])
+
+    loose_dir = os.path.join(common_dir, *namespace.split('/'))
+    for curr_dir, _, fps in os.walk(loose_dir):
+        rel_dir = os.path.relpath(curr_dir, loose_dir)
+        for fp in fps:
+            if fp.endswith('.lock'):
+                continue
+            name = fp if rel_dir == '.' else os.path.join(rel_dir, fp)
+            name = name.replace(os.sep, '/')
+            if name.startswith(prefix):
+                names.add(name)
+    return sorted(names)
+
+
+def _packed_refs(git_dir, common_dir):
+    """Return the names of all packed refs, grouped by namespace.
+
+    The result is a dict that maps a namespace (e.g., 'refs/tags/') to the
+    sorted list of the names under it (without the namespace). Parsing
+    packed-refs is cached in the Git dir, keyed by the mtime and size of
+    packed-refs (and the version of the cache format), so that most completions don't need to read it.
+    """
+    packed_refs_fp = os.path.join(common_dir, 'packed-refs')
+    try:
+        st = os.stat(packed_refs_fp)
+    except OSError:
+        return {}
+    key = [_CACHE_VERSION, st.st_mtime_ns, st.st_size]
+    memo = _packed_refs_memo.get(packed_refs_fp)
+    if memo and memo[0] == key:
+        return memo[1]
+
+    cache_fp = os.path.join(git_dir, _CACHE_FILE)
+    try:
+        with io.open(cache_fp, mode='r', encoding='utf-8') as f:
+            cache = json.load(f)
+        if cache['key'] == key:
+            _packed_refs_memo[packed_refs_fp] = (key, cache['refs'])
+            return cache['refs']
+    except (IOError, ValueError, KeyError, TypeError):
+        pass
+
+    refs = {}
+    with io.open(packed_refs_fp, mode='r', encoding='utf-8') as f:
+        for line in f:
+            # Lines are '<sha> <ref>', except for comments ('#') and the peeled
+            # value of the previous tag ('^<sha>')
+            if line.startswith(('#', '^')):
+                continue
+            parts = line.rstrip('\n').split(' ', 1)
+            if len(parts) != 2 or parts[1].count('/') < 2:
+                continue
+            _, kind, name = parts[1].split('/', 2)
+            refs.setdefault('refs/{0}/'.format(kind), []).append(name)
+    for names in refs.values():
+        names.sort()
+
+    try:
+        tmp_fp = cache_fp + '.tmp'
+        with io.open(tmp_fp, mode='w', encoding='utf-8') as f:
+            json.dump({'key': key, 'refs': refs}, f)
+        os.replace(tmp_fp, cache_fp)
+    except (IOError, OSError):
+        pass  # the cache is just an optimization
+    _packed_refs_memo[packed_refs_fp] = (key, refs)
+    return refs
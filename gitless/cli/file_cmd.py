@@ -4,11 +4,20 @@
 
 """Helper module for gl_{track, untrack, resolve}."""
 
-from . import helpers, pprint
+from . import completers, helpers, pprint
 
 VOWELS = ('a', 'e', 'i', 'o', 'u')
 
 
+# The files under the dirs given that each subcommand can be applied to (see
+# Repository.walk_files)
+WALK_FILTERS = {
+    'track': {'tracked': False},
+    'untrack': {'tracked': True},
+    'resolve': {'in_conflict': True},
+}
+
+
 def parser(help_msg, subcmd, subcmd_aliases=[]):
     def f(subparsers, repo):
         p = subparsers.add_parser(
@@ -16,10 +25,11 @@ def parser(help_msg, subcmd, subcmd_aliases=[]):
         p.add_argument(
             'files', nargs='+', help='the file(s) to {0}'.format(subcmd),
             action=helpers.PathProcessor, repo=repo,
-            skip_dir_test=repo and repo.current_branch.path_is_ignored,
+            walk_filter=WALK_FILTERS.get(subcmd), pathspec_from_file=True,
             skip_dir_cb=lambda path: pprint.warn(
                 'Skipped files under directory {0} since they are all '
-                'ignored'.format(path)))
+                'ignored'.format(path))).completer = completers.paths
+        helpers.pathspec_from_file_flags(p)
         p.set_defaults(func=main(subcmd))
 
     return f
@@ -28,22 +38,26 @@ def parser(help_msg, subcmd, subcmd_aliases=[]):
 def main(subcmd):
     def f(args, repo):
         curr_b = repo.current_branch
-        success = True
 
-        for fp in args.files:
-            try:
-                getattr(curr_b, subcmd + '_file')(fp)
+        # All files are looked up in one status and the index is written once.
+        # A file given more than once (e.g., also under a dir given) is only
+        # changed (and reported on) once
+        files = list(dict.fromkeys(args.files))  # (the paths come lazily)
+        if not files:  # (only dirs were given)
+            pprint.warn('No files to {0}'.format(subcmd))
+        errors = getattr(curr_b, subcmd + '_files')(files)
+        for fp in files:
+            e = errors.get(fp)
+            if e is None:
                 pprint.ok(
                     'File {0} is now a{1} {2}{3}d file'.format(
                         fp, 'n' if subcmd.startswith(VOWELS) else '', subcmd,
                         '' if subcmd.endswith('e') else 'e'))
-            except KeyError:
+            elif isinstance(e, KeyError):
                 pprint.err('Can\'t {0} non-existent file {1}'.format(subcmd, fp))
-                success = False
-            except ValueError as e:
+            else:
                 pprint.err(e)
-                success = False
 
-        return success
+        return not errors
 
     return f
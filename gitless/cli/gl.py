@@ -5,21 +5,23 @@
 """gl - Main Gitless command. Dispatcher to the other cmds."""
 
 import sys
+import os
 import argparse
-import argcomplete
+import array
+import importlib
+import json
+import signal
+import socket
+import struct
 import traceback
-import pygit2
 
 from subprocess import CalledProcessError
 
-from .. import core, __version__
+from .. import __version__, run_dir
 
-from . import (
-    gl_track, gl_untrack, gl_status, gl_diff, gl_commit, gl_branch, gl_tag,
-    gl_checkout, gl_merge, gl_resolve, gl_fuse, gl_remote, gl_publish,
-    gl_switch, gl_init, gl_history, gl_ignore, gl_fetch, gl_pull, gl_patch, gl_revert)
-from . import pprint
-from . import helpers
+# gitless.core (and with it pygit2), pprint and helpers are imported where
+# they are used, so that forwarding a command to the gl daemon and tab
+# completion don't pay for importing them
 
 SUCCESS = 0
 ERRORS_FOUND = 1
@@ -29,16 +31,74 @@ NOT_IN_GL_REPO = 4
 
 URL = 'https://github.com/goldstar611/gitless'
 
-repo = None
-try:
-    repo = core.Repository()
-    try:
-        pprint.DISABLE_COLOR = not repo.config.get_bool('color.ui')
-    except pygit2.GitError:
-        pprint.DISABLE_COLOR = (
-                repo.config['color.ui'] in ['no', 'never'])
-except (core.NotInRepoError, core.ShallowCloneException, core.RepoEmptyException, KeyError):
-    pass
+# The subcommands of gl, in the order they are listed in the help. Each entry
+# is (name, aliases, module). Modules are imported lazily, so that running a
+# subcommand only pays for importing and building the parser of that one.
+SUBCOMMANDS = [
+    ('track', ['tr'], 'gl_track'),
+    ('untrack', ['un'], 'gl_untrack'),
+    ('status', ['st'], 'gl_status'),
+    ('diff', ['df'], 'gl_diff'),
+    ('commit', ['ci'], 'gl_commit'),
+    ('branch', ['br'], 'gl_branch'),
+    ('tag', ['tg'], 'gl_tag'),
+    ('checkout', ['co'], 'gl_checkout'),
+    ('merge', ['mg'], 'gl_merge'),
+    ('resolve', ['rs'], 'gl_resolve'),
+    ('fuse', ['fs'], 'gl_fuse'),
+    ('remote', ['rt'], 'gl_remote'),
+    ('publish', ['pb', 'push'], 'gl_publish'),
+    ('switch', ['sw'], 'gl_switch'),
+    ('init', ['in'], 'gl_init'),
+    ('history', ['hs', 'log'], 'gl_history'),
+    ('ignore', ['ig'], 'gl_ignore'),
+    ('fetch', ['ft'], 'gl_fetch'),
+    ('pull', ['pl'], 'gl_pull'),
+    ('patch', ['pa'], 'gl_patch'),
+    ('revert', ['re'], 'gl_revert'),
+    ('batch', ['bt'], 'gl_batch'),
+    ('daemon', ['dm'], 'gl_daemon'),
+    ('watch', ['wt'], 'gl_watch'),
+    ('prompt', ['pr'], 'gl_prompt'),
+]
+
+# Subcommands that can run outside of a repository
+NO_REPO_SUBCOMMANDS = ['init', 'batch', 'daemon']
+
+
+def load_subcommands(argv=None):
+    """Return the modules of the subcommands needed to parse argv.
+
+    If argv names a subcommand (or one of its aliases) only the module of that
+    subcommand is imported. Otherwise (no subcommand, an unknown one, or a
+    request for help) the modules of all subcommands are returned so that they
+    can be listed. Printing the version needs no subcommand at all.
+    """
+    modules = [module for _, _, module in SUBCOMMANDS]
+    for arg in (argv or []):
+        if arg in ['-h', '--help']:
+            break
+        if arg == '--version':  # no need for any subcommand
+            modules = []
+            break
+        if not arg.startswith('-'):
+            entry = lookup_subcommand(arg)
+            if entry:
+                modules = [entry[2]]
+            break
+    return [_import_subcommand(m) for m in modules]
+
+
+def lookup_subcommand(name):
+    """Return the entry in SUBCOMMANDS for the given name or alias (or None)."""
+    for entry in SUBCOMMANDS:
+        if name == entry[0] or name in entry[1]:
+            return entry
+    return None
+
+
+def _import_subcommand(module):
+    return importlib.import_module('.' + module, __package__)
 
 
 def print_help(parser):
@@ -59,13 +119,14 @@ def print_help(parser):
             print('    {:<19} {}'.format(choice.dest, choice.help))
 
 
-def build_parser(subcommands, repo):
+def build_parser(subcommands, repo=None):
     parser = argparse.ArgumentParser(
         description=(
             'Gitless: a version control system built on top of Git.\nMore info, '
             'downloads and documentation at {0}'.format(URL)),
         formatter_class=argparse.RawDescriptionHelpFormatter)
     if sys.version_info[0] < 3:
+        from . import helpers
         parser.register('action', 'parsers', helpers.AliasedSubParsersAction)
     parser.add_argument(
         '--version', action='version', version=(
@@ -87,21 +148,85 @@ def setup_windows_console():
         kernel32.SetConsoleMode(kernel32.GetStdHandle(-11), 7)
 
 
+def complete():
+    """Tab-complete the command line that argcomplete passes in the environment.
+
+    Only the parser of the subcommand being completed is built. While the
+    subcommand itself is being completed, a parser that only knows the names of
+    the subcommands is used (no subcommand module is imported).
+    """
+    from argcomplete import autocomplete, split_line
+
+    comp_line = os.environ.get('COMP_LINE', '')
+    comp_point = int(os.environ.get('COMP_POINT', len(comp_line)))
+    words = split_line(comp_line, comp_point)[3][1:]  # the first word is gl
+    entry = None
+    for word in words:
+        if not word.startswith('-'):
+            entry = lookup_subcommand(word)
+            break
+
+    if entry:
+        sub_cmds = [_import_subcommand(entry[2])]
+    else:
+        sub_cmds = [_SubcommandName(name, aliases) for name, aliases, _ in SUBCOMMANDS]
+    autocomplete(build_parser(sub_cmds))
+    return SUCCESS
+
+
+class _SubcommandName(object):
+    """Stand-in for a subcommand module that only adds the subcommand's name."""
+
+    def __init__(self, name, aliases):
+        self.name = name
+        self.aliases = aliases
+
+    def parser(self, subparsers, _):
+        subparsers.add_parser(self.name, aliases=self.aliases)
+
+
 def main():
-    sub_cmds = [
-        gl_track, gl_untrack, gl_status, gl_diff, gl_commit, gl_branch, gl_tag,
-        gl_checkout, gl_merge, gl_resolve, gl_fuse, gl_remote, gl_publish,
-        gl_switch, gl_init, gl_history, gl_ignore, gl_fetch, gl_pull, gl_patch, gl_revert]
-
-    parser = build_parser(sub_cmds, repo)
-    argcomplete.autocomplete(parser)
-    if len(sys.argv) == 1:
+    if '_ARGCOMPLETE' in os.environ:
+        return complete()
+
+    ret = forward_to_daemon(sys.argv[1:])
+    if ret is not None:
+        return ret
+    return run(sys.argv[1:])
+
+
+def run(argv):
+    """Run the gl command given by argv (without the program name) in-process.
+
+    Returns the exit code of gl.
+    """
+    from . import helpers
+
+    if argv and lookup_subcommand(argv[0]) == lookup_subcommand('prompt'):
+        # It runs on every shell prompt, so it doesn't even build gl's parser
+        from . import gl_prompt
+        return gl_prompt.run(argv[1:])
+
+    # The repository is opened on first use (see helpers.get_repo), so that
+    # printing the help or the version, and syntax errors, don't pay for it
+    parser = build_parser(load_subcommands(argv))
+    if not argv:
         print_help(parser)
         return SUCCESS
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    return dispatch(args, helpers.get_repo())
+
+
+def dispatch(args, repo):
+    """Run the subcommand of the already parsed args and return gl's exit code."""
+    import pygit2
+    from .. import core
+    from . import pprint
+
     try:
-        if args.subcmd_name != 'init' and not repo:
+        name = lookup_subcommand(args.subcmd_name)[0]
+        if name not in NO_REPO_SUBCOMMANDS and not repo:
             raise core.NotInRepoError('You are not in a Gitless repository')
 
         setup_windows_console()
@@ -131,3 +256,86 @@ def main():
             'include the following information:\n\n{1}\n\n{2}'.format(
                 URL, __version__, traceback.format_exc()))
         return INTERNAL_ERROR
+
+
+# gl daemon client
+
+
+# The environment variables a command run by the gl daemon gets from the client
+# (what gl, Git and the editor, pager and ssh they run look at). The rest of
+# the client's environment (tokens and the like) is not sent
+DAEMON_ENV_VARS = frozenset([
+    'HOME', 'PATH', 'USER', 'LOGNAME', 'SHELL', 'TERM', 'COLORTERM', 'COLUMNS',
+    'LINES', 'LANG', 'LANGUAGE', 'TZ', 'TMPDIR', 'EDITOR', 'VISUAL', 'PAGER',
+    'LESS', 'LESSCHARSET', 'MORE', 'DISPLAY', 'XDG_CONFIG_HOME',
+    'XDG_RUNTIME_DIR', 'SSH_AUTH_SOCK', 'SSH_ASKPASS'])
+DAEMON_ENV_PREFIXES = ('GIT_', 'GL_', 'LC_')
+
+
+def daemon_address():
+    """Return the path of the Unix socket the gl daemon listens on."""
+    return os.path.join(run_dir.path(), 'daemon.sock')
+
+
+def daemon_env(env):
+    """Return the variables of env that are sent to the gl daemon."""
+    return {
+        var: value for var, value in env.items()
+        if var in DAEMON_ENV_VARS or var.startswith(DAEMON_ENV_PREFIXES)}
+
+
+def forward_to_daemon(argv):
+    """Run the gl command given by argv in the gl daemon, if there's one running.
+
+    The daemon gets the argv, cwd and environment (see DAEMON_ENV_VARS) of this
+    process, as well as its stdin, stdout and stderr, so the command reads and
+    writes directly from/to them. That only happens if the daemon is run by
+    the same user (see run_dir). Returns the exit code of the command or None
+    if the command wasn't run by a daemon (it should then be run in-process).
+    """
+    if sys.platform == 'win32' or os.environ.get('GL_NO_DAEMON'):
+        return None
+    if argv and lookup_subcommand(argv[0]) in [
+            lookup_subcommand('daemon'), lookup_subcommand('watch')]:
+        return None  # (these run until they are stopped)
+
+    try:
+        request = json.dumps({
+            'argv': argv, 'cwd': os.getcwd(),
+            'env': daemon_env(os.environ)})
+    except OSError:  # the cwd doesn't exist anymore
+        return None
+    sock = run_dir.connect(daemon_address())
+    if not sock:
+        return None
+
+    with sock:
+        request = request.encode('utf-8')
+        sock.sendmsg(
+            [struct.pack('!I', len(request))],
+            [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', [0, 1, 2]))])
+        sock.sendall(request)
+        # The daemon answers with the pid of the process running the command
+        # and, once it's done, with its exit code
+        try:
+            pid = read_int(sock)
+            while True:
+                try:
+                    return read_int(sock)
+                except KeyboardInterrupt:
+                    if pid > 0:  # (0 and -1 would be process groups)
+                        os.kill(pid, signal.SIGINT)
+        except EOFError:
+            sys.stderr.write('gl: the gl daemon died while running the command\n')
+            return INTERNAL_ERROR
+
+
+def read_int(sock):
+    """Read a 4-byte signed int (as sent by the gl daemon) from sock."""
+    data = b''
+    while len(data) < 4:
+        chunk = sock.recv(4 - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return struct.unpack('!i', data)[0]
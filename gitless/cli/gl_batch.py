@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# Gitless - a version control system built on top of Git
+# Licensed under MIT
+
+"""gl batch - Run many gl commands in one process."""
+
+import os
+import shlex
+import sys
+
+from . import gl, helpers, pprint
+
+
+def parser(subparsers, _):
+    """Adds the batch parser to the given subparsers object."""
+    desc = 'run the gl commands read from stdin (one per line)'
+    batch_parser = subparsers.add_parser(
+        'batch', help=desc, description=(
+            desc.capitalize() + '. '
+            'Lines are split like a shell would (e.g., track "a file" b) and the '
+            'leading gl is optional. Empty lines and lines that start with # are '
+            'ignored. Since stdin has the commands, the commands can\'t ask for '
+            'input'),
+        aliases=['bt'])
+    batch_parser.add_argument(
+        '-z', '--null', help=(
+            'read NUL-separated argv records instead of lines: each argument is '
+            'terminated by a NUL and each command by an empty argument'),
+        action='store_true')
+    batch_parser.add_argument(
+        '-s', '--stop-on-error', help='stop at the first command that fails',
+        action='store_true')
+    batch_parser.set_defaults(func=main)
+
+
+def main(args, repo):
+    data = os.fsdecode(sys.stdin.buffer.read())
+    cmds = _read_records(data) if args.null else _read_lines(data)
+    # One parser for all commands (argparse parsers can be reused)
+    cmd_parser = gl.build_parser(gl.load_subcommands())
+
+    errors_found = False
+    for i, (num, argv) in enumerate(cmds):
+        if argv and argv[0] == 'gl':
+            argv = argv[1:]
+        code = _run(cmd_parser, argv)
+        sys.stdout.flush()
+
+        cmd = ' '.join(shlex.quote(arg) for arg in ['gl'] + argv)
+        if code == gl.SUCCESS:
+            pprint.ok('{0}: {1}'.format(num, cmd))
+            continue
+        errors_found = True
+        pprint.err('{0}: {1} (exit status {2})'.format(num, cmd, code))
+        if args.stop_on_error:
+            skipped = len(cmds) - i - 1
+            if skipped:
+                pprint.err_exp('skipped the {0} remaining command(s)'.format(skipped))
+            break
+
+    return not errors_found
+
+
+def _run(cmd_parser, argv):
+    """Run the given gl command and return its exit status."""
+    entry = gl.lookup_subcommand(argv[0]) if argv else None
+    if entry and entry[0] in ['batch', 'daemon', 'watch']:
+        pprint.err('gl {0} can\'t be run from a batch'.format(entry[0]))
+        return gl.ERRORS_FOUND
+
+    try:
+        cmd_args = cmd_parser.parse_args(argv)
+    except SystemExit as e:  # syntax error (or help)
+        return e.code if isinstance(e.code, int) else gl.ERRORS_FOUND
+
+    repo = helpers.get_repo()
+    if not repo:
+        # There might be one after this command (gl init), so look again next
+        # time
+        helpers.set_repo(None)
+    return gl.dispatch(cmd_args, repo)
+
+
+def _read_lines(data):
+    """Return the (line number, argv) of the commands in the given lines."""
+    cmds = []
+    for num, line in enumerate(data.splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            cmds.append((num, shlex.split(line)))
+        except ValueError as e:  # e.g., no closing quotation
+            raise ValueError('Line {0}: {1}'.format(num, e))
+    return cmds
+
+
+def _read_records(data):
+    """Return the (record number, argv) of the commands in the given records."""
+    cmds = []
+    argv = []
+    args = data.split('\0')
+    if not args[-1]:  # what comes after the NUL that terminates the last argument
+        args.pop()
+    for arg in args:
+        if arg:
+            argv.append(arg)
+            continue
+        cmds.append((len(cmds) + 1, argv))
+        argv = []
+    if argv:  # the last command might not be followed by an empty argument
+        cmds.append((len(cmds) + 1, argv))
+    return cmds
@@ -6,7 +6,7 @@
 
 from gitless import core
 
-from . import helpers, pprint
+from . import completers, helpers, pprint
 
 
 def parser(subparsers, _):
@@ -31,12 +31,12 @@ def parser(subparsers, _):
     create_group.add_argument(
         '-dp', '--divergent-point',
         help='the commit from where to \'branch out\' (only relevant if a new '
-             'branch is created; defaults to HEAD)', dest='dp')
+             'branch is created; defaults to HEAD)', dest='dp').completer = completers.branches
 
     delete_group = branch_parser.add_argument_group('delete branches')
     delete_group.add_argument(
         '-d', '--delete', nargs='+', help='delete branch(es)', dest='delete_b',
-        metavar='branch')
+        metavar='branch').completer = completers.branches
 
     edit_current_branch_group = branch_parser.add_argument_group('edit the current branch')
     edit_current_branch_group.add_argument(
@@ -45,7 +45,7 @@ def parser(subparsers, _):
     edit_current_branch_group.add_argument(
         '-su', '--set-upstream',
         help='set the upstream branch of the current branch',
-        dest='upstream_b', metavar='branch')
+        dest='upstream_b', metavar='branch').completer = completers.branches
     edit_current_branch_group.add_argument(
         '-uu', '--unset-upstream',
         help='unset the upstream branch of the current branch',
@@ -57,7 +57,7 @@ def parser(subparsers, _):
         help='renames the current branch (gl branch -rn new_name) '
              'or another specified branch (gl branch -rn branch_name new_name)',
         dest='rename_b'
-    )
+    ).completer = completers.branches
 
     branch_parser.set_defaults(func=main)
 
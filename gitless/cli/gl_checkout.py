@@ -6,7 +6,7 @@
 
 from gitless import core
 
-from . import helpers, pprint
+from . import completers, helpers, pprint
 
 
 def parser(subparsers, repo):
@@ -17,10 +17,12 @@ def parser(subparsers, repo):
     checkout_parser.add_argument(
         '-cp', '--commit-point', help=(
             'the commit point to checkout the files at. Defaults to HEAD.'),
-        dest='cp', default='HEAD')
+        dest='cp', default='HEAD').completer = completers.branches
     checkout_parser.add_argument(
         'files', nargs='+', help='the file(s) to checkout',
-        action=helpers.PathProcessor, repo=repo, recursive=False)
+        action=helpers.PathProcessor, repo=repo, recursive=False,
+        pathspec_from_file=True).completer = completers.paths
+    helpers.pathspec_from_file_flags(checkout_parser)
     checkout_parser.set_defaults(func=main)
 
 
@@ -29,35 +31,35 @@ def main(args, repo):
 
     curr_b = repo.current_branch
     cp = args.cp
+    commit = repo.revparse_single(cp)
 
-    for fp in args.files:
-        conf_msg = (
-            'You have uncomitted changes in "{0}" that could be overwritten by '
-            'checkout'.format(fp))
-        try:
-            f = curr_b.status_file(fp)
-            if f.type == core.GL_STATUS_TRACKED and f.modified and (
+    files = list(args.files)  # PathProcessor yields the paths lazily
+    statuses = curr_b.status_files(files)
+    with repo.index_session:  # (the index is written once)
+        for fp in files:
+            conf_msg = (
+                'You have uncomitted changes in "{0}" that could be overwritten by '
+                'checkout'.format(fp))
+            f = statuses.get(fp)
+            if f and f.type == core.GL_STATUS_TRACKED and f.modified and (
                     not pprint.conf_dialog(conf_msg)):
                 pprint.err('Checkout aborted')
                 continue
-        except KeyError:
-            pass
-
-        try:
-            curr_b.checkout_file(fp, repo.revparse_single(cp))
-            pprint.ok(
-                'File {0} checked out successfully to its state at {1}'.format(
-                    fp, cp))
-        except core.PathIsDirectoryError:
-            commit = repo.revparse_single(cp)
-            for fp in curr_b.get_paths(fp, commit):
+
+            try:
                 curr_b.checkout_file(fp, commit)
                 pprint.ok(
                     'File {0} checked out successfully to its state at {1}'.format(
                         fp, cp))
-        except KeyError:
-            pprint.err('Checkout aborted')
-            pprint.err('There\'s no file {0} at {1}'.format(fp, cp))
-            errors_found = True
+            except core.PathIsDirectoryError:
+                for fp in curr_b.get_paths(fp, commit):
+                    curr_b.checkout_file(fp, commit)
+                    pprint.ok(
+                        'File {0} checked out successfully to its state at {1}'.format(
+                            fp, cp))
+            except KeyError:
+                pprint.err('Checkout aborted')
+                pprint.err('There\'s no file {0} at {1}'.format(fp, cp))
+                errors_found = True
 
     return not errors_found
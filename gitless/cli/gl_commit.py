@@ -44,17 +44,9 @@ def main(args, repo):
     curr_b = repo.current_branch
     total_additions = 0
     total_deletions = 0
-    for fp in commit_files:
-        try:
-            patch = curr_b.diff_file(fp)
-        except KeyError:
-            continue
-
-        if patch.delta.is_binary:
-            continue
-
-        total_additions += patch.line_stats[1]
-        total_deletions += patch.line_stats[2]
+    for _, additions, deletions in curr_b.diff_stats(commit_files):
+        total_additions += additions
+        total_deletions += deletions
 
     partials = None
     if args.p:
@@ -104,8 +96,9 @@ def _author_info_is_ok(repo):
 
 def _do_partial_selection(files, curr_b):
     partials = []
+    statuses = curr_b.status_files(files)
     for fp in files:
-        f_st = curr_b.status_file(fp)
+        f_st = statuses[fp]
         if not f_st.exists_at_head:
             pprint.warn('Can\'t select segments for new file {0}'.format(fp))
             continue
@@ -122,8 +115,7 @@ def _do_partial_selection(files, curr_b):
 
 def _auto_track(files, curr_b):
     """Tracks those untracked files in the list."""
-    for fp in files:
-        f = curr_b.status_file(fp)
+    for f in curr_b.status_files(files).values():
         if f.type == core.GL_STATUS_UNTRACKED:
             curr_b.track_file(f.fp)
 
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+# Gitless - a version control system built on top of Git
+# Licensed under MIT
+
+"""gl daemon - Serve gl commands from a long-running process.
+
+Each gl command pays for starting Python, importing pygit2 and opening the
+repository. The daemon does that once: it keeps the repositories it has seen
+open (one per worktree) and runs the commands that gl forwards to it (see
+gl.forward_to_daemon) in a forked child. The child gets the client's stdin,
+stdout and stderr, so the output goes straight to the client's terminal (or
+pipe). A repository is reopened if its index, HEAD, refs or config changed
+since it was opened.
+
+The socket is in the private run dir of the user (see run_dir) and requests
+from processes of other users are dropped.
+"""
+
+import array
+import json
+import os
+import socket
+import struct
+import sys
+import traceback
+
+import pygit2
+
+from gitless import core, run_dir
+
+from . import gl, helpers, pprint
+
+
+# Environment variables that change what repository (or index) a command uses.
+# Commands run with any of them set open the repository themselves
+_REPO_ENV_VARS = ['GIT_DIR', 'GIT_WORK_TREE', 'GIT_INDEX_FILE', 'GIT_COMMON_DIR']
+
+
+def parser(subparsers, _):
+    """Adds the daemon parser to the given subparsers object."""
+    desc = 'serve gl commands from a long-running process to make them faster'
+    daemon_parser = subparsers.add_parser(
+        'daemon', help=desc, description=(
+            desc.capitalize() + '. '
+            'While the daemon is running, gl commands are run by it (set '
+            'GL_NO_DAEMON to run a command without it)'),
+        aliases=['dm'])
+    daemon_parser.add_argument(
+        '--stop', help='stop the running daemon', action='store_true')
+    daemon_parser.set_defaults(func=main)
+
+
+def main(args, repo):
+    if sys.platform == 'win32' or not run_dir.is_supported():
+        pprint.err('gl daemon is not supported on this platform')
+        return False
+
+    address = gl.daemon_address()
+    if args.stop:
+        if not stop(address):
+            pprint.err('No gl daemon is running')
+            return False
+        pprint.ok('Stopped the gl daemon')
+        return True
+
+    if is_running(address):
+        pprint.err('A gl daemon is already running')
+        return False
+    try:
+        run_dir.make()
+    except run_dir.RunDirError as e:
+        pprint.err(e)
+        return False
+    pprint.ok('gl daemon listening on {0}'.format(address))
+    pprint.exp('do gl daemon --stop (or hit Ctrl-C) to stop it')
+    serve(address)
+    return True
+
+
+def is_running(address):
+    """True if there's a daemon accepting connections at address."""
+    sock = run_dir.connect(address)
+    if not sock:
+        return False
+    sock.close()
+    return True
+
+
+def stop(address):
+    """Ask the daemon listening at address to exit.
+
+    Returns False if there's no daemon running.
+    """
+    sock = run_dir.connect(address)
+    if not sock:
+        return False
+    with sock:
+        request = json.dumps({'stop': True}).encode('utf-8')
+        sock.sendall(struct.pack('!I', len(request)) + request)
+        while sock.recv(1024):  # the daemon closes the connection on exit
+            pass
+    return True
+
+
+def serve(address):
+    """Serve the requests sent to address until asked to stop."""
+    run_dir.make()
+    if os.path.lexists(address):  # left behind by a daemon that crashed
+        os.unlink(address)
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(address)
+    listener.listen(16)
+    # Wake up every now and then to reap the children that are done
+    listener.settimeout(1)
+    repos = {}
+    try:
+        while True:
+            _reap_children()
+            try:
+                conn, _ = listener.accept()
+            except socket.timeout:
+                continue
+            with conn:
+                if not run_dir.peer_is_user(conn):
+                    continue  # someone else
+                if not _handle(conn, listener, repos):
+                    break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        os.unlink(address)
+
+
+# Private functions
+
+
+def _handle(conn, listener, repos):
+    """Handle the request sent through conn. Returns False to stop serving."""
+    fds = array.array('i')
+    header, ancdata, _, _ = conn.recvmsg(4, socket.CMSG_LEN(3 * fds.itemsize))
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+
+    try:
+        header += _recv_exactly(conn, 4 - len(header))
+        length = struct.unpack('!I', header)[0]
+        request = json.loads(_recv_exactly(conn, length).decode('utf-8'))
+        if request.get('stop'):
+            return False
+        if len(fds) != 3:  # malformed request
+            return True
+
+        repo = None
+        if not any(var in request['env'] for var in _REPO_ENV_VARS):
+            repo = _get_repo(repos, request['cwd'])
+        sys.stdout.flush()
+        sys.stderr.flush()
+        if os.fork() == 0:
+            listener.close()
+            _run(conn, fds, request, repo)
+    except (EOFError, ValueError, KeyError, OSError):
+        pass  # bad request or the client went away
+    finally:
+        for fd in fds:
+            os.close(fd)
+    return True
+
+
+def _run(conn, fds, request, repo):
+    """Run the command of the request (in a forked child). Never returns."""
+    try:
+        # Leave the daemon's session so that the command has no controlling
+        # terminal: signals from the daemon's terminal don't reach it and
+        # pagers fall back to reading the keyboard from stderr
+        os.setsid()
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        sys.stdout.reconfigure(line_buffering=sys.stdout.isatty())
+        helpers.set_repo(repo)
+
+        conn.sendall(struct.pack('!i', os.getpid()))
+        try:
+            code = gl.run(request['argv'])
+        except SystemExit as e:  # argparse exits on syntax errors and --help
+            code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        conn.sendall(struct.pack('!i', code))
+    except Exception:
+        traceback.print_exc()
+    finally:
+        os._exit(0)
+
+
+def _get_repo(repos, cwd):
+    """Return the (cached) repository for cwd or None if it can't be opened."""
+    path = pygit2.discover_repository(cwd)
+    if not path:
+        return None
+
+    stamp = _stamp(path)
+    cached = repos.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    os.chdir(cwd)
+    try:
+        repo = core.Repository()
+    except (core.NotInRepoError, core.ShallowCloneException, core.RepoEmptyException):
+        return None  # the command will open it and report the error
+    repos[path] = (stamp, repo)
+    return repo
+
+
+def _stamp(git_dir):
+    """Return a value that changes if the index, HEAD, refs or config change."""
+    common_dir = git_dir
+    commondir_fp = os.path.join(git_dir, 'commondir')
+    if os.path.isfile(commondir_fp):  # a linked worktree
+        with open(commondir_fp, 'r') as f:
+            common_dir = os.path.normpath(os.path.join(git_dir, f.read().strip()))
+
+    fps = [
+        os.path.join(git_dir, 'index'), os.path.join(git_dir, 'HEAD'),
+        os.path.join(common_dir, 'packed-refs'),
+        os.path.join(common_dir, 'config')]
+    # Loose refs are written to a lock file that is then renamed, so the mtime
+    # of the dir that has the ref changes
+    for curr_dir, _, _ in os.walk(os.path.join(common_dir, 'refs')):
+        fps.append(curr_dir)
+
+    stamp = []
+    for fp in fps:
+        try:
+            st = os.stat(fp)
+            stamp.append((fp, st.st_mtime_ns, st.st_size, st.st_ino))
+        except OSError:
+            stamp.append((fp, None))
+    return stamp
+
+
+def _recv_exactly(conn, n):
+    data = b''
+    while len(data) < n:
+        chunk = conn.recv(n - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+
+def _reap_children():
+    try:
+        while os.waitpid(-1, os.WNOHANG)[0]:
+            pass
+    except ChildProcessError:
+        pass
@@ -4,12 +4,24 @@
 
 """gl diff - Show changes in files."""
 
+import concurrent.futures
+import io
 import os
+import shutil
 import tempfile
 
+from gitless import core
+
 from . import helpers, pprint
 
 
+# The least number of files a worker process diffs at a time (each diff has a
+# cost that doesn't depend on the number of files, see _parallel_diff)
+_BATCH_SIZE = 256
+# How much of a file with rendered diffs is copied to the pager at a time
+_CHUNK_SIZE = 64 * 1024
+
+
 def parser(subparsers, repo):
     """Adds the diff parser to the given subparsers object."""
     desc = 'show changes to files'
@@ -18,6 +30,11 @@ def parser(subparsers, repo):
                 desc.capitalize() + '. ' +
                 'By default all tracked modified files are diffed. To customize the '
                 ' set of files to diff use the only, exclude, and include flags'), aliases=['df'])
+    diff_parser.add_argument(
+        '-j', '--jobs', help=(
+            'the number of processes to generate the diffs with (0 means one '
+            'per CPU). The default is 1'),
+        type=int, default=1)
     helpers.oei_flags(diff_parser, repo)
     diff_parser.set_defaults(func=main)
 
@@ -27,39 +44,133 @@ def main(args, repo):
     if not files:
         pprint.warn('No files to diff')
 
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    if jobs > 1 and len(files) > _BATCH_SIZE:
+        return _parallel_diff(files, jobs, repo)
+
     success = True
     curr_b = repo.current_branch
-    with tempfile.NamedTemporaryFile(mode='w', delete=False) as tf:
-        total_additions = 0
-        total_deletions = 0
-        patches = []
-        for fp in files:
-            try:
-                patch = curr_b.diff_file(fp)
-            except KeyError:
-                pprint.err('Can\'t diff non-existent file {0}'.format(fp))
+    total_additions = 0
+    total_deletions = 0
+    patches = []
+    for fp, patch in curr_b.diff_files(files):
+        stats = _stats(patch)
+        if not _check_stats(fp, stats):
+            if stats is None:
                 success = False
-                continue
-
-            if patch.delta.is_binary:
-                pprint.warn('Not showing diffs for binary file {0}'.format(fp))
-                continue
-
-            additions = patch.line_stats[1]
-            deletions = patch.line_stats[2]
-            total_additions += additions
-            total_deletions += deletions
-            if (not additions) and (not deletions):
-                pprint.warn('No diffs to output for {0}'.format(fp))
-                continue
-            patches.append(patch)
-        if patches:
-            pprint.diff_totals(total_additions, total_deletions, stream=tf.write)
+            continue
+        total_additions += stats[0]
+        total_deletions += stats[1]
+        patches.append(patch)
+
+    if patches:
+        with helpers.Pager(repo) as out:
+            pprint.diff_totals(total_additions, total_deletions, stream=out.write)
             for patch in patches:
-                pprint.diff(patch, stream=tf.write)
+                pprint.diff(patch, stream=out.write)
+
+    return success
+
+
+def _parallel_diff(files, jobs, repo):
+    """Diff files on a pool of jobs worker processes.
+
+    The files are split into batches that are diffed in parallel. For each
+    batch, a worker counts the lines added and deleted in each file (what's
+    needed for the summary that goes first) and renders the diffs to a
+    temporary file. So the memory used is bounded by the batches in the works
+    (not by the size of the whole diff). Once all batches are done, the
+    rendered diffs are copied to the pager in the order of files.
+
+    The temporary files are in a dir made here, that is removed (with whatever
+    the workers left in it) even if a batch fails or we are interrupted.
+    """
+    success = True
+    total_additions = 0
+    total_deletions = 0
+    rendered_fps = []
+    tmp_dir = tempfile.mkdtemp(prefix='gl-diff')
+    # (a few batches per worker, so that they are kept busy)
+    size = max(_BATCH_SIZE, -(-len(files) // (jobs * 4)))  # ceil
+    batches = [files[i:i + size] for i in range(0, len(files), size)]
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+                min(jobs, len(batches)), initializer=_init_worker,
+                initargs=(not pprint.should_color(), tmp_dir)) as pool:
+            for batch_stats, rendered_fp in pool.map(_diff_batch, batches):
+                if rendered_fp:
+                    rendered_fps.append(rendered_fp)
+                for fp, stats in batch_stats:
+                    if not _check_stats(fp, stats):
+                        if stats is None:
+                            success = False
+                        continue
+                    total_additions += stats[0]
+                    total_deletions += stats[1]
 
-    if os.path.getsize(tf.name) > 0:
-        helpers.page(tf.name, repo)
-    os.remove(tf.name)
+        if rendered_fps:
+            with helpers.Pager(repo) as out:
+                pprint.diff_totals(
+                    total_additions, total_deletions, stream=out.write)
+                for rendered_fp in rendered_fps:
+                    with io.open(rendered_fp, mode='r', encoding='utf-8') as f:
+                        for chunk in iter(lambda: f.read(_CHUNK_SIZE), ''):
+                            out.write(chunk)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
 
     return success
+
+
+def _stats(patch):
+    """None if there's no patch, False if it's binary, else its line stats."""
+    if patch is None:
+        return None
+    if patch.delta.is_binary:
+        return False
+    return patch.line_stats[1:]
+
+
+def _check_stats(fp, stats):
+    """Report on fp if it has no diffs to output (returns False if so)."""
+    if stats is None:
+        pprint.err('Can\'t diff non-existent file {0}'.format(fp))
+        return False
+    if stats is False:
+        pprint.warn('Not showing diffs for binary file {0}'.format(fp))
+        return False
+    if not any(stats):
+        pprint.warn('No diffs to output for {0}'.format(fp))
+        return False
+    return True
+
+
+# What runs on the worker processes
+
+
+_worker_branch = None
+_worker_tmp_dir = None
+
+
+def _init_worker(disable_color, tmp_dir):
+    global _worker_branch, _worker_tmp_dir
+    pprint.DISABLE_COLOR = disable_color
+    _worker_branch = core.Repository().current_branch
+    _worker_tmp_dir = tmp_dir
+
+
+def _diff_batch(fps):
+    """Return the stats of the files in fps and where their diffs are."""
+    batch_stats = []
+    rendered_fp = None
+    with tempfile.NamedTemporaryFile(
+            mode='w', encoding='utf-8', dir=_worker_tmp_dir, delete=False) as tf:
+        for fp, patch in _worker_branch.diff_files(fps):
+            stats = _stats(patch)
+            batch_stats.append((fp, stats))
+            if stats and any(stats):
+                pprint.diff(patch, stream=tf.write)
+                rendered_fp = tf.name
+    if not rendered_fp:
+        os.remove(tf.name)
+    return batch_stats, rendered_fp
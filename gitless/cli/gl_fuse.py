@@ -6,7 +6,7 @@
 
 from gitless import core
 
-from . import helpers, pprint
+from . import completers, helpers, pprint
 
 
 def parser(subparsers, repo):
@@ -21,7 +21,7 @@ def parser(subparsers, repo):
         'src', nargs='?',
         help=(
             'the source branch to read changes from. If none is given the upstream '
-            'branch of the current branch is used as the source'))
+            'branch of the current branch is used as the source')).completer = completers.branches
     fuse_parser.add_argument(
         '-o', '--only', nargs='+',
         help=(
@@ -4,10 +4,7 @@
 
 """gl history - Show commit history."""
 
-import os
-import tempfile
-
-from . import helpers, pprint
+from . import completers, helpers, pprint
 
 
 def parser(subparsers, _):
@@ -25,25 +22,23 @@ def parser(subparsers, _):
         action='store_true', default=False)
     history_parser.add_argument(
         '-b', '--branch', nargs='?', metavar='branch_name', dest='b',
-        help='the branch to show history of (defaults to the current branch)')
+        help='the branch to show history of (defaults to the current branch)').completer = completers.branches
     history_parser.set_defaults(func=main)
 
 
 def main(args, repo):
     b = helpers.get_branch(args.b, repo) if args.b else repo.current_branch
-    with tempfile.NamedTemporaryFile(mode='w', delete=False) as tf:
+    with helpers.Pager(repo) as out:
         count = 0
         for ci in b.history():
             if args.limit and count == args.limit:
                 break
-            pprint.commit(ci, compact=args.compact, stream=tf.write)
+            pprint.commit(ci, compact=args.compact, stream=out.write)
             if not args.compact:
-                pprint.puts(stream=tf.write)
+                pprint.puts(stream=out.write)
             if args.verbose and len(ci.parents) == 1:
                 for patch in b.diff_commits(ci.parents[0], ci):
-                    pprint.diff(patch, stream=tf.write)
+                    pprint.diff(patch, stream=out.write)
 
             count += 1
-    helpers.page(tf.name, repo)
-    os.remove(tf.name)
     return True
@@ -6,7 +6,7 @@
 
 from gitless import core
 
-from . import helpers, pprint
+from . import completers, helpers, pprint
 
 
 def parser(subparsers, repo):
@@ -15,7 +15,7 @@ def parser(subparsers, repo):
         'merge', help=desc, description=desc.capitalize(), aliases=['mg'])
     group = merge_parser.add_mutually_exclusive_group()
     group.add_argument(
-        'src', nargs='?', help='the source branch to read changes from')
+        'src', nargs='?', help='the source branch to read changes from').completer = completers.branches
     group.add_argument(
         '-a', '--abort', help='abort the merge in progress', action='store_true')
     merge_parser.set_defaults(func=main)
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# Gitless - a version control system built on top of Git
+# Licensed under MIT
+
+"""gl prompt - Print a summary of the repo for the shell prompt."""
+
+import argparse
+import io
+import os
+import select
+import signal
+import sys
+import threading
+import time
+
+from gitless import core
+
+from . import gl, helpers
+
+
+DESC = 'print a summary of the repo for the shell prompt'
+
+
+def parser(subparsers, repo):
+    """Adds the prompt parser to the given subparsers object."""
+    prompt_parser = subparsers.add_parser(
+        'prompt', help=DESC, description=_description(), aliases=['pr'])
+    _add_arguments(prompt_parser)
+    prompt_parser.set_defaults(func=main)
+
+
+def run(argv):
+    """Run gl prompt with the given args (what comes after 'prompt').
+
+    This is what gl runs for gl prompt: only the parser of gl prompt is built.
+    Returns the exit code of gl.
+    """
+    prompt_parser = argparse.ArgumentParser(
+        prog='gl prompt', description=_description())
+    _add_arguments(prompt_parser)
+    args = prompt_parser.parse_args(argv)
+    repo = helpers.get_repo()
+    if not repo:
+        return gl.NOT_IN_GL_REPO  # (nothing is printed)
+    return gl.SUCCESS if main(args, repo) else gl.ERRORS_FOUND
+
+
+def _description():
+    return (
+        DESC.capitalize() + ': the name of the current branch, (merge) or '
+        '(fuse) if one is in progress, how many commits the branch is ahead '
+        '(↑) and behind (↓) its upstream, * if there are tracked files with '
+        'modifications and % if there are untracked files. If the time budget '
+        'runs out, what is missing is replaced by a ?')
+
+
+def _add_arguments(prompt_parser):
+    prompt_parser.add_argument(
+        '-c', '--counts', help=(
+            'print the number of tracked files with modifications and of '
+            'untracked files after * and %% (slower, since every file needs to '
+            'be looked at)'),
+        action='store_true')
+    prompt_parser.add_argument(
+        '-b', '--budget', help=(
+            'the time (in milliseconds) gl prompt has to print the summary. '
+            'The default is to take as long as needed'),
+        type=int, default=None)
+
+
+def main(args, repo):
+    deadline = None
+    if args.budget is not None:
+        deadline = time.monotonic() + args.budget / 1000
+
+    # The segments are worked out (cheapest first) in a child process, so that
+    # the ones that are ready can be printed once the budget runs out and the
+    # rest of the work (that might be deep in libgit2) can be killed. Without
+    # fork, it's a thread that is left running. Either way, the work might be
+    # cut short, so it doesn't write anything (e.g., an index refresh killed
+    # midway would leave the index locked)
+    repo.read_only = True
+    work = _work_in_child if hasattr(os, 'fork') else _work_in_thread
+    done, finished = work(repo, args.counts, deadline)
+    if not finished:
+        done.append('?')
+    sys.stdout.write(' '.join(s for s in done if s) + '\n')
+    sys.stdout.flush()
+    return True
+
+
+def _work_in_child(repo, counts, deadline):
+    """Return the segments ready by the deadline and whether all are."""
+    r, w = os.pipe()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(r)
+            _work(
+                repo, counts,
+                lambda segment: os.write(w, segment.encode('utf-8') + b'\0'))
+        finally:
+            os._exit(0)
+
+    os.close(w)
+    data = b''
+    finished = False
+    try:
+        while True:
+            timeout = (
+                None if deadline is None
+                else max(0, deadline - time.monotonic()))
+            if not select.select([r], [], [], timeout)[0]:
+                break
+            chunk = os.read(r, io.DEFAULT_BUFFER_SIZE)
+            if not chunk:
+                finished = True
+                break
+            data += chunk
+    finally:
+        os.close(r)
+        if not finished:
+            os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+    # (a segment cut short by the kill has no NUL at the end)
+    return [s.decode('utf-8') for s in data.split(b'\0')[:-1]], finished
+
+
+def _work_in_thread(repo, counts, deadline):
+    """Return the segments ready by the deadline and whether all are."""
+    segments = []
+    worker = threading.Thread(
+        target=_work, args=(repo, counts, segments.append), daemon=True)
+    worker.start()
+    worker.join(None if deadline is None else max(0, deadline - time.monotonic()))
+    return list(segments), not worker.is_alive()
+
+
+def _work(repo, counts, add):
+    try:
+        _segments(repo, counts, add)
+    except Exception:  # (e.g., the repo changed under us) the prompt goes on
+        add('?')
+
+
+def _segments(repo, counts, add):
+    """Work out the segments of the prompt and pass each one to add."""
+    git_repo = repo.git_repo
+    try:
+        curr_b = repo.current_branch
+    except core.DetachedHeadException:
+        add(str(git_repo.head.target)[:7])
+        return
+    add(curr_b.branch_name)
+
+    if curr_b.merge_in_progress:
+        add('(merge)')
+    elif curr_b.fuse_in_progress:
+        add('(fuse)')
+
+    upstream = curr_b.git_branch.upstream
+    if upstream:
+        ahead, behind = git_repo.ahead_behind(
+            curr_b.git_branch.target, upstream.target)
+        add(''.join([
+            '↑{0}'.format(ahead) if ahead else '',
+            '↓{0}'.format(behind) if behind else '']))
+
+    if not counts:
+        add('*' if curr_b.has_modified_files() else '')
+        add('%' if curr_b.has_untracked_files() else '')
+        return
+
+    modified = untracked = 0
+    for f in curr_b.status_list():
+        if f.type == core.GL_STATUS_TRACKED and f.modified:
+            modified += 1
+        elif f.type == core.GL_STATUS_UNTRACKED:
+            untracked += 1
+    add('*{0}'.format(modified) if modified else '')
+    add('%{0}'.format(untracked) if untracked else '')
@@ -4,7 +4,7 @@
 
 """gl publish - Publish commits upstream."""
 
-from . import helpers, pprint
+from . import completers, helpers, pprint
 
 
 def parser(subparsers, _):
@@ -13,7 +13,7 @@ def parser(subparsers, _):
     publish_parser = subparsers.add_parser(
         'publish', help=desc, description=desc.capitalize(), aliases=['pb', 'push'])
     publish_parser.add_argument(
-        'dst', nargs='?', help='the branch where to publish commits')
+        'dst', nargs='?', help='the branch where to publish commits').completer = completers.branches
     publish_parser.set_defaults(func=main)
 
 
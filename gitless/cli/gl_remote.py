@@ -4,7 +4,7 @@
 
 """gl remote - List, create, edit or delete remotes."""
 
-from . import pprint
+from . import completers, pprint
 
 
 def parser(subparsers, _):
@@ -20,15 +20,15 @@ def parser(subparsers, _):
         help='the url of the remote (only relevant if a new remote is created)')
     remote_parser.add_argument(
         '-d', '--delete', nargs='+', help='delete remote(es)', dest='delete_r',
-        metavar='remote')
+        metavar='remote').completer = completers.remotes
     remote_parser.add_argument(
         '-u', '--update', nargs='+', help='update remote URL', dest='update_r',
-        metavar='remote')
+        metavar='remote').completer = completers.remotes
     remote_parser.add_argument(
         '-rn', '--rename', nargs='+',
         help='renames the specified remote: accepts two arguments '
              '(current remote name and new remote name)',
-        dest='rename_r')
+        dest='rename_r').completer = completers.remotes
     remote_parser.set_defaults(func=main)
 
 
@@ -4,11 +4,13 @@
 
 """gl status - Show the status of files in the repo."""
 
+import json
 import os
+import sys
 
 from gitless import core
 
-from . import helpers, pprint
+from . import completers, helpers, pprint
 
 
 def parser(subparsers, repo):
@@ -17,13 +19,66 @@ def parser(subparsers, repo):
     status_parser = subparsers.add_parser(
         'status', help=desc, description=desc.capitalize(), aliases=['st'])
     status_parser.add_argument(
-        'paths', nargs='*', help='the specific path(s) to status',
-        action=helpers.PathProcessor, repo=repo)
+        'paths', nargs='*', help=(
+            'the specific path(s) to status (files or directories)'),
+        action=helpers.PathProcessor, repo=repo,
+        recursive=False).completer = completers.paths
+    status_parser.add_argument(
+        '--cwd', help=(
+            'only show the status of files under the current directory. This '
+            'is the default if the gitless.statusCwdOnly setting is true (and '
+            'no paths are given)'),
+        action='store_true')
+    only_group = status_parser.add_mutually_exclusive_group()
+    only_group.add_argument(
+        '--tracked', help=(
+            'only show tracked files with modifications (faster, since there\'s '
+            'no need to look for untracked files)'),
+        action='store_true')
+    only_group.add_argument(
+        '--untracked', help=(
+            'only show untracked files (faster, since there\'s no need to '
+            'compare the staged content with the head of the branch)'),
+        action='store_true')
+    status_parser.add_argument(
+        '--refresh', help=(
+            'update the stat data in the index of all files that are '
+            'unchanged first, so that the next status only needs to stat them '
+            '(status already does this for the files it looks at unless the '
+            'gitless.refreshIndex setting is false)'),
+        action='store_true')
+    status_parser.add_argument(
+        '--expand', help=(
+            'list each untracked file in directories that only have untracked '
+            'files (by default, only the directory is listed)'),
+        action='store_true')
+    format_group = status_parser.add_mutually_exclusive_group()
+    format_group.add_argument(
+        '--porcelain', help=(
+            'print one line per file, as it is found, in a format meant for '
+            'scripts: two status characters, a space and the path relative to '
+            'the repo root. The first character is T (tracked) or ? '
+            '(untracked). For tracked files the second one is M (modified), A '
+            '(new file), D (deleted) or U (with conflicts); for untracked files '
+            'it is a space, H (exists at head), D (exists at head but not in '
+            'the working directory) or U (with conflicts)'),
+        action='store_true')
+    format_group.add_argument(
+        '--json-lines', help=(
+            'print one JSON object per file, as it is found, with the path '
+            'relative to the repo root and the fields of the status'),
+        action='store_true', dest='json_lines')
     status_parser.set_defaults(func=main)
 
 
 def main(args, repo):
+    if args.refresh:
+        repo.refresh_index()
+
     curr_b = repo.current_branch
+    if args.porcelain or args.json_lines:
+        return _print_machine_status(args, repo, curr_b)
+
     pprint.msg('On branch {0}, repo-directory {1}'.format(
         pprint.green(curr_b.branch_name), pprint.green(repo.root)))
 
@@ -34,16 +89,16 @@ def main(args, repo):
         pprint.blank()
         _print_conflict_exp('fuse')
 
-    tracked_mod_list = []
-    untracked_list = []
-    paths = frozenset(args.paths)
-    for f in curr_b.status():
-        if paths and (f.fp not in paths):
-            continue
-        if f.type == core.GL_STATUS_TRACKED and f.modified:
-            tracked_mod_list.append(f)
-        elif f.type == core.GL_STATUS_UNTRACKED:
-            untracked_list.append(f)
+    # Only the given paths are scanned (directories are scanned recursively)
+    paths = list(args.paths)
+    if not paths and repo.cwd and (args.cwd or _cwd_only_by_default(repo)):
+        paths = [repo.cwd]
+        pprint.exp('only listing files under {0}'.format(repo.cwd))
+
+    # (the statuses are sorted by path)
+    st_list = curr_b.status_list(
+        paths, tracked=not args.untracked, untracked=not args.tracked,
+        untracked_dirs=not args.expand)
 
     relative_paths = True  # git seems to default to true
     try:
@@ -51,17 +106,91 @@ def main(args, repo):
     except KeyError:
         pass
 
-    pprint.blank()
-    tracked_mod_list.sort(key=lambda f: f.fp)
-    _print_tracked_mod_files(tracked_mod_list, relative_paths, repo)
-    pprint.blank()
-    pprint.blank()
-    untracked_list.sort(key=lambda f: f.fp)
-    _print_untracked_files(untracked_list, relative_paths, repo)
+    if not args.untracked:
+        pprint.blank()
+        _print_tracked_mod_files(st_list, relative_paths, repo)
+        pprint.blank()
+    if not args.tracked:
+        pprint.blank()
+        _print_untracked_files(st_list, relative_paths, repo)
     return True
 
 
-def _print_tracked_mod_files(tracked_mod_list, relative_paths, repo):
+def _print_machine_status(args, repo, curr_b):
+    """Print the status for scripts (see --porcelain and --json-lines).
+
+    Files are printed as status finds them (sorted by path) and their paths are
+    relative to the repo root (with '/' as separator).
+    """
+    paths = list(args.paths)
+    if not paths and repo.cwd and (args.cwd or _cwd_only_by_default(repo)):
+        paths = [repo.cwd]
+
+    fmt = _json_line if args.json_lines else _porcelain_line
+    write = sys.stdout.write
+    for f in curr_b.status(
+            paths, tracked=not args.untracked, untracked=not args.tracked,
+            untracked_dirs=not args.expand):
+        if f.type == core.GL_STATUS_UNTRACKED or (
+                f.type == core.GL_STATUS_TRACKED and f.modified):
+            write(fmt(f))
+    return True
+
+
+def _porcelain_line(f):
+    if f.type == core.GL_STATUS_TRACKED:
+        st = 'T' + (
+            'U' if f.in_conflict else
+            'A' if not f.exists_at_head else
+            'D' if not f.exists_in_wd else 'M')
+    else:
+        st = '?' + (
+            'U' if f.in_conflict else
+            ' ' if not f.exists_at_head else
+            'H' if f.exists_in_wd else 'D')
+    return '{0} {1}\n'.format(st, f.fp)
+
+
+def _json_line(f):
+    return json.dumps({
+        'path': f.fp,
+        'type': 'tracked' if f.type == core.GL_STATUS_TRACKED else 'untracked',
+        'exists_at_head': f.exists_at_head,
+        'exists_in_wd': f.exists_in_wd,
+        'in_conflict': f.in_conflict,
+    }) + '\n'
+
+
+def _cwd_only_by_default(repo):
+    try:
+        return repo.config.get_bool('gitless.statusCwdOnly')
+    except KeyError:
+        return False
+
+
+def _relative_path_fn(relative_paths, repo):
+    """Return a function that makes a repo-relative path fit for printing.
+
+    Paths under the current directory only need the prefix stripped, only the
+    rest go through os.path.relpath.
+    """
+    if not relative_paths:
+        return lambda fp: fp
+    root = repo.root
+    prefix = None  # (on Windows, the separator needs to be changed too)
+    if os.sep == '/':
+        prefix = repo.cwd + '/' if repo.cwd else ''
+
+    def relative_path(fp):
+        if prefix is not None and fp.startswith(prefix):
+            return fp[len(prefix):] or './'  # (an untracked dir can be the cwd)
+        ret = os.path.relpath(os.path.join(root, fp))
+        return os.path.join(ret, '') if fp.endswith('/') else ret
+
+    return relative_path
+
+
+def _print_tracked_mod_files(st_list, relative_paths, repo):
     pprint.msg('Tracked files with modifications:')
     pprint.exp('these will be automatically considered for commit')
     pprint.exp(
@@ -71,12 +200,12 @@ def _print_tracked_mod_files(tracked_mod_list, relative_paths, repo):
         'local changes')
     pprint.blank()
 
-    if not tracked_mod_list:
-        pprint.item('There are no tracked files with modifications to list')
-        return
-
-    root = repo.root
-    for f in tracked_mod_list:
+    relative_path = _relative_path_fn(relative_paths, repo)
+    listed = False
+    for f in st_list:
+        if f.type != core.GL_STATUS_TRACKED or not f.modified:
+            continue
+        listed = True
         exp = ''
         color = pprint.yellow
         if not f.exists_at_head:
@@ -89,25 +218,24 @@ def _print_tracked_mod_files(tracked_mod_list, relative_paths, repo):
             exp = ' (with conflicts)'
             color = pprint.cyan
 
-        fp = os.path.relpath(os.path.join(root, f.fp)) if relative_paths else f.fp
-        if fp == '.':
-            continue
+        pprint.item(color(relative_path(f.fp)), opt_text=exp)
 
-        pprint.item(color(fp), opt_text=exp)
+    if not listed:
+        pprint.item('There are no tracked files with modifications to list')
 
 
-def _print_untracked_files(untracked_list, relative_paths, repo):
+def _print_untracked_files(st_list, relative_paths, repo):
     pprint.msg('Untracked files:')
     pprint.exp('these won\'t be considered for commit')
     pprint.exp('use gl track f if you want to track changes to file f')
     pprint.blank()
 
-    if not untracked_list:
-        pprint.item('There are no untracked files to list')
-        return
-
-    root = repo.root
-    for f in untracked_list:
+    relative_path = _relative_path_fn(relative_paths, repo)
+    listed = False
+    for f in st_list:
+        if f.type != core.GL_STATUS_UNTRACKED:
+            continue
+        listed = True
         exp = ''
         color = pprint.blue
         if f.in_conflict:
@@ -120,11 +248,10 @@ def _print_untracked_files(untracked_list, relative_paths, repo):
             else:
                 exp = ' (exists at head but not in working directory)'
 
-        fp = os.path.relpath(os.path.join(root, f.fp)) if relative_paths else f.fp
-        if fp == '.':
-            continue
+        pprint.item(color(relative_path(f.fp)), opt_text=exp)
 
-        pprint.item(color(fp), opt_text=exp)
+    if not listed:
+        pprint.item('There are no untracked files to list')
 
 
 def _print_conflict_exp(op):
@@ -4,7 +4,7 @@
 
 """gl switch - Switch branches."""
 
-from . import pprint
+from . import completers, pprint
 
 
 def parser(subparsers, _):
@@ -12,7 +12,8 @@ def parser(subparsers, _):
     desc = 'switch branches'
     switch_parser = subparsers.add_parser(
         'switch', help=desc, description=desc.capitalize(), aliases=['sw'])
-    switch_parser.add_argument('branch', help='switch to branch')
+    switch_parser.add_argument(
+        'branch', help='switch to branch').completer = completers.branches
     switch_parser.add_argument(
         '-mo', '--move-over',
         help='move uncomitted changes made in the current branch to the '
@@ -6,7 +6,7 @@
 
 from gitless import core
 
-from . import helpers, pprint
+from . import completers, helpers, pprint
 
 
 def parser(subparsers, _):
@@ -28,12 +28,12 @@ def parser(subparsers, _):
     create_group.add_argument(
         '-ci', '--commit',
         help='the commit to tag (only relevant if a new '
-             'tag is created; defaults to the HEAD commit)', dest='ci')
+             'tag is created; defaults to the HEAD commit)', dest='ci').completer = completers.branches
 
     delete_group = tag_parser.add_argument_group('delete tags')
     delete_group.add_argument(
         '-d', '--delete', nargs='+', help='delete tag(s)', dest='delete_t',
-        metavar='tag')
+        metavar='tag').completer = completers.tags
 
     tag_parser.set_defaults(func=main)
 
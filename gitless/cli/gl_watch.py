@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Gitless - a version control system built on top of Git
+# Licensed under MIT
+
+"""gl watch - Watch the working tree to make status faster."""
+
+from gitless import watcher
+
+from . import pprint
+
+
+def parser(subparsers, _):
+    """Adds the watch parser to the given subparsers object."""
+    desc = 'watch the working tree for changes to make status faster'
+    watch_parser = subparsers.add_parser(
+        'watch', help=desc, description=(
+            desc.capitalize() + '. '
+            'While the watcher is running, gl only looks at the files that '
+            'changed since the last time instead of at the whole working tree '
+            '(only supported on Linux)'),
+        aliases=['wt'])
+    watch_parser.add_argument(
+        '--stop', help='stop the watcher of this working tree',
+        action='store_true')
+    watch_parser.set_defaults(func=main)
+
+
+def main(args, repo):
+    if not watcher.is_supported():
+        pprint.err('gl watch is only supported on Linux')
+        return False
+
+    if args.stop:
+        if not watcher.stop(repo.root):
+            pprint.err('No watcher is running for this working tree')
+            return False
+        pprint.ok('Stopped the watcher')
+        return True
+
+    if watcher.changes(repo.root, None) is not None:
+        pprint.err('A watcher is already running for this working tree')
+        return False
+    try:
+        pprint.ok('Watching {0}'.format(repo.root))
+        pprint.exp('do gl watch --stop (or hit Ctrl-C) to stop watching')
+        watcher.serve(repo.root)
+    except watcher.WatcherError as e:
+        pprint.err(e)
+        return False
+    return True
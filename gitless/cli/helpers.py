@@ -5,15 +5,62 @@
 """Some helpers for commands."""
 
 import argparse
+import itertools
 import os
 import subprocess
 import sys
 import shlex
-import shutil
+
+import pygit2
 
 from gitless import core
 
-from . import pprint
+from . import completers, pprint
+
+
+_repo = None
+_repo_opened = False
+
+# How much of the file of --pathspec-from-file is read at a time
+_PATHSPEC_CHUNK_SIZE = 64 * 1024
+
+
+def get_repo():
+    """Return the Gitless repository of the cwd (None if there's none).
+
+    The repository is opened the first time this function is called, and the
+    same object is returned from then on. This way commands that never need the
+    repository don't pay for discovering and opening it.
+    """
+    global _repo_opened
+    if _repo_opened:
+        return _repo
+
+    try:
+        set_repo(core.Repository())
+    except (core.NotInRepoError, core.ShallowCloneException, core.RepoEmptyException):
+        _repo_opened = True
+    return _repo
+
+
+def set_repo(repo):
+    """Make get_repo return the given (already open) repository.
+
+    Used by the gl daemon, which keeps repositories open across commands. If
+    repo is None, the next call to get_repo opens the repository again.
+    """
+    global _repo, _repo_opened
+    _repo = repo
+    _repo_opened = repo is not None
+    if not repo:
+        return
+
+    try:
+        pprint.DISABLE_COLOR = not repo.config.get_bool('color.ui')
+    except pygit2.GitError:
+        pprint.DISABLE_COLOR = repo.config['color.ui'] in ['no', 'never']
+    except KeyError:
+        pass
 
 
 def get_branch(branch_name, repo):
@@ -68,89 +115,218 @@ def get_branch_or_use_upstream(branch_name, arg, repo):
     return ret
 
 
-def page(fp, repo):
-    if not sys.stdout.isatty():  # we are being piped or redirected
-        if sys.platform != 'win32':
-            # Prevent Python from throwing exceptions on SIGPIPE
-            from signal import signal, SIGPIPE, SIG_DFL
-            signal(SIGPIPE, SIG_DFL)
-        # memory-friendly way to output contents of file to stdout
-        with open(fp, 'r') as f:
-            shutil.copyfileobj(f, sys.stdout)
-        return
+class Pager(object):
+    """Where the output of a command that is to be paged goes.
 
-    # On Windows, we need to call 'more' through cmd.exe (with 'cmd'). The /C is
-    # so that the command window gets closed after 'more' finishes
-    default_pager = 'less' if sys.platform != 'win32' else 'cmd /C more'
-    try:
-        pager = repo.config['core.pager']
-    except KeyError:
-        pager = ''  # empty string will evaluate to False below
-    pager = pager or os.environ.get('PAGER', None) or default_pager
-    cmd = shlex.split(pager)  # split into constituents
-    if os.path.basename(cmd[0]) == 'less':
-        cmd.extend(['-r', '-f'])  # append arguments
-    with open(fp, "rb") as f:
-        data = f.read()
+    Used as a context manager, its write method is what the output is written
+    with (e.g., the stream of pprint's functions). The pager is started with
+    the first write and gets the output through a pipe as it's produced. If
+    stdout is not a terminal, the output is written straight to stdout.
 
-    try:
-        p = subprocess.Popen(cmd, stdout=sys.stdout, stdin=subprocess.PIPE, stderr=sys.stderr)
-        stdout_data, stderr_data = p.communicate(input=data)
+    If the pager exits before all the output was written (e.g., the user
+    quit it), the next write raises BrokenPipeError. That stops whatever is
+    producing the output, and the error is swallowed on exit.
+    """
 
-        if p.returncode != 0:
-            pprint.err('Call to pager {0} failed'.format(pager))
-    except OSError:
-        pprint.err('Couldn\'t launch pager {0}'.format(pager))
-        pprint.err_exp('change the value of git\'s core.pager setting')
+    def __init__(self, repo):
+        self.repo = repo
+        self._proc = None
+        if sys.stdout.isatty():
+            self.write = self._write_to_pager
+        else:  # we are being piped or redirected
+            if sys.platform != 'win32':
+                # Prevent Python from throwing exceptions on SIGPIPE
+                from signal import signal, SIGPIPE, SIG_DFL
+                signal(SIGPIPE, SIG_DFL)
+            self.write = sys.stdout.write
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._proc:
+            try:
+                self._proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            self._proc.wait()
+            if self._proc.returncode != 0:
+                pprint.err('Call to pager {0} failed'.format(self._pager))
+        return exc_type is not None and issubclass(exc_type, BrokenPipeError)
+
+    def _write_to_pager(self, s):
+        if not self._proc:
+            try:
+                self._proc = self._start()
+            except OSError:
+                pprint.err('Couldn\'t launch pager {0}'.format(self._pager))
+                pprint.err_exp('change the value of git\'s core.pager setting')
+                self.write = sys.stdout.write
+                self.write(s)
+                return
+        self._proc.stdin.write(s)
+
+    def _start(self):
+        # On Windows, we need to call 'more' through cmd.exe (with 'cmd'). The /C
+        # is so that the command window gets closed after 'more' finishes
+        default_pager = 'less' if sys.platform != 'win32' else 'cmd /C more'
+        try:
+            pager = self.repo.config['core.pager']
+        except KeyError:
+            pager = ''  # empty string will evaluate to False below
+        self._pager = pager or os.environ.get('PAGER', None) or default_pager
+        cmd = shlex.split(self._pager)  # split into constituents
+        if os.path.basename(cmd[0]) == 'less':
+            cmd.extend(['-r', '-f'])  # append arguments
+        return subprocess.Popen(
+            cmd, stdout=sys.stdout, stdin=subprocess.PIPE, stderr=sys.stderr,
+            universal_newlines=True)
 
 
 class PathProcessor(argparse.Action):
 
     def __init__(
-            self, option_strings, dest, repo=None, skip_dir_test=None,
-            skip_dir_cb=None, recursive=True, **kwargs):
+            self, option_strings, dest, repo=None, skip_dir_cb=None,
+            recursive=True, walk_filter=None, pathspec_from_file=False,
+            **kwargs):
+        """Create the action.
+
+        Args:
+          skip_dir_cb: called with each ignored dir that is not entered.
+          recursive: if True, the files under the dirs given are processed
+            instead of the dirs.
+          walk_filter: which of the files under the dirs given to process
+            (the keyword args of Repository.walk_files, e.g., {'tracked':
+            False} for untracked files only). The files given are always
+            processed.
+          pathspec_from_file: if True, the paths in the file given with
+            --pathspec-from-file (see pathspec_from_file_flags) are processed
+            too, after the ones in the command line.
+        """
         self.repo = repo
-        self.skip_dir_test = skip_dir_test
         self.skip_dir_cb = skip_dir_cb
         self.recursive = recursive
+        self.walk_filter = walk_filter or {}
+        self.pathspec_from_file = pathspec_from_file
+        # With the paths in a file, there might be none in the command line.
+        # That there's at least one is checked once the file is known
+        self.paths_required = pathspec_from_file and kwargs.get('nargs') == '+'
+        if self.paths_required:
+            kwargs['nargs'] = '*'
         super(PathProcessor, self).__init__(option_strings, dest, **kwargs)
 
     def __call__(self, parser, namespace, paths, option_string=None):
-        root = self.repo.root if self.repo else ''
-        repo_path = self.repo.path if self.repo else ''
+        repo = self.repo or get_repo()
+        root = repo.root if repo else ''
+        root_prefix = os.path.join(os.path.abspath(root), '')
+        repo_path = repo.path if repo else ''
         # We add the sep so that we can use `startswith` to determine if a file
         # is inside the .git folder
         # `normpath` is important because libgit2 returns the repo_path with forward
         # slashes on Windows
         normalized_repo_path = os.path.normpath(repo_path) + os.path.sep
 
+        def all_paths():
+            """The paths given (read lazily, once all args were parsed).
+
+            Raises ValueError (and not a parser error, that would exit) if
+            they are wrong, since by then the command is already running.
+            """
+            from_file = (
+                getattr(namespace, 'pathspec_from_file', None)
+                if self.pathspec_from_file else None)
+            if not from_file:
+                if self.paths_required and not paths:
+                    raise ValueError(
+                        'the following arguments are required: {0}'.format(
+                            self.metavar or self.dest))
+                return paths
+            try:
+                return itertools.chain(paths, read_pathspec_file(
+                    from_file, namespace.pathspec_file_nul))
+            except OSError as e:
+                raise ValueError('can\'t read {0}: {1}'.format(from_file, e))
+
         def process_paths():
-            for path in paths:
+            for path in all_paths():
                 path = os.path.abspath(path)
+                if (path + os.path.sep).startswith(normalized_repo_path):
+                    continue
                 # Treat symlinks as normal files, even if the link points to a
                 # directory. The directory could be outside of the repo, then things
                 # get weird... This is standard git behavior.
-                if self.recursive and os.path.isdir(path) and not os.path.islink(path):
-                    for curr_dir, dirs, fps in os.walk(path, topdown=True):
-                        if curr_dir.startswith(normalized_repo_path):
-                            dirs[:] = []
-                            continue
-                        curr_dir_rel = os.path.relpath(curr_dir, root)
-                        if (curr_dir_rel != "." and self.skip_dir_test and
-                                self.skip_dir_test(curr_dir_rel)):
-                            if self.skip_dir_cb:
-                                self.skip_dir_cb(curr_dir_rel)
-                            dirs[:] = []
-                            continue
-                        for fp in fps:
-                            yield fp if curr_dir_rel == '.' else os.path.join(curr_dir_rel, fp)
+                if (repo and self.recursive and os.path.isdir(path) and
+                        not os.path.islink(path)):
+                    for fp in repo.walk_files(
+                            os.path.relpath(path, root),
+                            ignored_dir_cb=self.skip_dir_cb, **self.walk_filter):
+                        yield fp
+                elif path.startswith(root_prefix):  # (cheaper than relpath)
+                    yield path[len(root_prefix):]
                 else:
-                    if not path.startswith(normalized_repo_path):
-                        yield os.path.relpath(path, root)
+                    yield os.path.relpath(path, root)
 
         setattr(namespace, self.dest, process_paths())
 
 
+def pathspec_from_file_flags(subparser):
+    """Add the flags to read the paths from a file (or stdin) to subparser.
+
+    For the paths that don't fit in the command line (e.g., when they come
+    from another program). The paths are processed by the PathProcessor
+    created with pathspec_from_file=True.
+    """
+    subparser.add_argument(
+        '--pathspec-from-file', help=(
+            'also read the file(s) from the given file (- for the standard '
+            'input), one per line'),
+        metavar='file')
+    subparser.add_argument(
+        '--pathspec-file-nul', help=(
+            'the files read with --pathspec-from-file are separated with NUL '
+            'characters instead of newlines'),
+        action='store_true')
+
+
+def read_pathspec_file(fp, nul=False):
+    """Return a generator of the paths in the file at fp (- for stdin).
+
+    Paths are separated with newlines, or NUL characters if nul is True. The
+    file is opened right away (so that errors are raised) and then read as
+    the paths are consumed, so that they can be processed as they come.
+    """
+    f = sys.stdin.buffer if fp == '-' else open(fp, 'rb')
+
+    def paths():
+        sep = b'\0' if nul else b'\n'
+        rest = b''
+        try:
+            while True:
+                chunk = f.read1(_PATHSPEC_CHUNK_SIZE)
+                if not chunk:
+                    break
+                chunk = rest + chunk
+                end = chunk.rfind(sep)
+                if end < 0:
+                    rest = chunk
+                    continue
+                rest = chunk[end + 1:]
+                for path in chunk[:end].split(sep):
+                    if not nul:
+                        path = path.rstrip(b'\r')
+                    if path:
+                        yield os.fsdecode(path)
+            if rest and not nul:
+                rest = rest.rstrip(b'\r')
+            if rest:
+                yield os.fsdecode(rest)
+        finally:
+            if f is not sys.stdin.buffer:
+                f.close()
+
+    return paths()
+
+
 class CommitIdProcessor(argparse.Action):
 
     def __init__(self, option_strings, dest, repo=None, **kwargs):
@@ -158,7 +334,7 @@ class CommitIdProcessor(argparse.Action):
         super(CommitIdProcessor, self).__init__(option_strings, dest, **kwargs)
 
     def __call__(self, parser, namespace, revs, option_string=None):
-        cids = (self.repo.revparse_single(rev).id for rev in revs)
+        cids = ((self.repo or get_repo()).revparse_single(rev).id for rev in revs)
         setattr(namespace, self.dest, cids)
 
 
@@ -166,15 +342,17 @@ def oei_flags(subparsers, repo):
     subparsers.add_argument(
         'only', nargs='*',
         help='use only files given (tracked modified or untracked)',
-        action=PathProcessor, repo=repo, metavar='file')
+        action=PathProcessor, repo=repo, metavar='file',
+        pathspec_from_file=True).completer = completers.paths
+    pathspec_from_file_flags(subparsers)
     subparsers.add_argument(
         '-e', '--exclude', nargs='+',
         help='exclude files given (files must be tracked modified)',
-        action=PathProcessor, repo=repo, metavar='file')
+        action=PathProcessor, repo=repo, metavar='file').completer = completers.paths
     subparsers.add_argument(
         '-i', '--include', nargs='+',
         help='include files given (files must be untracked)',
-        action=PathProcessor, repo=repo, metavar='file')
+        action=PathProcessor, repo=repo, metavar='file').completer = completers.paths
 
 
 def oei_fs(args, repo):
@@ -190,10 +368,10 @@ def oei_fs(args, repo):
     if only:
         ret = only
     else:
-        # Tracked modified files
+        # Tracked modified files (no need to look for untracked files)
         ret = frozenset(
-            f.fp for f in curr_b.status()
-            if f.type == core.GL_STATUS_TRACKED and f.modified)  # using generator expression
+            f.fp for f in curr_b.status(untracked=False)
+            if f.modified)  # using generator expression
         # We get the files from status with forward slashes. On Windows, these
         # won't match the paths provided by the user, which are normalized by
         # PathProcessor
@@ -222,6 +400,8 @@ def _oei_validate(only, exclude, include, curr_b):
         return False
 
     err = []
+    # The status of all files is looked up at once
+    statuses = curr_b.status_files(only | exclude | include)
 
     def validate(fps, check_fn, msg):
         ''' fps: files
@@ -232,15 +412,13 @@ def _oei_validate(only, exclude, include, curr_b):
         if not fps:
             return ret
         for fp in fps:
-            try:
-                f = curr_b.status_file(fp)
-            except KeyError:
+            f = statuses.get(fp)
+            if not f:
                 err.append('File {0} doesn\'t exist'.format(fp))
                 ret = False  # set error flag, but keep assessing other files
-            else:  # executed after "try", exception will be ignored here
-                if not check_fn(f):
-                    err.append(msg(fp))  # dynamic string formatting
-                    ret = False
+            elif not check_fn(f):
+                err.append(msg(fp))  # dynamic string formatting
+                ret = False
         return ret
 
     only_valid = validate(
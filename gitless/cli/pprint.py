@@ -145,7 +145,10 @@ def conf_dialog(text):
       True if the user confirmed she wanted to continue or False if otherwise.
     """
     msg('{0}. Do you wish to continue? (y/N)'.format(text))
-    user_input = get_user_input()
+    try:
+        user_input = get_user_input()
+    except EOFError:  # (e.g., the files were read from stdin) it's a no
+        user_input = ''
     return user_input and user_input[0].lower() == 'y'
 
 
@@ -4,19 +4,27 @@
 
 """Gitless library."""
 
+import array
 import collections
 import errno
+import heapq
 import io
 import itertools
 import json
 import os
 import re
 import shutil
+import stat
 import sys
 from locale import getpreferredencoding
 from subprocess import run, CalledProcessError
 
 import pygit2
+from pygit2 import ffi as _ffi, C as _C
+from pygit2.errors import check_error as _check_error
+from pygit2.utils import to_bytes as _to_bytes
+
+from gitless import ignore, index_file, stat_scan, untracked_cache, watcher
 
 ENCODING = getpreferredencoding() or 'utf-8'
 
@@ -53,6 +61,15 @@ GL_STATUS_UNTRACKED = 1
 GL_STATUS_TRACKED = 2
 GL_STATUS_IGNORED = 3
 
+# The Git status of the last time the watcher was used, see
+# Repository._watched_status
+WATCHER_STATE_FILE = 'GL_WATCHER_STATE'
+# Past this many changed paths, doing a full status is faster
+_MAX_WATCHED_PATHS = 1000
+# Past this many files that might have been modified, having libgit2 look at
+# the whole working tree is faster than giving it the list
+_MAX_STAT_SCAN_PATHS = 1000
+
 
 def init_repository(url=None, only=None, exclude=None):
     """Creates a new Gitless repository in the cwd.
@@ -111,6 +128,10 @@ class Repository(object):
       config: the repository's configuration.
       current_branch: the current branch (a Branch object).
       remotes: the configured remotes (see RemoteCollection).
+      index_session: Git's index (see IndexSession).
+      read_only: if True, status doesn't write to the Git dir (the stat data
+        of the index isn't refreshed and the untracked cache and the watcher
+        state are not updated). For work that might be killed midway.
     """
 
     def __init__(self):
@@ -124,6 +145,12 @@ class Repository(object):
         self.path = self.git_repo.path
         self.root = self.git_repo.workdir
         self.config = self.git_repo.config
+        # (index stamp, assumed unchanged files), see _au_files
+        self._au_cache = (None, frozenset())
+        # (index stamp, all paths in the index), see _untracked_files
+        self._index_paths_cache = (None, frozenset())
+        self._index_session = None  # see index_session
+        self.read_only = False
 
         if self.git_repo.is_shallow:
             raise ShallowCloneException("Gitless is not compatible with shallow clones or with --depth specified.")
@@ -162,6 +189,318 @@ class Repository(object):
         except KeyError:
             raise GlError('No common commit found between {0} and {1}'.format(b1, b2))
 
+    def _au_files(self):
+        """Return the set of files marked as assumed unchanged in the index.
+
+        The index is only read again if it changed since the last call.
+        """
+        index_fp = os.path.join(self.path, 'index')
+        stamp = index_file.stamp(index_fp)
+        if stamp is None or stamp != self._au_cache[0]:
+            try:
+                au_files = index_file.assumed_unchanged(index_fp)
+            except ValueError:  # an index we can't read, Git can
+                # (the tag of an assumed unchanged file is in lowercase)
+                au_files = [
+                    f_out[2:] for f_out in
+                    git('ls-files', '-v', '-z', cwd=self.root).split('\0')
+                    if f_out and f_out[0].islower()]
+            self._au_cache = (stamp, frozenset(au_files))
+        return self._au_cache[1]
+
+    def _git_status(self, git_paths, tracked, untracked):
+        """Return the Git status (path -> pygit2 status) of the given paths.
+
+        See Branch.status for the args.
+        """
+        return dict(self._git_status_items(git_paths, tracked, untracked))
+
+    def _git_status_items(self, git_paths, tracked, untracked):
+        """Generate the (path, Git status) pairs of _git_status sorted by path.
+
+        The pairs come as libgit2 diffs (see _git_status_items), so no status
+        of the whole working tree is built (and sorted) before the first one.
+        """
+        git_repo = self.git_repo
+        untracked_fps = None
+        if git_paths is None and untracked and _pathspec_diff:
+            untracked_fps = self._untracked_files()
+        if untracked_fps is None:
+            if git_paths is None and tracked and not untracked:
+                return self._tracked_status_items()
+            return _git_status_items(
+                git_repo, git_paths, tracked, untracked,
+                refresh=tracked and self._status_refreshes_index())
+
+        # libgit2 doesn't need to look for untracked files, we have them
+        tracked_items = self._tracked_status_items() if tracked else iter([])
+        head_tree = None if tracked else git_repo.head.peel().tree
+        return _with_untracked(tracked_items, untracked_fps, head_tree)
+
+    def _tracked_status_items(self):
+        """Generate the Git status of the files in the index (sorted by path).
+
+        If gitless.statusWorkers is set (to the number of threads to use), the
+        stat data of the index entries is checked against the working tree in
+        parallel (see stat_scan) and libgit2 only looks at the files that might
+        have been modified. Otherwise, libgit2 looks at every file in the index
+        (one after the other).
+
+        Unless gitless.refreshIndex is false, the stat data of the files found
+        unchanged is updated in the index (see _git_status).
+        """
+        wd_paths = None
+        workers = self._config_int('gitless.statusWorkers', 0)
+        if workers > 0:
+            wd_paths = self._stat_scan(workers)
+        return _git_status_items(
+            self.git_repo, tracked=True, untracked=False, wd_paths=wd_paths,
+            refresh=self._status_refreshes_index())
+
+    def refresh_index(self):
+        """Update the stat data in the index of the files that are unchanged.
+
+        Files whose stat data doesn't match the working tree (e.g., after a
+        build touched them) have to be compared by content on each status.
+        Once refreshed, a stat is enough. The index is written back under its
+        lock (and replaced atomically).
+        """
+        index = self.git_repo.index
+        try:
+            index.read(False)
+            index.diff_to_workdir(pygit2.GIT_DIFF_UPDATE_INDEX)
+        except pygit2.GitError as e:
+            raise GlError('Couldn\'t refresh the index: {0}'.format(e))
+
+    def walk_files(
+            self, path, tracked=None, in_conflict=False, ignored_dir_cb=None):
+        """Return a generator of the files under the dir at path.
+
+        Paths are relative to the repo root (path too). Ignored dirs are not
+        entered, ignored_dir_cb (if given) is called with each of them instead.
+        The ignore rules are matched in-process (see ignore), so this is much
+        faster than asking libgit2 about each dir.
+
+        Args:
+          path: the dir to walk.
+          tracked: if True, only tracked files are yielded; if False, only
+            untracked files (that are not ignored). If None, all files are.
+          in_conflict: if True, only files in conflict are yielded.
+        """
+        _check_path_is_repo_relative(path)
+        git_path = _get_git_path(os.path.normpath(path))
+        git_path = '' if git_path == '.' else git_path
+        if self._config_bool('core.ignoreCase', False):
+            # The ignore rules are matched case-sensitively, so ask libgit2
+            path_is_ignored = self.git_repo.path_is_ignored
+            matcher = lambda rel_dir: lambda name, is_dir: path_is_ignored(
+                rel_dir + '/' + name if rel_dir else name)
+        else:
+            matcher = ignore.Rules(self.root, self._exclude_fps()).matcher
+
+        # Is the dir itself (or one of its parents) ignored?
+        parts = git_path.split('/') if git_path else []
+        for i, name in enumerate(parts):
+            if name == '.git':
+                return
+            if matcher('/'.join(parts[:i]))(name, True):
+                if ignored_dir_cb:
+                    ignored_dir_cb(path)
+                return
+
+        keep = None
+        if tracked is not None or in_conflict:
+            try:
+                index_paths = self._index_paths()
+            except ValueError:  # an index we can't read
+                index_paths = frozenset(e.path for e in self.git_repo.index)
+            au_fps = self._au_files()
+            if in_conflict:
+                conflicts = frozenset(
+                    next(e for e in entries if e).path
+                    for entries in self.index_session.conflicts or [])
+                keep = lambda fp: fp in conflicts
+            elif tracked:
+                keep = lambda fp: fp in index_paths and fp not in au_fps
+            else:  # (the ignored files are left out by the walk)
+                keep = lambda fp: fp not in index_paths or fp in au_fps
+
+        to_path = (lambda fp: fp) if os.sep == '/' else os.path.normpath
+        for fp in ignore.walk(
+                self.root, git_path, matcher, ignored_files=tracked is not False,
+                ignored_dir_cb=ignored_dir_cb and (
+                    lambda fp: ignored_dir_cb(to_path(fp)))):
+            if keep is None or keep(fp):
+                yield to_path(fp)
+
+    def _stat_scan(self, workers):
+        """Return the files in the index that might have been modified.
+
+        None is returned if it's best to have libgit2 look at every file.
+        """
+        changed = self._stat_changed_paths(workers)
+        if changed is None or len(changed) > _MAX_STAT_SCAN_PATHS:
+            return None
+        return changed
+
+    def _stat_changed_paths(self, workers):
+        """Return the files in the index whose stat data doesn't match.
+
+        See stat_scan.changed_paths. None is returned if the index can't be
+        read.
+        """
+        index_fp = os.path.join(self.path, 'index')
+        try:
+            index_mtime_ns = os.stat(index_fp).st_mtime_ns
+            entries = index_file.stat_entries(index_fp)
+        except (OSError, ValueError):  # no index or an index we can't read
+            return None
+        return stat_scan.changed_paths(
+            self.root, entries, index_mtime_ns, workers,
+            trust_ctime=self._config_bool('core.trustctime', True),
+            trust_mode=self._config_bool('core.fileMode', True))
+
+    def _watched_status(self):
+        """Return the Git status of the whole working tree using the watcher.
+
+        The status of the last time (and the watcher token of when it was
+        done) is kept in the Git dir. If the index, HEAD and the ignore files
+        that are not in the working tree didn't change since then, only the
+        paths the watcher says changed are looked at. None is returned if
+        there's no watcher running for this working tree.
+        """
+        state_fp = os.path.join(self.path, WATCHER_STATE_FILE)
+        try:
+            with io.open(state_fp, mode='r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            state = {}
+        reply = watcher.changes(self.root, state.get('token'))
+        if reply is None:
+            return None
+
+        token, paths = reply
+        key = self._watched_status_key()
+        if (paths is None or state.get('key') != key or
+                len(paths) > _MAX_WATCHED_PATHS or
+                any(p.rpartition('/')[2] == '.gitignore' for p in paths)):
+            git_sts = dict(self._git_status(None, True, True))
+        else:
+            git_sts = state['status']
+            if paths:
+                changed = set(paths)
+
+                def is_changed(fp):
+                    fp = fp.rstrip('/')
+                    while fp:
+                        if fp in changed:
+                            return True
+                        fp = fp.rpartition('/')[0]
+                    return False
+
+                git_sts = {
+                    fp: st for fp, st in git_sts.items() if not is_changed(fp)}
+                git_sts.update(_git_status(self.git_repo, sorted(changed)))
+
+        if not self.read_only and (
+                token != state.get('token') or key != state.get('key') or
+                paths):
+            try:
+                tmp_fp = state_fp + '.tmp'
+                with io.open(tmp_fp, mode='w', encoding='utf-8') as f:
+                    f.write(json.dumps(
+                        {'token': token, 'key': key, 'status': git_sts}))
+                os.replace(tmp_fp, state_fp)
+            except (IOError, OSError):
+                pass  # the state is just an optimization
+        return git_sts
+
+    def _watched_status_key(self):
+        """Return what, if it changes, makes the watched status invalid."""
+        head = self.git_repo.head
+        # (lists instead of tuples so that it can be compared to the one that
+        # comes from the state file)
+        return [
+            head.name, str(head.target),
+            [_file_stamp(fp) for fp in
+             [os.path.join(self.path, 'index')] + self._exclude_fps()]]
+
+    def _untracked_files(self):
+        """Return an iterator of the untracked files in the working tree.
+
+        The result comes from the untracked cache (see untracked_cache). None
+        is returned if the cache can't be used for this repo.
+        """
+        if not self._config_bool('gitless.untrackedCache', True):
+            return None
+        if self._config_bool('core.ignoreCase', False):
+            return None  # the ignore rules are matched case-sensitively
+
+        stamp = index_file.stamp(os.path.join(self.path, 'index'))
+        try:
+            return untracked_cache.untracked_files(
+                self.root, self.path, self._exclude_fps(), stamp,
+                self._index_paths, write=not self.read_only)
+        except ValueError:  # an index we can't read
+            return None
+
+    def _index_paths(self):
+        """Return the set of paths in the index.
+
+        The index is only read again if it changed since the last call. Raises
+        ValueError if the index can't be read (see index_file.paths).
+        """
+        index_fp = os.path.join(self.path, 'index')
+        stamp = index_file.stamp(index_fp)
+        if stamp is None or stamp != self._index_paths_cache[0]:
+            self._index_paths_cache = (
+                stamp, frozenset(index_file.paths(index_fp)))
+        return self._index_paths_cache[1]
+
+    def _index_dirs(self):
+        """Return the set of dirs that have files in the index.
+
+        Paths are relative to the repo root and use '/' as separator.
+        """
+        try:
+            paths = self._index_paths()
+        except ValueError:  # an index we can't read
+            paths = [e.path for e in self.git_repo.index]
+        dirs = set()
+        for fp in paths:
+            fp = fp.rpartition('/')[0]
+            while fp and fp not in dirs:
+                dirs.add(fp)
+                fp = fp.rpartition('/')[0]
+        return dirs
+
+    def _exclude_fps(self):
+        """Return the ignore files that apply to the whole working tree."""
+        common_dir = self.path
+        commondir_fp = os.path.join(self.path, 'commondir')
+        if os.path.isfile(commondir_fp):  # a linked worktree
+            with io.open(commondir_fp, mode='r', encoding='utf-8') as f:
+                common_dir = os.path.join(self.path, f.read().strip())
+        try:
+            excludes_fp = os.path.expanduser(self.config['core.excludesFile'])
+        except KeyError:
+            config_home = os.environ.get('XDG_CONFIG_HOME') or os.path.join(
+                os.path.expanduser('~'), '.config')
+            excludes_fp = os.path.join(config_home, 'git', 'ignore')
+        return [os.path.join(common_dir, 'info', 'exclude'), excludes_fp]
+
+    def _config_bool(self, key, default):
+        try:
+            return self.config.get_bool(key)
+        except KeyError:
+            return default
+
+    def _config_int(self, key, default):
+        try:
+            return self.config.get_int(key)
+        except KeyError:
+            return default
+
     def _fuse_commits_fp(self, b):
         return os.path.join(
             self.path, 'GL_FUSE_CIS_{0}'.format(b.branch_name.replace('/', '_')))
@@ -315,25 +654,22 @@ class Repository(object):
 
                 # Save conflict info
                 conf_info = {}
-                index = git_repo.index
-                index.read()
-                if index.conflicts:
-                    extract = lambda e: {'mode': e.mode, 'id': str(e.id), 'path': e.path}
-                    for ancestor, ours, theirs in index.conflicts:
-                        if ancestor:
-                            path = ancestor.path
-                            ancestor = extract(ancestor)
-                        if theirs:
-                            path = theirs.path
-                            theirs = extract(theirs)
-                        if ours:
-                            path = ours.path
-                            ours = extract(ours)
-
-                        conf_info[path] = {ANCESTOR: ancestor, THEIRS: theirs, OURS: ours}
-                        index.add(path)
-
-                    index.write()
+                with self.index_session as index:
+                    if index.conflicts:
+                        extract = lambda e: {'mode': e.mode, 'id': str(e.id), 'path': e.path}
+                        for ancestor, ours, theirs in index.conflicts:
+                            if ancestor:
+                                path = ancestor.path
+                                ancestor = extract(ancestor)
+                            if theirs:
+                                path = theirs.path
+                                theirs = extract(theirs)
+                            if ours:
+                                path = ours.path
+                                ours = extract(ours)
+
+                            conf_info[path] = {ANCESTOR: ancestor, THEIRS: theirs, OURS: ours}
+                            index.add(path)
                 body[CONF_INFO] = conf_info
 
                 # Save ref info
@@ -426,6 +762,129 @@ class Repository(object):
         git_repo.checkout(dst_b.git_branch)
         restore(dst_b)
 
+    @property
+    def index_session(self):
+        """The index session of this repository (see IndexSession)."""
+        if not self._index_session:
+            self._index_session = IndexSession(self.git_repo)
+        return self._index_session
+
+    def _status_refreshes_index(self):
+        """Return True if the status diffs can update the stat data of the index.
+
+        Not during an index transaction: the diff would write the changes
+        waiting to be written, and the index session would then find the index
+        modified under it. Not if the repo is read only either.
+        """
+        session = self._index_session
+        return (
+            not self.read_only and
+            self._config_bool('gitless.refreshIndex', True) and
+            not (session and (session.in_transaction or session.changed)))
+
+
+class IndexSession(object):
+    """Git's index, loaded once and shared by all operations on a repository.
+
+    Changes are made in a transaction (using the session as a context manager,
+    transactions can be nested) and written out once, when the outermost
+    transaction ends. If nothing changed, nothing is written. If someone else
+    wrote the index in the meantime (its checksum on disk is not the one of
+    the index we loaded), the changes are discarded and GlError is raised
+    instead of overwriting theirs.
+
+    Outside transactions, the index is brought up to date with the one on
+    disk before it is used (which is only read again if it changed).
+
+    Attributes:
+      changed: True if there are changes waiting to be written.
+    """
+
+    # The methods of pygit2's Index that change it
+    _CHANGE_METHODS = frozenset([
+        'add', 'add_all', 'clear', 'read_tree', 'remove', 'remove_all',
+        'update_all'])
+
+    def __init__(self, git_repo):
+        self._git_index = git_repo.index
+        self._index_fp = os.path.join(git_repo.path, 'index')
+        self._checksum = None  # of the index file we loaded
+        self._depth = 0
+        self.changed = False
+
+    def __enter__(self):
+        if not self.in_transaction:
+            self._load()
+        self._depth += 1
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self._depth -= 1
+        if self._depth:
+            return
+        if value:
+            self.discard()
+        else:
+            self.write()
+
+    def __getattr__(self, name):
+        attr = getattr(self._loaded(), name)
+        if name in self._CHANGE_METHODS:
+            self.changed = True
+        return attr
+
+    def __contains__(self, path):
+        return path in self._loaded()
+
+    def __getitem__(self, key):
+        return self._loaded()[key]
+
+    def __iter__(self):
+        return iter(self._loaded())
+
+    def __len__(self):
+        return len(self._loaded())
+
+    @property
+    def in_transaction(self):
+        return self._depth > 0
+
+    def mark_changed(self):
+        """Note a change made to the index other than with its methods."""
+        self.changed = True
+
+    def write(self):
+        """Write the index if it changed (see above)."""
+        if not self.changed:
+            return
+        if index_file.checksum(self._index_fp) != self._checksum:
+            self.discard()
+            raise GlError(
+                'The index was modified by another process, try again')
+        self._git_index.write()
+        self._checksum = index_file.checksum(self._index_fp)
+        self.changed = False
+
+    def discard(self):
+        """Discard the changes that haven't been written."""
+        if self.changed:
+            self.changed = False
+            self._checksum = index_file.checksum(self._index_fp)
+            self._git_index.read(True)
+
+    def _load(self):
+        if self.changed:  # (the changes would be lost)
+            return
+        # Taken before reading, so that if the index changes while we read it
+        # we err on the side of finding it modified when writing
+        self._checksum = index_file.checksum(self._index_fp)
+        self._git_index.read(False)
+
+    def _loaded(self):
+        if not self.in_transaction:
+            self._load()
+        return self._git_index
+
 
 class RemoteCollection(object):
 
@@ -743,26 +1202,8 @@ class Branch(object):
 
     @property
     def _index(self):
-        """Convenience wrapper of Git's index."""
-
-        class Index(object):
-
-            def __init__(self, git_index):
-                self._git_index = git_index
-                self._git_index.read()
-
-            def __enter__(self):
-                return self
-
-            def __exit__(self, type, value, traceback):
-                if not value:  # no exception
-                    self._git_index.write()
-                    return True
-
-            def __getattr__(self, name):
-                return getattr(self._git_index, name)
-
-        return Index(self.gl_repo.git_repo.index)
+        """The index session of the repository (see IndexSession)."""
+        return self.gl_repo.index_session
 
     _st_map = {
         # git status: gl status, exists_at_head, exists_in_wd, modified, conflict
@@ -809,43 +1250,238 @@ class Branch(object):
             'in_conflict'])
 
     def _au_files(self):
-        for f_out in git('ls-files', '-v', cwd=self.gl_repo.root).splitlines():
-            if f_out[0] == 'h':
-                yield f_out[2:].strip()
-
-    def status(self):
+        return self.gl_repo._au_files()
+
+    # Codes (next to the Git statuses of _st_map) of what status reports
+    # without Git: assumed unchanged files (see _status_codes)
+    _ST_AU = 1 << 16
+    _ST_AU_NOT_IN_WD = 1 << 17
+
+    def _st_fields(self, code):
+        """Return the FileStatus fields (but fp) for the given status code."""
+        if code == self._ST_AU:
+            return GL_STATUS_UNTRACKED, True, True, True, False
+        if code == self._ST_AU_NOT_IN_WD:
+            return GL_STATUS_UNTRACKED, True, False, True, False
+        return self._st_map[code]
+
+    def status(self, paths=None, tracked=True, untracked=True,
+               untracked_dirs=False):
         """Return a generator of file statuses (see FileStatus).
 
         Ignored and tracked unmodified files are not reported.
-        File paths are always relative to the repo root.
+        File paths are always relative to the repo root, and files are reported
+        sorted by path.
+
+        Args:
+          paths: if given, only the files at these paths (relative to the repo
+            root) are reported. A path can be a file or a directory (all files
+            under it are reported), and only these paths are scanned.
+          tracked: if False, tracked files are not reported (and the index is
+            not diffed against HEAD).
+          untracked: if False, untracked files are not reported (and the
+            working tree is not searched for files that are not in the index).
+          untracked_dirs: if True, a directory with no files in the index is
+            reported as a single untracked file (with its path ending in '/')
+            instead of reporting each of the untracked files under it.
         """
-        try:
-            for fp, git_s in self.gl_repo.git_repo.status().items():
-                yield self.FileStatus(fp, *self._st_map[git_s])
-        except KeyError as e:
-            raise
+        for fp, code in self._status_codes(
+                paths, tracked, untracked, untracked_dirs):
+            yield self.FileStatus(fp, *self._st_fields(code))
+
+    def status_list(self, paths=None, tracked=True, untracked=True,
+                    untracked_dirs=False):
+        """Return the file statuses as a StatusList.
+
+        Same as list(status(...)) (see status for the args), but the result
+        takes a fraction of the memory, which matters for huge result sets
+        (e.g., a repo with millions of untracked files).
+        """
+        return StatusList(
+            self._status_codes(paths, tracked, untracked, untracked_dirs),
+            self.FileStatus, self._st_fields)
+
+    def _status_codes(self, paths, tracked, untracked, untracked_dirs):
+        """Generate the (path, status code) of the files status reports.
+
+        Codes are the Git statuses of _st_map or _ST_AU*. See status for the
+        args.
+        """
+        git_paths = _pathspec(paths)
+        # The watcher has the status of the whole working tree. When it can't
+        # be used (e.g., the index changed), that's what's looked at, so it's
+        # only asked for what the scoped status would look at anyway
+        git_sts = None
+        if git_paths is None and tracked and untracked:
+            git_sts = self.gl_repo._watched_status()
+        if git_sts is None:  # no watcher
+            items = self.gl_repo._git_status_items(git_paths, tracked, untracked)
+        else:
+            items = ((fp, git_sts[fp]) for fp in sorted(git_sts))
 
+        def codes():
+            for fp, code in items:
+                is_tracked = self._st_map[code][0] == GL_STATUS_TRACKED
+                if tracked if is_tracked else untracked:
+                    yield fp, code
+
+        if not untracked:
+            yield from codes()
+            return
         # status doesn't report au files
-        au_files = list(self._au_files())
-        if au_files:
-            for fp in au_files:
-                exists_in_wd = os.path.exists(os.path.join(self.gl_repo.root, fp))
-                yield self.FileStatus(
-                    fp, GL_STATUS_UNTRACKED, True, exists_in_wd, True, False)
+        au_codes = []
+        for fp in sorted(self._au_files()):
+            if git_paths is not None and not _in_pathspec(fp, git_paths):
+                continue
+            exists_in_wd = os.path.exists(os.path.join(self.gl_repo.root, fp))
+            au_codes.append(
+                (fp, self._ST_AU if exists_in_wd else self._ST_AU_NOT_IN_WD))
+        all_codes = heapq.merge(codes(), au_codes)
+        if untracked_dirs:
+            all_codes = self._collapse_untracked_dirs(all_codes, git_paths)
+        yield from all_codes
+
+    def _collapse_untracked_dirs(self, codes, git_paths):
+        """Replace the files under dirs with no files in the index by the dir.
+
+        codes are (path, status code) pairs sorted by path. A dir is only
+        reported if it's under the pathspec git_paths (if not None), else a dir
+        under it is.
+        """
+        index_dirs = self.gl_repo._index_dirs()
+        last_dir = None
+        for fp, code in codes:
+            if code == pygit2.GIT_STATUS_WT_NEW:  # untracked, not at head
+                d = _untracked_dir(fp, index_dirs, git_paths)
+                if d is not None:
+                    if d != last_dir:
+                        last_dir = d
+                        yield d, code
+                    continue
+            yield fp, code
+
+    def has_modified_files(self):
+        """Return True if there's a tracked file with modifications.
+
+        Cheaper than looking for one in status: after diffing the index against
+        the head, only the files whose stat data doesn't match the index are
+        compared by content, stopping at the first one that was modified.
+
+        A file deleted from the index (e.g., with git rm --cached) that is still
+        in the working tree with the contents it has at head is not modified:
+        committing it wouldn't change it.
+        """
+        git_repo = self.gl_repo.git_repo
+        index = self._index
+        for delta in index.diff_to_tree(git_repo.head.peel().tree).deltas:
+            if (delta.status != pygit2.GIT_DELTA_DELETED or
+                    not self._is_at_head_in_wd(delta.old_file)):
+                return True
+
+        workers = self.gl_repo._config_int('gitless.statusWorkers', 0)
+        changed = self.gl_repo._stat_changed_paths(max(workers, 1))
+        if changed is None:  # an index we can't read
+            return next(self.status(untracked=False), None) is not None
+        wd_modified = (
+            pygit2.GIT_STATUS_WT_MODIFIED | pygit2.GIT_STATUS_WT_DELETED |
+            pygit2.GIT_STATUS_WT_TYPECHANGE | pygit2.GIT_STATUS_CONFLICTED)
+        for path in changed:
+            try:
+                if git_repo.status_file(path) & wd_modified:
+                    return True
+            except KeyError:  # e.g., a submodule
+                return True
+        return False
+
+    def _is_at_head_in_wd(self, head_file):
+        """True if the working tree has head_file (a DiffFile) as it is at head."""
+        fp = os.path.join(self.gl_repo.root, head_file.path)
+        try:
+            st = os.lstat(fp)
+        except OSError:
+            return False
+        if not stat.S_ISREG(st.st_mode):
+            return False
+        if self.gl_repo._config_bool('core.fileMode', True):
+            mode = (
+                pygit2.GIT_FILEMODE_BLOB_EXECUTABLE if st.st_mode & stat.S_IXUSR
+                else pygit2.GIT_FILEMODE_BLOB)
+            if head_file.mode != mode:
+                return False
+        return pygit2.hashfile(fp) == head_file.id
+
+    def has_untracked_files(self):
+        """Return True if there's an untracked file.
+
+        If the untracked cache can be used (see Repository._untracked_files),
+        the index is not diffed against the head.
+        """
+        if self._au_files():
+            return True
+        untracked_fps = self.gl_repo._untracked_files()
+        if untracked_fps is None:
+            return next(self.status(tracked=False), None) is not None
+        # A file deleted from the index that is at head is tracked
+        head_tree = self.gl_repo.git_repo.head.peel().tree
+        return any(fp.rstrip('/') not in head_tree for fp in untracked_fps)
 
     def status_file(self, path):
         """Return the status (see FileStatus) of the given path."""
         return self._status_file(path)[0]
 
+    def status_files(self, paths):
+        """Return a dict that maps each of the given paths to its FileStatus.
+
+        Same as calling status_file on each path, except that paths that don't
+        exist are left out of the dict (instead of raising KeyError). The
+        working tree is scanned once for all paths (and only at those paths).
+        """
+        return {path: st[0] for path, st in self._status_files(paths).items()}
+
     def _status_file(self, path):
         _check_path_is_repo_relative(path)
 
-        git_st = self.gl_repo.git_repo.status_file(_get_git_path(path))
-        root = self.gl_repo.root
-        cmd_out = git('ls-files', '-v', '--full-name', path, cwd=root)
-        is_au = cmd_out and cmd_out[0] == 'h'
+        git_path = _get_git_path(path)
+        git_st = self.gl_repo.git_repo.status_file(git_path)
+        return self._file_status(path, git_st, git_path in self._au_files())
+
+    def _status_files(self, paths):
+        """Like status_files but the values are the same as _status_file's."""
+        paths = list(paths)
+        if not paths:
+            return {}
+
+        for path in paths:
+            _check_path_is_repo_relative(path)
+        git_repo = self.gl_repo.git_repo
+        git_sts = _git_status(
+            git_repo, [_get_git_path(path) for path in paths])
+        au_files = self._au_files()
+        ret = {}
+        # (in a transaction, so that the index is loaded once and not once
+        # per lookup)
+        with self._index as index:
+            for path in paths:
+                git_path = _get_git_path(path)
+                git_st = git_sts.get(git_path)
+                if git_st is None:  # not in status: unmodified or ignored
+                    full_path = os.path.join(self.gl_repo.root, path)
+                    if git_path in index:
+                        git_st = pygit2.GIT_STATUS_CURRENT
+                    elif os.path.isdir(full_path):
+                        raise ValueError('Path {0} is a directory'.format(path))
+                    elif os.path.lexists(full_path):
+                        git_st = pygit2.GIT_STATUS_IGNORED
+                    else:
+                        continue
+                ret[path] = self._file_status(
+                    path, git_st, git_path in au_files)
+        return ret
+
+    def _file_status(self, path, git_st, is_au):
+        """Return the (FileStatus, git status, is au) tuple of _status_file."""
         if is_au:
-            exists_in_wd = os.path.exists(os.path.join(root, path))
+            exists_in_wd = os.path.exists(os.path.join(self.gl_repo.root, path))
             f_st = self.FileStatus(
                 path, GL_STATUS_UNTRACKED, True, exists_in_wd, True, False)
         else:
@@ -862,10 +1498,19 @@ class Branch(object):
 
     def track_file(self, path):
         """Start tracking changes to path."""
-        _check_path_is_repo_relative(path)
+        _raise_file_error(self.track_files([path]))
+
+    def track_files(self, paths):
+        """Start tracking changes to the given paths.
 
-        gl_st, git_st, is_au = self._status_file(path)
+        Same as calling track_file on each path, but all paths are looked up in
+        one status (see status_files) and the index is written once. Returns a
+        dict that maps each path that couldn't be tracked to the error (a
+        KeyError if the file doesn't exist, a ValueError otherwise).
+        """
+        return self._change_files(paths, self._track)
 
+    def _track(self, index, path, gl_st, git_st, is_au):
         if gl_st.type == GL_STATUS_TRACKED:
             raise ValueError('File {0} is already tracked'.format(path))
         elif gl_st.type == GL_STATUS_IGNORED:
@@ -877,21 +1522,27 @@ class Branch(object):
         # file. This means that in the Git world, the file could be either:
         #   (i)  a new file for Git => add the file;
         #   (ii) an assumed unchanged file => unmark it.
+        git_path = _get_git_path(path)
         if git_st == pygit2.GIT_STATUS_WT_NEW:  # Case (i)
-            with self._index as index:
-                git_path = _get_git_path(path)
-                index.add(git_path)
+            index.add(git_path)
         elif is_au:  # Case (ii)
-            git('update-index', '--no-assume-unchanged', path, cwd=self.gl_repo.root)
+            _set_assumed_unchanged(index, git_path, False)
         else:
             raise GlError('File {0} in unknown status {1}'.format(path, git_st))
 
     def untrack_file(self, path):
         """Stop tracking changes to path."""
-        _check_path_is_repo_relative(path)
+        _raise_file_error(self.untrack_files([path]))
+
+    def untrack_files(self, paths):
+        """Stop tracking changes to the given paths.
 
-        gl_st, git_st, is_au = self._status_file(path)
+        Same as calling untrack_file on each path, but all paths are looked up
+        in one status and the index is written once (see track_files).
+        """
+        return self._change_files(paths, self._untrack)
 
+    def _untrack(self, index, path, gl_st, git_st, is_au):
         if gl_st.type == GL_STATUS_UNTRACKED:
             raise ValueError('File {0} is already untracked'.format(path))
         elif gl_st.type == GL_STATUS_IGNORED:
@@ -907,26 +1558,51 @@ class Branch(object):
         #        an uncommitted file) => reset changes;
         #   (ii) the file is a previously committed file => mark it as assumed
         #        unchanged.
+        git_path = _get_git_path(path)
         if git_st == pygit2.GIT_STATUS_INDEX_NEW:  # Case (i)
-            with self._index as index:
-                git_path = _get_git_path(path)
-                index.remove(git_path)
+            index.remove(git_path)
         elif not is_au:  # Case (ii)
-            git('update-index', '--assume-unchanged', path, cwd=self.gl_repo.root)
+            _set_assumed_unchanged(index, git_path, True)
         else:
             raise GlError('File {0} in unknown status {1}'.format(path, git_st))
 
     def resolve_file(self, path):
         """Mark the given path as resolved."""
-        _check_path_is_repo_relative(path)
+        _raise_file_error(self.resolve_files([path]))
+
+    def resolve_files(self, paths):
+        """Mark the given paths as resolved.
+
+        Same as calling resolve_file on each path, but all paths are looked up
+        in one status and the index is written once (see track_files).
+        """
+        return self._change_files(paths, self._resolve)
 
-        gl_st, _, _ = self._status_file(path)
+    def _resolve(self, index, path, gl_st, git_st, is_au):
         if not gl_st.in_conflict:
             raise ValueError('File {0} has no conflicts'.format(path))
+        index.add(_get_git_path(path))
 
+    def _change_files(self, paths, change):
+        """Apply change to each of paths in one index transaction.
+
+        change gets the index, the path and its _status_file tuple, and raises
+        ValueError if the path can't be changed. Returns a dict that maps the
+        paths that couldn't be changed to the error.
+        """
+        paths = list(paths)
+        errors = {}
         with self._index as index:
-            git_path = _get_git_path(path)
-            index.add(git_path)
+            statuses = self._status_files(paths)
+            for path in paths:
+                if path not in statuses:
+                    errors[path] = KeyError(path)
+                    continue
+                try:
+                    change(index, path, *statuses[path])
+                except ValueError as e:
+                    errors[path] = e
+        return errors
 
     def checkout_file(self, path, commit):
         """Checkouts the given path at the given commit."""
@@ -982,7 +1658,12 @@ class Branch(object):
                 yield tree_entry_path
 
     def diff_file(self, path):
-        """Diff the working version of path with its committed version."""
+        """Diff the working version of path with its committed version.
+
+        The working version is diffed as it is in memory, without being
+        written to the object database (where it would be left as a loose
+        object).
+        """
         _check_path_is_repo_relative(path)
 
         git_repo = self.gl_repo.git_repo
@@ -990,17 +1671,139 @@ class Branch(object):
         try:
             blob_at_head = git_repo[git_repo.head.peel().tree[git_path].id]
         except KeyError:  # no blob at head
-            wt_blob = git_repo[git_repo.create_blob_fromworkdir(git_path)]
-            nil_blob = git_repo[git_repo.create_blob('')]
-            return nil_blob.diff(wt_blob, 0, git_path, git_path)
+            blob_at_head = None
+
+        if _may_filter(git_repo, git_path):
+            patch = self._diff_filtered_file(git_path, blob_at_head)
+            if patch:
+                return patch
+            # Only Git's filters know what the working version is in the
+            # object database
+            try:
+                wt = git_repo[git_repo.create_blob_fromworkdir(git_path)]
+            except KeyError:  # no blob at wd (the file was deleted)
+                wt = None
+        else:
+            full_path = os.path.join(self.gl_repo.root, path)
+            try:
+                if os.path.islink(full_path):
+                    wt = os.fsencode(os.readlink(full_path))
+                else:
+                    with io.open(full_path, mode='rb') as f:
+                        wt = f.read()
+            except FileNotFoundError:  # the file was deleted
+                wt = None
+
+        if blob_at_head is None and wt is None:
+            raise KeyError(path)
+        return _Patch(
+            blob_at_head if blob_at_head is not None else b'',
+            wt if wt is not None else b'', git_path)
+
+    def diff_files(self, paths):
+        """Diff the working versions of paths with their committed versions.
+
+        Same as calling diff_file on each path, but the head tree is diffed to
+        the working tree (through the index) once for all paths, and each
+        patch is only generated when it's yielded.
+
+        Returns a generator of (path, patch) pairs in the order of paths. The
+        patch of a path that is neither at head nor in the working tree is
+        None.
+        """
+        paths = list(paths)
+        for path in paths:
+            _check_path_is_repo_relative(path)
+        if not _pathspec_diff:  # this pygit2 doesn't have what we need
+            for path in paths:
+                try:
+                    yield path, self.diff_file(path)
+                except KeyError:
+                    yield path, None
+            return
 
-        try:
-            wt_blob = git_repo[git_repo.create_blob_fromworkdir(git_path)]
-        except KeyError:  # no blob at wd (the file was deleted)
-            nil_blob = git_repo[git_repo.create_blob('')]
-            return blob_at_head.diff(nil_blob, 0, git_path, git_path)
+        git_repo = self.gl_repo.git_repo
+        head_tree = git_repo.head.peel().tree
+        # The index doesn't have the working version of assumed unchanged files
+        # nor the committed version of files in conflict, diff_file does those
+        one_by_one = set(self._au_files())
+        one_by_one.update(
+            next(e for e in entries if e).path
+            for entries in self._index.conflicts or [])
+        git_paths = [_get_git_path(path) for path in paths]
+        diffed = [fp for fp in git_paths if fp not in one_by_one]
+        positions = {}
+        if diffed:
+            flags = (
+                pygit2.GIT_DIFF_INCLUDE_UNTRACKED |
+                pygit2.GIT_DIFF_RECURSE_UNTRACKED_DIRS |
+                pygit2.GIT_DIFF_SHOW_UNTRACKED_CONTENT |
+                pygit2.GIT_DIFF_INCLUDE_IGNORED)
+            diff = _pathspec_diff(git_repo, diffed, flags, tree=head_tree)
+            diff.merge(_pathspec_diff(git_repo, diffed, flags))
+            for i, delta in enumerate(diff.deltas):
+                positions[delta.new_file.path] = i
+                # (libgit2 doesn't load the content of ignored files)
+                if delta.status == pygit2.GIT_DELTA_IGNORED:
+                    one_by_one.add(delta.new_file.path)
+
+        for path, git_path in zip(paths, git_paths):
+            if git_path in one_by_one:
+                try:
+                    yield path, self.diff_file(path)
+                except KeyError:
+                    yield path, None
+            elif git_path in positions:
+                yield path, diff[positions[git_path]]
+            else:  # no changes (or no file)
+                try:
+                    blob = git_repo[head_tree[git_path].id]
+                except KeyError:
+                    yield path, None
+                else:
+                    yield path, _Patch(blob, blob, git_path)
+
+    def diff_stats(self, paths):
+        """Count the lines added and deleted in the working versions of paths.
+
+        The patches come from diff_files and only their line stats are looked
+        at (the hunks are never turned into Python objects). Binary files (as
+        libgit2 detects them from the start of their content) and paths that
+        are neither at head nor in the working tree are left out.
+
+        Returns a generator of (path, additions, deletions) in the order of
+        paths.
+        """
+        for path, patch in self.diff_files(paths):
+            if patch is None or patch.delta.is_binary:
+                continue
+            _, additions, deletions = patch.line_stats
+            yield path, additions, deletions
+
+    def _diff_filtered_file(self, git_path, blob_at_head):
+        """Diff the working version of a file Git filters with blob_at_head.
 
-        return blob_at_head.diff(wt_blob, 0, git_path, git_path)
+        libgit2 applies the filters when diffing the index to the working
+        tree, which is the diff we want if the index has the same version of
+        the file as the head. Returns None if it hasn't.
+        """
+        git_repo = self.gl_repo.git_repo
+        index = self._index
+        index_id = index[git_path].id if git_path in index else None
+        head_id = blob_at_head.id if blob_at_head is not None else None
+        if (not _pathspec_diff or index_id != head_id or
+                git_path in self._au_files()):
+            return None
+        diff = _pathspec_diff(
+            git_repo, [git_path],
+            pygit2.GIT_DIFF_INCLUDE_UNTRACKED |
+            pygit2.GIT_DIFF_SHOW_UNTRACKED_CONTENT |
+            pygit2.GIT_DIFF_INCLUDE_IGNORED)
+        for patch in diff:
+            return patch
+        if blob_at_head is None:  # not at head nor in the working tree
+            raise KeyError(git_path)
+        return _Patch(blob_at_head, blob_at_head, git_path)  # (no changes)
 
     # Merge-related methods
 
@@ -1255,41 +2058,32 @@ class Branch(object):
 
         def get_tree_and_update_index():
 
-            def update():
-                """Add/remove files to the index."""
+            # Update index to how it should look like after the commit
+            with index:
                 for f in files:
                     assert not os.path.isabs(f)
                     git_f = _get_git_path(f)
                     if not os.path.exists(os.path.join(self.gl_repo.root, f)):
                         # Check if this file has been removed using `git mv` or `git rm`
-                        if git_f in index._git_index:
+                        if git_f in index:
                             index.remove(git_f)
                     elif f not in partials:
                         index.add(git_f)
 
-            # Update index to how it should look like after the commit
-            partial_entries = {}
-            with index:
-                update()
-                for f in partials:
-                    git_f = _get_git_path(f)
-                    partial_entries[f] = index._git_index[git_f]
-
-            # To create the commit tree with only the changes to the given files we:
-            #   (i)   reset the index to HEAD,
-            #   (ii)  update it with the changes to commit,
-            #   (iii) create a tree out of this modified index, and
-            #   (iv)  discard the changes after being done.
-            index.read_tree(git_repo.head.peel().tree)
-            update()
-            for f in partial_entries.keys():
-                index.add(partial_entries[f])
-
-            tree_oid = index.write_tree()
-
-            index.read()  # discard changes
-
-            return tree_oid
+            # The commit tree has only the changes to the given files: it's the
+            # tree of HEAD with the entries of these files taken from the
+            # (updated) index. It's built in an in-memory index, so that the
+            # index of the repo doesn't have to be reset and read again.
+            tree_index = pygit2.Index()
+            tree_index.read_tree(git_repo.head.peel().tree)
+            for f in files:
+                git_f = _get_git_path(f)
+                if git_f in index:
+                    tree_index.add(index[git_f])
+                elif git_f in tree_index:
+                    tree_index.remove(git_f)
+
+            return tree_index.write_tree(git_repo)
 
         parents = [git_repo.head.target]
         if self.merge_in_progress:
@@ -1364,6 +2158,59 @@ class Tag(object):
         return self.tag_name
 
 
+class StatusList(object):
+    """A compact, read-only list of file statuses (see Branch.status_list).
+
+    Instead of a FileStatus and a path string per file, the dirs of the paths
+    are kept once (each file points to its dir), the basenames are all in one
+    string, and the statuses are small integer codes. The FileStatus of a file
+    is only made when it's accessed.
+    """
+
+    def __init__(self, entries, file_status, st_fields):
+        """Create a StatusList out of the (path, status code) pairs entries.
+
+        file_status is the FileStatus type and st_fields the function that
+        returns the FileStatus fields (but the path) for a status code.
+        """
+        self._file_status = file_status
+        self._st_fields = st_fields
+        self._dirs = []
+        self._dir_idxs = array.array('I')
+        self._name_ends = array.array('I')
+        self._codes = array.array('I')
+        dir_ids = {}
+        names = io.StringIO()
+        end = 0
+        for fp, code in entries:
+            d, _, name = fp.rpartition('/')
+            dir_idx = dir_ids.get(d)
+            if dir_idx is None:
+                dir_idx = dir_ids[d] = len(self._dirs)
+                self._dirs.append(d + '/' if d else '')
+            end += names.write(name)
+            self._dir_idxs.append(dir_idx)
+            self._name_ends.append(end)
+            self._codes.append(code)
+        self._names = names.getvalue()
+
+    def __len__(self):
+        return len(self._codes)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self._codes)
+        if not 0 <= i < len(self._codes):
+            raise IndexError('StatusList index out of range')
+        start = self._name_ends[i - 1] if i else 0
+        fp = self._dirs[self._dir_idxs[i]] + self._names[
+            start:self._name_ends[i]]
+        return self._file_status(fp, *self._st_fields(self._codes[i]))
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self._codes)))
+
+
 # Helpers for stashing
 
 def _stash(pattern):
@@ -1420,6 +2267,341 @@ def walker(git_repo, target, reverse):
     return git_repo.walk(target, flags)
 
 
+def _pathspec(paths):
+    """Return the repo-relative paths as a literal pathspec for libgit2.
+
+    None means the whole repo.
+    """
+    if not paths:
+        return None
+    git_paths = []
+    for path in paths:
+        _check_path_is_repo_relative(path)
+        git_path = _get_git_path(os.path.normpath(path))
+        if git_path == '.':  # the repo root
+            return None
+        git_paths.append(git_path)
+    return git_paths
+
+
+def _in_pathspec(git_path, git_paths):
+    return any(
+        git_path == p or git_path.startswith(p + '/') for p in git_paths)
+
+
+def _untracked_dir(git_path, index_dirs, git_paths):
+    """Return the topmost dir of git_path with no files in the index.
+
+    The dir is returned with a trailing '/'. None is returned if all dirs of
+    git_path (under the pathspec git_paths) have files in the index.
+    """
+    parts = git_path.rstrip('/').split('/')
+    for i in range(1, len(parts)):
+        d = '/'.join(parts[:i])
+        if d not in index_dirs and (
+                git_paths is None or _in_pathspec(d, git_paths)):
+            return d + '/'
+    return None
+
+
+# libgit2 status is computed out of two diffs: HEAD to index and index to
+# working tree. Which status flag each kind of delta maps to:
+_HEAD_TO_INDEX_ST = {
+    pygit2.GIT_DELTA_ADDED: pygit2.GIT_STATUS_INDEX_NEW,
+    pygit2.GIT_DELTA_MODIFIED: pygit2.GIT_STATUS_INDEX_MODIFIED,
+    pygit2.GIT_DELTA_DELETED: pygit2.GIT_STATUS_INDEX_DELETED,
+    pygit2.GIT_DELTA_RENAMED: pygit2.GIT_STATUS_INDEX_RENAMED,
+    pygit2.GIT_DELTA_TYPECHANGE: pygit2.GIT_STATUS_INDEX_TYPECHANGE,
+}
+_INDEX_TO_WD_ST = {
+    pygit2.GIT_DELTA_ADDED: pygit2.GIT_STATUS_WT_NEW,
+    pygit2.GIT_DELTA_UNTRACKED: pygit2.GIT_STATUS_WT_NEW,
+    pygit2.GIT_DELTA_MODIFIED: pygit2.GIT_STATUS_WT_MODIFIED,
+    pygit2.GIT_DELTA_DELETED: pygit2.GIT_STATUS_WT_DELETED,
+    pygit2.GIT_DELTA_RENAMED: pygit2.GIT_STATUS_WT_RENAMED,
+    pygit2.GIT_DELTA_TYPECHANGE: pygit2.GIT_STATUS_WT_TYPECHANGE,
+    pygit2.GIT_DELTA_IGNORED: pygit2.GIT_STATUS_IGNORED,
+}
+
+
+def _git_status(
+        git_repo, git_paths=None, tracked=True, untracked=True, wd_paths=None,
+        refresh=False):
+    """Like git_repo.status() but only for the files under the given paths.
+
+    pygit2's status doesn't take a pathspec, so the two diffs that make up a
+    status (HEAD to index and index to working tree) are done here with the
+    pathspec given to libgit2. This way, libgit2 only looks at the matching
+    subtrees (both in the index and the working tree).
+
+    If tracked is False, only the statuses that make a file untracked for
+    Gitless are reported and the HEAD to index diff is skipped. If untracked is
+    False, libgit2 doesn't look for files that are not in the index (usually the
+    biggest part of a status for repos with lots of build output).
+
+    If wd_paths is not None, it's the list of files in the index that might
+    differ from the working tree (see stat_scan), and the index to working
+    tree diff only looks at those (untracked must be False).
+
+    If refresh is True, the stat data of the files the index to working tree
+    diff finds unchanged is updated in the index, and the index is written
+    back (by libgit2, under the index lock) if any entry changed. This is only
+    an optimization: if the index can't be written the status is still done.
+    """
+    if not _pathspec_diff:  # this pygit2 doesn't have what we need
+        return {
+            fp: st for fp, st in git_repo.status().items()
+            if git_paths is None or _in_pathspec(fp, git_paths)}
+
+    if (git_paths is None and tracked and not untracked and wd_paths is None and
+            not refresh):
+        try:  # one pass (and one index read) instead of two diffs
+            return _fix_index_deleted(
+                git_repo, git_repo.status(untracked_files='no'))
+        except TypeError:  # this pygit2's status doesn't take untracked_files
+            pass
+
+    return dict(_diff_status(
+        git_repo, git_paths, tracked, untracked, wd_paths, refresh))
+
+
+def _git_status_items(
+        git_repo, git_paths=None, tracked=True, untracked=True, wd_paths=None,
+        refresh=False):
+    """Like _git_status, but generate the (path, status) pairs sorted by path.
+
+    libgit2 sorts the deltas of a diff by path (case-insensitively if
+    core.ignoreCase is set), so the two diffs of the status are merged as their
+    deltas come: no dict of the whole status is built (and sorted) first.
+    """
+    if _pathspec_diff and not _ignores_case(git_repo):
+        yield from _diff_status(
+            git_repo, git_paths, tracked, untracked, wd_paths, refresh)
+        return
+    git_sts = _git_status(
+        git_repo, git_paths, tracked, untracked, wd_paths, refresh)
+    for fp in sorted(git_sts):
+        yield fp, git_sts[fp]
+
+
+def _diff_status(git_repo, git_paths, tracked, untracked, wd_paths, refresh):
+    """Generate the (path, status) pairs of _git_status (see _git_status_items).
+
+    Paths come in the order of the deltas of the diffs.
+    """
+    head_tree = git_repo.head.peel().tree
+    diffs = []
+    if tracked:
+        diffs.append(_delta_sts(
+            _pathspec_diff(git_repo, git_paths, 0, tree=head_tree),
+            _HEAD_TO_INDEX_ST))
+    wd_flags = 0
+    if untracked:
+        wd_flags = (
+            pygit2.GIT_DIFF_INCLUDE_UNTRACKED |
+            pygit2.GIT_DIFF_RECURSE_UNTRACKED_DIRS)
+    if wd_paths is None:
+        diffs.append(_delta_sts(
+            _wd_diff(git_repo, git_paths, wd_flags, refresh),
+            _INDEX_TO_WD_ST))
+    elif wd_paths:  # (an empty pathspec matches everything)
+        diffs.append(_delta_sts(
+            _wd_diff(git_repo, wd_paths, wd_flags, refresh), _INDEX_TO_WD_ST))
+
+    root = git_repo.workdir
+    first = lambda item: item[0]
+    for fp, group in itertools.groupby(
+            heapq.merge(*diffs, key=first), key=first):
+        st = 0
+        for _, delta_st in group:
+            if pygit2.GIT_STATUS_CONFLICTED in (st, delta_st):
+                st = pygit2.GIT_STATUS_CONFLICTED
+            else:
+                st |= delta_st
+        if not tracked:
+            # A file that is not in the index but is at HEAD was deleted from
+            # the index (e.g., with git rm --cached), which makes it tracked
+            if st != pygit2.GIT_STATUS_WT_NEW:
+                continue
+            if fp in head_tree:
+                st |= pygit2.GIT_STATUS_INDEX_DELETED
+        if not untracked:
+            # Without looking for untracked files libgit2 can't tell if a file
+            # deleted from the index is still in the working tree
+            if (st == pygit2.GIT_STATUS_INDEX_DELETED and
+                    os.path.lexists(os.path.join(root, fp))):
+                st |= pygit2.GIT_STATUS_WT_NEW
+        yield fp, st
+
+
+def _with_untracked(tracked_items, untracked_fps, head_tree):
+    """Merge the untracked files into the (sorted) status pairs tracked_items.
+
+    head_tree is None if tracked_items has all tracked files, else it's used
+    to tell which untracked files were deleted from the index.
+    """
+    first = lambda item: item[0]
+    untracked_items = ((fp, None) for fp in untracked_fps)  # (sorted)
+    for fp, group in itertools.groupby(
+            heapq.merge(tracked_items, untracked_items, key=first), key=first):
+        st = next(group)[1]  # (tracked items come first)
+        if st is None:
+            st = pygit2.GIT_STATUS_WT_NEW
+            if head_tree is not None and fp.rstrip('/') in head_tree:
+                st |= pygit2.GIT_STATUS_INDEX_DELETED
+        # (else it was deleted from the index, see _diff_status)
+        yield fp, st
+
+
+def _delta_sts(diff, st_map):
+    """Generate the (path, status) of each delta of diff."""
+    for delta in diff.deltas:
+        fp = delta.new_file.path or delta.old_file.path
+        if delta.status == pygit2.GIT_DELTA_CONFLICTED:
+            yield fp, pygit2.GIT_STATUS_CONFLICTED
+        else:
+            yield fp, st_map[delta.status]
+
+
+def _ignores_case(git_repo):
+    try:
+        return git_repo.config.get_bool('core.ignoreCase')
+    except KeyError:
+        return False
+
+
+def _wd_diff(git_repo, git_paths, flags, refresh):
+    """Diff the index to the working tree, refreshing the index if possible."""
+    if refresh:
+        try:
+            return _pathspec_diff(
+                git_repo, git_paths, flags | pygit2.GIT_DIFF_UPDATE_INDEX)
+        except (pygit2.GitError, OSError):  # e.g., someone has the index lock
+            pass
+    return _pathspec_diff(git_repo, git_paths, flags)
+
+
+def _fix_index_deleted(git_repo, git_sts):
+    """Fix up a status done without looking for untracked files.
+
+    Without looking for untracked files libgit2 can't tell if a file deleted
+    from the index is still in the working tree.
+    """
+    root = git_repo.workdir
+    for fp, st in git_sts.items():
+        if (st == pygit2.GIT_STATUS_INDEX_DELETED and
+                os.path.lexists(os.path.join(root, fp))):
+            git_sts[fp] = st | pygit2.GIT_STATUS_WT_NEW
+    return git_sts
+
+
+try:
+    from pygit2.utils import StrArray as _StrArray
+    # (older pygit2 versions don't declare these)
+    _C.git_diff_options_init, _C.git_diff_index_to_workdir, _C.git_diff_tree_to_index
+
+    def _pathspec_diff(git_repo, git_paths, flags, tree=None):
+        """Diff the index to the working tree (or tree to the index).
+
+        Only paths matching the (literal) pathspec git_paths (if not None) are
+        diffed. This
+        is done the same way pygit2's Index.diff_to_workdir/diff_to_tree do it,
+        but setting the pathspec option, which pygit2 doesn't expose.
+        """
+        copts = _ffi.new('git_diff_options *')
+        _check_error(_C.git_diff_options_init(copts, 1))
+        copts.flags = flags | pygit2.GIT_DIFF_DISABLE_PATHSPEC_MATCH
+        with _StrArray(git_paths) as arr:
+            if git_paths is not None:
+                copts.pathspec = arr[0]
+            cdiff = _ffi.new('git_diff **')
+            # With a NULL index libgit2 uses the repo's index (re-reading it
+            # if it changed on disk)
+            if tree is None:
+                err = _C.git_diff_index_to_workdir(
+                    cdiff, git_repo._repo, _ffi.NULL, copts)
+            else:
+                ctree = _ffi.new('git_tree **')
+                _ffi.buffer(ctree)[:] = tree._pointer[:]
+                err = _C.git_diff_tree_to_index(
+                    cdiff, git_repo._repo, ctree[0], _ffi.NULL, copts)
+            _check_error(err)
+        return pygit2.Diff.from_c(bytes(_ffi.buffer(cdiff)[:]), git_repo)
+except (ImportError, AttributeError):
+    _pathspec_diff = None
+
+
+class _Patch(object):
+    """A pygit2 Patch of blobs or buffers.
+
+    libgit2 doesn't copy the buffers a patch is created from, so the patch
+    keeps them alive.
+    """
+
+    def __init__(self, old, new, git_path):
+        self._buffers = (old, new)
+        self._patch = pygit2.Patch.create_from(old, new, git_path, git_path, 0)
+
+    def __getattr__(self, name):
+        return getattr(self._patch, name)
+
+
+# The attributes that make Git filter a file (see gitattributes)
+_FILTER_ATTRS = ('text', 'crlf', 'eol', 'ident', 'filter', 'working-tree-encoding')
+
+
+def _may_filter(git_repo, git_path):
+    """True if Git might filter git_path on its way to the object database.
+
+    E.g., to convert the line endings of the file. Running the filters takes
+    libgit2 API that pygit2 doesn't have.
+    """
+    try:
+        autocrlf = git_repo.config['core.autocrlf']
+    except KeyError:
+        autocrlf = 'false'
+    if autocrlf.lower() not in ('false', 'no', 'off', '0', ''):
+        return True
+    return any(
+        git_repo.get_attr(git_path, attr) not in (None, False)
+        for attr in _FILTER_ATTRS)
+
+
+def _file_stamp(fp):
+    try:
+        st = os.stat(fp)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+
+def _raise_file_error(errors):
+    """Raise the error (if any) of the one path given to a *_files method."""
+    for e in errors.values():
+        raise e
+
+
+def _set_assumed_unchanged(index, git_path, assumed_unchanged):
+    """Set or clear the assume-unchanged flag of an entry of the index session.
+
+    pygit2's IndexEntry doesn't have the flags (and adding one would lose the
+    stat data of the entry), so the entry is copied and added back with the
+    flag changed, the same way `git update-index --[no-]assume-unchanged`
+    does, but without writing the index.
+    """
+    centry = _C.git_index_get_bypath(index._index, _to_bytes(git_path), 0)
+    if centry == _ffi.NULL:
+        raise KeyError(git_path)
+    new_centry = _ffi.new('git_index_entry *')
+    new_centry[0] = centry[0]
+    if assumed_unchanged:
+        new_centry.flags |= index_file.FLAG_ASSUME_VALID
+    else:
+        new_centry.flags &= ~index_file.FLAG_ASSUME_VALID
+    _check_error(_C.git_index_add(index._index, new_centry))
+    index.mark_changed()
+
+
 def _get_git_path(path):
     return path if sys.platform != 'win32' else path.replace('\\', '/')
 
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+# Gitless - a version control system built on top of Git
+# Licensed under MIT
+
+"""Matching of paths against gitignore patterns.
+
+Asking libgit2 if a path is ignored (Repository.path_is_ignored) costs about
+as much as a stat per path, which is too much for code that looks at every
+file in the working tree. Here, the patterns of an ignore file are compiled
+once to regexes and the matching is done in-process.
+
+See https://git-scm.com/docs/gitignore for the format.
+"""
+
+import os
+import re
+
+
+def read_rules(fp):
+    """Return the compiled rules of the ignore file at fp (see compile_rules).
+
+    If there's no file at fp there are no rules.
+    """
+    try:
+        with open(fp, 'rb') as f:
+            return compile_rules(f.read())
+    except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+        return []
+
+
+def compile_rules(content):
+    """Return the rules in content (the bytes of an ignore file).
+
+    Each rule is a tuple (regex, negated, dir_only, anchored). Anchored rules
+    are matched against the path relative to the dir of the ignore file, the
+    others against the file name only.
+    """
+    rules = []
+    for line in os.fsdecode(content).splitlines():
+        rule = _compile(line)
+        if rule:
+            rules.append(rule)
+    return rules
+
+
+def is_ignored(rule_sets, rel_path, name, is_dir):
+    """True if the path is ignored per the given rule sets.
+
+    Args:
+      rule_sets: a sequence of (base, rules) pairs in order of precedence (the
+        ignore file of the deepest dir first). base is the dir of the ignore
+        file ('' for the repo root or for files that apply to the whole repo
+        like .git/info/exclude) and rules is what compile_rules returns.
+      rel_path: the path relative to the repo root (with '/' as separator).
+      name: the last component of rel_path.
+      is_dir: True if the path is a directory.
+    """
+    for base, rules in rule_sets:
+        path = rel_path[len(base) + 1:] if base else rel_path
+        # The last matching rule of a file wins
+        for regex, negated, dir_only, anchored in reversed(rules):
+            if dir_only and not is_dir:
+                continue
+            if regex.match(path if anchored else name):
+                return not negated
+    return False
+
+
+class Rules(object):
+    """The ignore rules of a working tree.
+
+    The ignore file of each dir is read (and compiled) the first time a path in
+    that dir is matched, and then kept.
+    """
+
+    def __init__(self, root, exclude_fps):
+        """Create the rules of the working tree at root.
+
+        exclude_fps are the paths of the ignore files that apply to the whole
+        working tree (in order of precedence).
+        """
+        self.root = root
+        self._exclude_fps = exclude_fps
+        self._rules_memo = {}
+        self._rule_sets_memo = {}
+        self._matchers_memo = {}
+
+    def rule_sets(self, rel_dir):
+        """Return the rule sets that apply to the paths in rel_dir.
+
+        See is_ignored. rel_dir is relative to the root and uses '/' as
+        separator.
+        """
+        rule_sets = self._rule_sets_memo.get(rel_dir)
+        if rule_sets is None:
+            rule_sets = [(rel_dir, self._rules(
+                os.path.join(self.root, rel_dir, '.gitignore')))]
+            if rel_dir:
+                rule_sets.extend(self.rule_sets(rel_dir.rpartition('/')[0]))
+            else:
+                rule_sets.extend(
+                    ('', self._rules(fp)) for fp in self._exclude_fps)
+            rule_sets = [(base, rules) for base, rules in rule_sets if rules]
+            self._rule_sets_memo[rel_dir] = rule_sets
+        return rule_sets
+
+    def is_ignored(self, rel_path, is_dir):
+        """True if the path is ignored by the rules of its dir (or its parents).
+
+        The dirs the path is in are not matched: if one of them is ignored, so
+        is the path, but that's for the caller to check (e.g., when walking the
+        working tree, ignored dirs are not entered).
+        """
+        rel_dir, _, name = rel_path.rpartition('/')
+        return self.matcher(rel_dir)(name, is_dir)
+
+    def matcher(self, rel_dir):
+        """Return a function that tells if an entry of rel_dir is ignored.
+
+        The function gets the name of the entry and whether it's a dir. Since
+        rules that only apply to dirs (e.g., node_modules/) are common, the
+        files of a dir are only matched against the other rules.
+        """
+        matcher = self._matchers_memo.get(rel_dir)
+        if matcher is None:
+            matcher = _matcher(rel_dir, self.rule_sets(rel_dir))
+            self._matchers_memo[rel_dir] = matcher
+        return matcher
+
+    def _rules(self, fp):
+        if fp not in self._rules_memo:
+            self._rules_memo[fp] = read_rules(fp)
+        return self._rules_memo[fp]
+
+
+def walk(root, rel_dir, matcher, ignored_files=True, ignored_dir_cb=None):
+    """Yield the files under rel_dir that are not in an ignored dir.
+
+    Paths are relative to root and use '/' as separator. Files in the same dir
+    are yielded in sorted order, before the files in its subdirs. Symlinks are
+    files (even if they point to a dir). Git dirs are not entered.
+
+    Args:
+      root: the root of the working tree.
+      rel_dir: the dir to walk (relative to root, '' for root).
+      matcher: a function that gets the path of a dir under rel_dir and
+        returns a function that tells if an entry of it is ignored (e.g.,
+        Rules(...).matcher). Ignored dirs are not entered.
+      ignored_files: if False, ignored files are not yielded.
+      ignored_dir_cb: called with the path of each ignored dir found.
+    """
+    pending = [rel_dir]
+    while pending:
+        curr_dir = pending.pop()
+        is_ignored = matcher(curr_dir)
+        prefix = curr_dir + '/' if curr_dir else ''
+        fps = []
+        dirs = []
+        try:
+            with os.scandir(os.path.join(root, curr_dir)) as it:
+                for e in it:
+                    name = e.name
+                    if name == '.git':
+                        continue
+                    if not e.is_dir(follow_symlinks=False):
+                        if ignored_files or not is_ignored(name, False):
+                            fps.append(prefix + name)
+                    elif not is_ignored(name, True):
+                        dirs.append(prefix + name)
+                    elif ignored_dir_cb:
+                        ignored_dir_cb(prefix + name)
+        except OSError:  # removed while we were at it (or not a dir)
+            continue
+        fps.sort()
+        for fp in fps:
+            yield fp
+        dirs.sort(reverse=True)  # (so that they are popped in order)
+        pending.extend(dirs)
+
+
+# Private functions
+
+
+def _matcher(rel_dir, rule_sets):
+    """Return the function of Rules.matcher for rel_dir."""
+    prefix = rel_dir + '/' if rel_dir else ''
+    file_rule_sets = [
+        (base, rules) for base, rules in
+        ((base, [r for r in rules if not r[2]]) for base, rules in rule_sets)
+        if rules]
+
+    def is_ignored_entry(name, is_dir):
+        sets = rule_sets if is_dir else file_rule_sets
+        return bool(sets) and is_ignored(sets, prefix + name, name, is_dir)
+
+    return is_ignored_entry
+
+
+def _compile(line):
+    if not line or line.startswith('#'):
+        return None
+    # Trailing spaces are ignored unless they are escaped
+    stripped = line.rstrip(' ')
+    if stripped.endswith('\\') and len(stripped) < len(line):
+        stripped += ' '
+    line = stripped
+    negated = line.startswith('!')
+    if negated:
+        line = line[1:]
+    elif line.startswith('\\!') or line.startswith('\\#'):
+        line = line[1:]
+    dir_only = line.endswith('/')
+    line = line.rstrip('/')
+    if not line:
+        return None
+    # A pattern with a slash (other than a trailing one) is relative to the
+    # dir of the ignore file
+    anchored = '/' in line
+    line = line.lstrip('/') if anchored else line
+
+    regex = []
+    i = 0
+    n = len(line)
+    while i < n:
+        c = line[i]
+        if c == '*':
+            if line.startswith('**', i) and (i == 0 or line[i - 1] == '/'):
+                if i + 2 == n:  # trailing /**: everything inside
+                    regex.append('.*')
+                    i += 2
+                    continue
+                if line[i + 2] == '/':  # leading **/ or /**/: zero or more dirs
+                    regex.append('(?:.*/)?')
+                    i += 3
+                    continue
+            while i < n and line[i] == '*':  # other *s are regular asterisks
+                i += 1
+            regex.append('[^/]*')
+            continue
+        if c == '?':
+            regex.append('[^/]')
+        elif c == '[':
+            end = _class_end(line, i)
+            if end < 0:
+                regex.append(re.escape(c))
+            else:
+                regex.append(_class_regex(line[i + 1:end]))
+                i = end
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            regex.append(re.escape(line[i]))
+        else:
+            regex.append(re.escape(c))
+        i += 1
+    regex.append(r'\Z')
+    return re.compile(''.join(regex), re.DOTALL), negated, dir_only, anchored
+
+
+def _class_end(line, start):
+    """Return the position of the ] that closes the class at start (or -1)."""
+    i = start + 1
+    if i < len(line) and line[i] in '!^':
+        i += 1
+    if i < len(line) and line[i] == ']':  # a ] right at the start is literal
+        i += 1
+    while i < len(line):
+        if line[i] == '\\':
+            i += 2
+            continue
+        if line[i] == ']':
+            return i
+        i += 1
+    return -1
+
+
+def _class_regex(body):
+    negated = body[:1] in ('!', '^')
+    if negated:
+        body = body[1:]
+    chars = []
+    i = 0
+    while i < len(body):
+        c = body[i]
+        if c == '\\' and i + 1 < len(body):
+            i += 1
+            chars.append(re.escape(body[i]))
+        elif c == '-' and chars and i + 1 < len(body):
+            chars.append('-')
+        else:
+            chars.append(re.escape(c) if c not in '-' else r'\-')
+        i += 1
+    return '[{0}{1}]'.format('^/' if negated else '', ''.join(chars))
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# Gitless - a version control system built on top of Git
+# Licensed under MIT
+
+"""Direct access to Git's index file.
+
+pygit2 doesn't expose the flags of index entries (e.g., the assume-valid bit
+that backs `git update-index --assume-unchanged`), so we read them from the
+index file ourselves instead of running `git ls-files`.
+
+See https://git-scm.com/docs/index-format for the format.
+"""
+
+import collections
+import os
+import struct
+
+
+SIGNATURE = b'DIRC'
+SUPPORTED_VERSIONS = (2, 3, 4)
+
+# The stat data of an index entry (all fields are truncated to 32 bits)
+StatData = collections.namedtuple('StatData', [
+    'ctime', 'ctime_ns', 'mtime', 'mtime_ns', 'dev', 'ino', 'mode', 'uid',
+    'gid', 'size'])
+
+FLAG_ASSUME_VALID = 0x8000
+FLAG_EXTENDED = 0x4000
+
+_HEADER = struct.Struct('>4sLL')
+# ctime (s, ns), mtime (s, ns), dev, ino, mode, uid, gid, size, oid
+_STAT_AND_OID_SIZE = 10 * 4 + 20
+_FLAGS = struct.Struct('>H')
+_NAME_MASK = 0x0fff
+_STAGE_MASK = 0x3000
+_STAGE_SHIFT = 12
+_STAT = struct.Struct('>10L')
+_EXTENSION = struct.Struct('>4sL')
+_CHECKSUM_SIZE = 20  # SHA-1
+# With these, some entries are in another file (link) or are dirs (sdir)
+_PARTIAL_INDEX_EXTENSIONS = (b'link', b'sdir')
+
+
+def assumed_unchanged(index_fp):
+    """Return the set of paths in the index that are marked assume-valid.
+
+    Paths are relative to the repo root and use '/' as separator. If there's
+    no index file the set is empty. Raises ValueError if the index doesn't have
+    all paths in it (split or sparse indexes).
+    """
+    data = _read(index_fp)
+    return _paths(data, FLAG_ASSUME_VALID) if data else set()
+
+
+def paths(index_fp):
+    """Return the set of all paths in the index (same format as above).
+
+    Paths of unmerged files are in the index more than once (one entry per
+    stage), but they are only once in the set. Raises ValueError if the index
+    doesn't have all paths in it (see assumed_unchanged).
+    """
+    data = _read(index_fp)
+    return _paths(data, 0) if data else set()
+
+
+def stat_entries(index_fp):
+    """Return the entries of the index with the stat data Git keeps for them.
+
+    Each entry is a (path, stat, stage) tuple, where path is the path as bytes
+    (relative to the repo root and with '/' as separator) and stat is a
+    StatData. Entries are in the order of the index (sorted by path). Raises
+    ValueError if the index doesn't have all paths in it (see paths).
+    """
+    data = _read(index_fp)
+    if not data:
+        return []
+    entries = []
+    for pos, flags, path in _entries(data):
+        entries.append((
+            path, StatData._make(_STAT.unpack_from(data, pos)),
+            (flags & _STAGE_MASK) >> _STAGE_SHIFT))
+    return entries
+
+
+def stamp(index_fp):
+    """Return a value that changes when the index file at index_fp changes."""
+    try:
+        st = os.stat(index_fp)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def checksum(index_fp):
+    """Return the checksum at the end of the index file at index_fp.
+
+    Git rewrites the whole file (and so the checksum) on every change. If
+    there's no index file None is returned.
+    """
+    try:
+        with open(index_fp, 'rb') as f:
+            f.seek(-_CHECKSUM_SIZE, os.SEEK_END)
+            return f.read(_CHECKSUM_SIZE)
+    except FileNotFoundError:
+        return None
+    except OSError:  # shorter than a checksum, so it's not a valid index
+        return b''
+
+
+# Private functions
+
+
+def _read(index_fp):
+    try:
+        with open(index_fp, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _paths(data, flag):
+    """Return the paths of the entries that have flag set (all if flag is 0)."""
+    return {
+        os.fsdecode(path) for _, flags, path in _entries(data)
+        if not flag or flags & flag}
+
+
+def _entries(data):
+    """Generate the (position, flags, path as bytes) of the entries in data.
+
+    Raises ValueError once the entries are done if the index doesn't have all
+    paths in it (see _check_extensions).
+    """
+    version, count = _read_header(data)
+    pos = _HEADER.size
+    path = b''
+    # This runs once per entry, so it's kept tight
+    unpack_flags = _FLAGS.unpack_from
+    find_nul = data.index
+    flags_offset = _STAT_AND_OID_SIZE
+    path_offset = _STAT_AND_OID_SIZE + _FLAGS.size
+    for _ in range(count):
+        flags, = unpack_flags(data, pos + flags_offset)
+        path_pos = pos + path_offset
+        if flags & FLAG_EXTENDED:
+            path_pos += 2
+        if version == 4:
+            # The path is compressed: a varint with the number of bytes to
+            # remove from the end of the previous path and the NUL-terminated
+            # suffix to append to what's left
+            strip, path_pos = _varint(data, path_pos)
+            end = find_nul(b'\0', path_pos)
+            path = path[:len(path) - strip] + data[path_pos:end]
+            yield pos, flags, path
+            pos = end + 1
+        else:
+            # The length of the path is in the flags (unless it's too long to
+            # fit), and the NUL-terminated path is padded with NULs to a
+            # multiple of 8
+            end = path_pos + (flags & _NAME_MASK)
+            if flags & _NAME_MASK == _NAME_MASK:
+                end = find_nul(b'\0', path_pos)
+            yield pos, flags, data[path_pos:end]
+            pos += (end - pos + 8) & ~7
+    _check_extensions(data, pos)
+
+
+def _check_extensions(data, pos):
+    """Raise ValueError if the index doesn't have all paths in it.
+
+    pos is the position in data where the entries end (what follows them are
+    the extensions and the checksum).
+    """
+    while pos + 8 <= len(data) - 20:
+        signature, size = _EXTENSION.unpack_from(data, pos)
+        if signature in _PARTIAL_INDEX_EXTENSIONS:
+            raise ValueError('Index has a {0!r} extension'.format(signature))
+        pos += 8 + size
+
+
+def _read_header(data):
+    """Return the version and number of entries of the index data (bytes)."""
+    signature, version, count = _HEADER.unpack_from(data)
+    if signature != SIGNATURE:
+        raise ValueError('Not a Git index file')
+    if version not in SUPPORTED_VERSIONS:
+        raise ValueError('Unsupported index version {0}'.format(version))
+    return version, count
+
+
+def _varint(data, pos):
+    """Decode the offset-encoded varint at pos (as in Git's varint.c)."""
+    byte = data[pos]
+    pos += 1
+    value = byte & 0x7f
+    while byte & 0x80:
+        byte = data[pos]
+        pos += 1
+        value = ((value + 1) << 7) | (byte & 0x7f)
+    return value, pos
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# Gitless - a version control system built on top of Git
+# Licensed under MIT
+
+"""The private dir of the user where gl's Unix sockets are.
+
+The gl daemon and the watchers (see watcher) listen on Unix sockets in it. The
+client of the daemon hands it its stdin, stdout, stderr and environment, and
+gl status trusts what a watcher says changed, so both ends of a connection
+make sure that the other one is run by the same user: the dir has to be owned
+by the user (and not be a symlink) and grant no permissions to anyone else,
+the socket has to be owned by the user and the process at the other end of
+the connection has to be run by the user (SO_PEERCRED).
+"""
+
+import os
+import socket
+import stat
+import struct
+
+
+_PEERCRED = struct.Struct('3i')  # struct ucred: pid, uid, gid
+
+
+class RunDirError(Exception):
+    pass
+
+
+def is_supported():
+    """True if the user at the other end of a connection can be checked."""
+    return hasattr(socket, 'SO_PEERCRED')
+
+
+def path():
+    """Return the path of the run dir (it might not exist)."""
+    xdg_run_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if xdg_run_dir:
+        return os.path.join(xdg_run_dir, 'gitless')
+    return os.path.join('/tmp', 'gitless-{0}'.format(os.getuid()))
+
+
+def make():
+    """Create the run dir if it doesn't exist and return its path.
+
+    Raises RunDirError if it exists but it's not private to the user.
+    """
+    fp = path()
+    try:
+        os.makedirs(os.path.dirname(fp), mode=0o700, exist_ok=True)
+        os.mkdir(fp, mode=0o700)
+    except FileExistsError:
+        pass
+    if not is_private(fp):
+        raise RunDirError(
+            '{0} is not a dir private to the user (it should be owned by the '
+            'user, not be a symlink and grant no permissions to others), '
+            'remove it and try again'.format(fp))
+    return fp
+
+
+def is_private(dir_fp):
+    """True if dir_fp is a dir owned by the user that no one else can use."""
+    try:
+        st = os.lstat(dir_fp)
+    except OSError:
+        return False
+    return (
+        stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and
+        not st.st_mode & 0o077)
+
+
+def socket_is_private(fp):
+    """True if fp is a socket of the user in a private run dir."""
+    if not is_private(os.path.dirname(fp)):
+        return False
+    try:
+        st = os.lstat(fp)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid()
+
+
+def connect(fp):
+    """Connect to the socket at fp if it's safe to talk to what's there.
+
+    Returns the connected socket or None if there's no socket at fp, it's not
+    private to the user or the process listening isn't run by the user.
+    """
+    if not is_supported() or not socket_is_private(fp):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(fp)
+        if peer_is_user(sock):
+            return sock
+    except OSError:  # stale socket file
+        pass
+    sock.close()
+    return None
+
+
+def peer_is_user(sock):
+    """True if the process at the other end of sock is run by the user."""
+    if not is_supported():
+        return False
+    try:
+        cred = sock.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, _PEERCRED.size)
+    except OSError:
+        return False
+    _, uid, _ = _PEERCRED.unpack(cred)
+    return uid == os.getuid()
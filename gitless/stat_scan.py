@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# Gitless - a version control system built on top of Git
+# Licensed under MIT
+
+"""Parallel check of the working tree against the stat data in the index.
+
+To tell if a tracked file was modified, Git (and libgit2) first compare the
+stat data of the file with what's in its index entry: if they match, the file
+is unmodified. This means one lstat per tracked file, done one after the
+other. That's fine on a local disk, but on a network file system (e.g., NFS)
+each lstat is a round trip to the server.
+
+Here, the index is split into ranges of paths that are checked in parallel
+on a thread pool (os.lstat releases the GIL). What comes out are the paths
+whose stat data doesn't match (or can't be trusted), and only those need to be
+compared by content.
+"""
+
+import concurrent.futures
+import os
+import stat
+
+
+_NS = 10 ** 9
+
+# Entries whose mtime is this close to the mtime of the index (or newer) might
+# have been modified right after the index was written without their mtime
+# changing ("racy" entries), so they are always checked by content. Git does
+# this for the entries with the same mtime as the index, the margin also
+# covers file systems with coarse (1s) mtimes and an index written by a Git
+# that doesn't store nanoseconds
+_RACY_NS = _NS
+
+_MASK = 0xffffffff
+
+
+def changed_paths(root, entries, index_mtime_ns, workers, trust_ctime=True,
+                  trust_mode=True):
+    """Return the paths of the index entries that might have changed.
+
+    Args:
+      root: the root of the working tree.
+      entries: the index entries (see index_file.stat_entries).
+      index_mtime_ns: the mtime of the index file.
+      workers: the number of threads to use.
+      trust_ctime: if False, the ctime is not compared (core.trustctime).
+      trust_mode: if False, the executable bit is not compared (core.fileMode).
+
+    Paths are relative to root (str, with '/' as separator). Unmerged entries
+    and submodules are always included.
+    """
+    if not entries:
+        return []
+    root = os.fsencode(os.path.join(root, ''))
+    workers = max(1, min(workers, len(entries)))
+    size = -(-len(entries) // workers)  # ceil
+    ranges = [entries[i:i + size] for i in range(0, len(entries), size)]
+
+    def check(entries_range):
+        return _check_range(
+            root, entries_range, index_mtime_ns, trust_ctime, trust_mode)
+
+    if len(ranges) == 1:
+        results = [check(ranges[0])]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            results = list(pool.map(check, ranges))
+    return [os.fsdecode(path) for result in results for path in result]
+
+
+# Private functions
+
+
+def _check_range(root, entries, index_mtime_ns, trust_ctime, trust_mode):
+    changed = []
+    lstat = os.lstat
+    for path, st, stage in entries:
+        if stage or st.mode == 0o160000:  # unmerged or a submodule
+            changed.append(path)
+            continue
+        try:
+            wd_st = lstat(root + path)
+        except OSError:  # deleted (or a parent dir is now a file)
+            changed.append(path)
+            continue
+        mtime_ns = wd_st.st_mtime_ns
+        if (st.mtime * _NS + st.mtime_ns >= index_mtime_ns - _RACY_NS or
+                (mtime_ns // _NS) & _MASK != st.mtime or
+                mtime_ns % _NS != st.mtime_ns or
+                wd_st.st_size & _MASK != st.size or
+                wd_st.st_ino & _MASK != st.ino or
+                wd_st.st_uid & _MASK != st.uid or
+                wd_st.st_gid & _MASK != st.gid or
+                _mode(wd_st.st_mode, trust_mode) != _mode(st.mode, trust_mode)):
+            changed.append(path)
+            continue
+        if trust_ctime:
+            ctime_ns = wd_st.st_ctime_ns
+            if ((ctime_ns // _NS) & _MASK != st.ctime or
+                    ctime_ns % _NS != st.ctime_ns):
+                changed.append(path)
+    return changed
+
+
+def _mode(mode, trust_mode):
+    """Return mode as Git records it in the index."""
+    if stat.S_ISLNK(mode):
+        return 0o120000
+    if stat.S_ISREG(mode):
+        return 0o100755 if trust_mode and mode & 0o100 else 0o100644
+    return mode
@@ -4,15 +4,27 @@
 
 """Core unit tests."""
 
+import argparse
+import io
 import os
+import shutil
+import socket
 import sys
 import tempfile
+import threading
+import time
+import unittest
 from functools import wraps
 from subprocess import CalledProcessError
+from unittest import mock
+
+import pygit2
 
 import gitless.tests.utils as utils_lib
-from gitless import core
-from gitless.cli import gl, gl_track
+from gitless import (
+    core, index_file, run_dir, stat_scan, untracked_cache, watcher)
+from gitless.cli import (
+    completers, gl, gl_prompt, gl_track, gl_untrack, helpers)
 
 TRACKED_FP = 'f1'
 TRACKED_FP_CONTENTS_1 = 'f1-1\n'
@@ -294,6 +306,23 @@ class TestFileTrack(TestFile):
     def test_track_gitignore(self):
         self.__assert_track_untracked(GITIGNORE_FP)
 
+    def test_track_files(self):
+        self.curr_b.untrack_file(TRACKED_DIR_FP)
+        fps = [UNTRACKED_FP, TRACKED_DIR_FP, TRACKED_FP, NONEXISTENT_FP, IGNORED_FP]
+        errors = self.curr_b.track_files(fps)
+        self.assertEqual(
+            [TRACKED_FP, NONEXISTENT_FP, IGNORED_FP], sorted(errors, key=fps.index))
+        self.assertIsInstance(errors[NONEXISTENT_FP], KeyError)
+        self.assertIn('already tracked', str(errors[TRACKED_FP]))
+        self.assertIn('is ignored', str(errors[IGNORED_FP]))
+        for fp in [UNTRACKED_FP, TRACKED_DIR_FP]:
+            self.assertEqual(
+                core.GL_STATUS_TRACKED, self.curr_b.status_file(fp).type)
+        # (not assumed unchanged anymore)
+        self.assertIn(
+            'H ' + TRACKED_DIR_FP.replace(os.sep, '/'),
+            utils_lib.git('ls-files', '-v').splitlines())
+
     def test_delete_tracked(self):
         utils_lib.write_file(DELETED_TRACKED_FP, contents=DELETED_TRACKED_FP_CONTENTS)
         utils_lib.git(
@@ -306,6 +335,34 @@ class TestFileTrack(TestFile):
 
 class TestFileUntrack(TestFile):
 
+    def test_untrack_files(self):
+        self.curr_b.track_file(UNTRACKED_FP)
+        fps = [TRACKED_FP, TRACKED_DIR_DIR_FP, UNTRACKED_FP, UNTRACKED_DIR_FP]
+        errors = self.curr_b.untrack_files(fps)
+        self.assertEqual([UNTRACKED_DIR_FP], list(errors))
+        self.assertIn('already untracked', str(errors[UNTRACKED_DIR_FP]))
+        for fp in fps:
+            self.assertEqual(
+                core.GL_STATUS_UNTRACKED, self.curr_b.status_file(fp).type)
+        # Committed files are marked as assumed unchanged (Git sees it too)
+        au_fps = [
+            line[2:] for line in utils_lib.git('ls-files', '-v').splitlines()
+            if line.startswith('h ')]
+        self.assertEqual(
+            sorted([TRACKED_FP, TRACKED_DIR_DIR_FP.replace(os.sep, '/')]),
+            sorted(au_fps))
+        self.assertEqual({}, self.curr_b.track_files([TRACKED_FP]))
+        self.assertEqual(
+            core.GL_STATUS_TRACKED, self.curr_b.status_file(TRACKED_FP).type)
+
+    def test_untrack_split_index(self):
+        self.curr_b.untrack_file(TRACKED_FP)
+        # Some entries are in the shared index, so Git has to read it
+        utils_lib.git('update-index', '--split-index')
+        index_fp = os.path.join(self.repo.path, 'index')
+        self.assertRaises(ValueError, index_file.assumed_unchanged, index_fp)
+        self.assertEqual({TRACKED_FP}, self.repo._au_files())
+
     def __assert_untrack_tracked(self, *fps):
         root = self.repo.root
         for fp in fps:
@@ -474,8 +531,75 @@ class TestFileCheckout(TestFile):
         self.__assert_checkout_error(NONEXISTENT_FP, NONEXISTENT_FP_WITH_SPACE)
 
 
+class TestIndexSession(TestFile):
+
+    def setUp(self):
+        super(TestIndexSession, self).setUp()
+        self.index_fp = os.path.join(self.repo.path, 'index')
+
+    def test_no_changes(self):
+        stamp = index_file.stamp(self.index_fp)
+        with self.repo.index_session as index:
+            self.assertIn(TRACKED_FP, index)
+        self.assertRaises(ValueError, self.curr_b.track_file, TRACKED_FP)
+        self.assertEqual(stamp, index_file.stamp(self.index_fp))
+
+    def test_write_once(self):
+        stamp = index_file.stamp(self.index_fp)
+        with self.repo.index_session as index:
+            self.curr_b.track_file(UNTRACKED_FP)
+            self.curr_b.track_file(UNTRACKED_FP_WITH_SPACE)
+            self.assertTrue(index.changed)
+            self.assertEqual(stamp, index_file.stamp(self.index_fp))
+        self.assertFalse(index.changed)
+        self.assertNotEqual(stamp, index_file.stamp(self.index_fp))
+        tracked = utils_lib.git('ls-files').splitlines()
+        self.assertIn(UNTRACKED_FP, tracked)
+        self.assertIn(UNTRACKED_FP_WITH_SPACE, tracked)
+
+    def test_modified_by_another_process(self):
+        with self.assertRaisesRegex(core.GlError, 'modified by another'):
+            with self.repo.index_session:
+                self.curr_b.track_file(UNTRACKED_FP)
+                utils_lib.git('add', UNTRACKED_FP_WITH_SPACE)
+        self.assertFalse(self.repo.index_session.changed)
+        tracked = utils_lib.git('ls-files').splitlines()
+        self.assertNotIn(UNTRACKED_FP, tracked)
+        self.assertIn(UNTRACKED_FP_WITH_SPACE, tracked)
+        # The session picks up the index of the other process
+        self.assertIn(UNTRACKED_FP_WITH_SPACE, self.repo.index_session)
+        self.curr_b.track_file(UNTRACKED_FP)
+        self.assertIn(UNTRACKED_FP, utils_lib.git('ls-files').splitlines())
+
+    def test_loaded_once(self):
+        fps = [TRACKED_FP, TRACKED_FP_WITH_SPACE, TRACKED_DIR_FP] * 100
+        with mock.patch.object(
+                index_file, 'checksum', wraps=index_file.checksum) as checksum:
+            self.curr_b.status_files(fps)
+            self.assertEqual(1, checksum.call_count)
+            checksum.reset_mock()
+            self.curr_b.untrack_files(fps)
+            # (not once per path)
+            self.assertLess(checksum.call_count, 5)
+
+
 class TestFileStatus(TestFile):
 
+    def test_status_streams(self):
+        utils_lib.git('config', 'gitless.untrackedCache', 'false')
+        utils_lib.write_file(TRACKED_FP, contents='new contents')
+        expected = sorted(
+            (fp, st) for fp, st in self.repo.git_repo.status().items()
+            if st != pygit2.GIT_STATUS_IGNORED)
+        # The status comes from libgit2's deltas, not from a dict of all files
+        with mock.patch.object(core, '_git_status', side_effect=AssertionError):
+            self.assertEqual(
+                expected,
+                list(self.repo._git_status_items(None, True, True)))
+            self.assertEqual(
+                [fp for fp, _ in expected],
+                [f.fp for f in self.curr_b.status()])
+
     def test_status_all(self):
         st_all = self.curr_b.status()
         for fp, f_type, exists_at_head, exists_in_wd, modified, _ in st_all:
@@ -496,6 +620,237 @@ class TestFileStatus(TestFile):
         for f_st in self.curr_b.status():
             self.assertEqual(f_st, self.curr_b.status_file(f_st.fp))
 
+    def test_status_paths(self):
+        self.curr_b.untrack_file(TRACKED_DIR_DIR_FP)
+        os.remove(TRACKED_DIR_FP_WITH_SPACE)
+        st_all = list(self.curr_b.status())
+        for paths in [
+                [DIR], [DIR_DIR], [TRACKED_FP, DIR_DIR], [TRACKED_DIR_FP_WITH_SPACE],
+                [UNTRACKED_FP, NONEXISTENT_FP], [IGNORED_FP]]:
+            expected = [
+                f for f in st_all if any(
+                    f.fp == p or f.fp.startswith(p + '/') for p in paths)]
+            self.assertEqual(
+                sorted(expected), sorted(self.curr_b.status(paths)), paths)
+        self.assertEqual(sorted(st_all), sorted(self.curr_b.status(['.'])))
+
+    def test_status_modes(self):
+        self.curr_b.untrack_file(TRACKED_DIR_DIR_FP)
+        # Removed from the index but still in the working tree: tracked
+        utils_lib.git('rm', '--cached', TRACKED_FP)
+        utils_lib.git('rm', TRACKED_DIR_FP)
+        utils_lib.write_file(TRACKED_FP_WITH_SPACE, contents='contents')
+        st_all = list(self.curr_b.status())
+        for paths in [None, [DIR], [TRACKED_FP, UNTRACKED_FP]]:
+            expected = [
+                f for f in st_all if not paths or any(
+                    f.fp == p or f.fp.startswith(p + '/') for p in paths)]
+            self.assertEqual(
+                sorted(f for f in expected if f.type == core.GL_STATUS_TRACKED),
+                sorted(self.curr_b.status(paths, untracked=False)), paths)
+            self.assertEqual(
+                sorted(f for f in expected if f.type == core.GL_STATUS_UNTRACKED),
+                sorted(self.curr_b.status(paths, tracked=False)), paths)
+
+    def test_status_untracked_dirs(self):
+        untracked_dirs = ['udir/', DIR + '/udir/']
+        for d in untracked_dirs:
+            utils_lib.write_file(d + 'f')
+            utils_lib.write_file(d + 'sub/f')
+        st_all = list(self.curr_b.status())
+        self.assertEqual(sorted(st_all), st_all)
+        st_dirs = list(self.curr_b.status(untracked_dirs=True))
+        self.assertEqual(sorted(st_dirs), st_dirs)
+        for d in untracked_dirs:
+            self.assertIn(
+                self.curr_b.FileStatus(
+                    d, core.GL_STATUS_UNTRACKED, False, True, True, False),
+                st_dirs)
+        # Other untracked dirs get collapsed too (e.g., the one with symlinks)
+        collapsed = [f.fp for f in st_dirs if f.fp.endswith('/')]
+        self.assertEqual(
+            [f for f in st_all if not f.fp.startswith(tuple(collapsed))],
+            [f for f in st_dirs if f.fp not in collapsed])
+        self.assertEqual(
+            ['udir/sub/'],
+            [f.fp for f in self.curr_b.status(['udir/sub'], untracked_dirs=True)])
+
+    def test_has_modified_files(self):
+        def modify():
+            utils_lib.write_file(TRACKED_DIR_FP, contents='contents')
+
+        def stage():
+            modify()
+            utils_lib.git('add', TRACKED_DIR_FP)
+
+        def rm_cached():
+            utils_lib.git('rm', '--cached', TRACKED_DIR_FP)
+
+        self.assertFalse(self.curr_b.has_modified_files())
+        for change in [
+                modify, stage, lambda: os.remove(TRACKED_DIR_FP),
+                lambda: (rm_cached(), os.remove(TRACKED_DIR_FP)),
+                lambda: (rm_cached(), modify()),
+                lambda: (rm_cached(), os.chmod(TRACKED_DIR_FP, 0o755))]:
+            utils_lib.git('reset', '--hard')
+            change()
+            self.assertTrue(self.curr_b.has_modified_files())
+        utils_lib.git('reset', '--hard')
+        # A file deleted from the index that is still in the working tree as it
+        # is at head has no modifications to commit
+        rm_cached()
+        self.assertFalse(self.curr_b.has_modified_files())
+        utils_lib.git('reset', '--hard')
+        # Untracked files are not tracked files with modifications
+        self.curr_b.untrack_file(TRACKED_DIR_FP)
+        utils_lib.write_file(TRACKED_DIR_FP, contents='contents')
+        self.assertFalse(self.curr_b.has_modified_files())
+
+    def test_has_untracked_files(self):
+        self.assertTrue(self.curr_b.has_untracked_files())
+        utils_lib.git('clean', '-fdqx')
+        self.assertFalse(self.curr_b.has_untracked_files())
+        utils_lib.git('rm', '--cached', TRACKED_DIR_FP)  # tracked
+        self.assertFalse(self.curr_b.has_untracked_files())
+        self.curr_b.untrack_file(TRACKED_FP)
+        self.assertTrue(self.curr_b.has_untracked_files())
+
+    def test_status_list(self):
+        self.curr_b.untrack_file(TRACKED_DIR_FP)
+        os.remove(TRACKED_DIR_FP)
+        self.curr_b.untrack_file(TRACKED_DIR_DIR_FP)
+        utils_lib.write_file(TRACKED_FP, contents='contents')
+        utils_lib.write_file('udir/f')
+        for kwargs in [
+                {}, {'untracked_dirs': True}, {'tracked': False},
+                {'untracked': False}, {'paths': [DIR]}]:
+            expected = list(self.curr_b.status(**kwargs))
+            st_list = self.curr_b.status_list(**kwargs)
+            self.assertEqual(len(expected), len(st_list), kwargs)
+            self.assertEqual(expected, list(st_list), kwargs)
+            self.assertEqual(expected[-1], st_list[-1], kwargs)
+        self.assertRaises(IndexError, lambda: st_list[len(st_list)])
+
+    def test_status_workers(self):
+        st = os.stat(TRACKED_DIR_DIR_FP)
+        changes = [
+            lambda: utils_lib.write_file(TRACKED_FP, contents='contents'),
+            lambda: os.remove(TRACKED_DIR_FP),
+            lambda: os.chmod(TRACKED_FP_WITH_SPACE, 0o755),
+            lambda: self.curr_b.untrack_file(TRACKED_DIR_FP_WITH_SPACE),
+            lambda: utils_lib.git('rm', '--cached', TRACKED_DIR_DIR_FP),
+            lambda: utils_lib.git('add', TRACKED_DIR_DIR_FP),
+            # Same size and mtime, only the content tells
+            lambda: utils_lib.write_file(
+                TRACKED_DIR_DIR_FP, contents=TRACKED_FP_CONTENTS_1),
+            lambda: os.utime(TRACKED_DIR_DIR_FP, ns=(st.st_atime_ns, st.st_mtime_ns)),
+        ]
+        for change in changes:
+            change()
+            expected = sorted(self.curr_b.status())
+            utils_lib.git('config', 'gitless.statusWorkers', '4')
+            try:
+                self.assertEqual(expected, sorted(self.curr_b.status()))
+                self.assertEqual(
+                    [f for f in expected if f.type == core.GL_STATUS_TRACKED],
+                    sorted(self.curr_b.status(untracked=False)))
+            finally:
+                utils_lib.git('config', '--unset', 'gitless.statusWorkers')
+
+    def test_status_workers_stat_scan(self):
+        index_fp = os.path.join(REPO_DIR, 'index')
+        for fp in utils_lib.git('ls-files').splitlines():
+            st = os.stat(fp)  # so that no file is racy
+            os.utime(fp, ns=(st.st_atime_ns, st.st_mtime_ns - 10 * 10 ** 9))
+        utils_lib.git('update-index', '--refresh')
+        utils_lib.write_file(TRACKED_FP, contents='contents')
+        os.remove(TRACKED_DIR_FP)
+        changed = stat_scan.changed_paths(
+            self.repo.root, index_file.stat_entries(index_fp),
+            os.stat(index_fp).st_mtime_ns, 4)
+        self.assertEqual(
+            sorted([TRACKED_FP, TRACKED_DIR_FP.replace(os.sep, '/')]),
+            sorted(changed))
+
+    def test_status_workers_racy(self):
+        index_fp = os.path.join(REPO_DIR, 'index')
+        utils_lib.git('update-index', '--refresh')
+        mtime_ns = os.stat(TRACKED_FP).st_mtime_ns
+        # An index written half a second after the file was, on a file system
+        # where a change to the file in between might not change its mtime
+        os.utime(index_fp, ns=(mtime_ns, mtime_ns + 5 * 10 ** 8))
+        self.assertIn(TRACKED_FP, stat_scan.changed_paths(
+            self.repo.root, index_file.stat_entries(index_fp),
+            os.stat(index_fp).st_mtime_ns, 1))
+        os.utime(index_fp, ns=(mtime_ns, mtime_ns + 2 * 10 ** 9))
+        self.assertNotIn(TRACKED_FP, stat_scan.changed_paths(
+            self.repo.root, index_file.stat_entries(index_fp),
+            os.stat(index_fp).st_mtime_ns, 1))
+
+    def __stale_in_index(self, fp):
+        index_fp = os.path.join(REPO_DIR, 'index')
+        return fp in stat_scan.changed_paths(
+            self.repo.root, index_file.stat_entries(index_fp),
+            os.stat(index_fp).st_mtime_ns, 1)
+
+    def test_status_refresh(self):
+        st = os.stat(TRACKED_FP)
+        # Same contents, but the index has the old stat data
+        os.utime(TRACKED_FP, (st.st_atime - 100, st.st_mtime - 100))
+        self.assertTrue(self.__stale_in_index(TRACKED_FP))
+        utils_lib.git('config', 'gitless.refreshIndex', 'false')
+        self.assertEqual([], list(self.curr_b.status(untracked=False)))
+        self.assertTrue(self.__stale_in_index(TRACKED_FP))
+        utils_lib.git('config', 'gitless.refreshIndex', 'true')
+        for untracked in [True, False]:
+            self.assertFalse(any(
+                f.type == core.GL_STATUS_TRACKED
+                for f in self.curr_b.status(untracked=untracked)))
+            self.assertFalse(self.__stale_in_index(TRACKED_FP))
+            os.utime(TRACKED_FP, (st.st_atime - 200, st.st_mtime - 200))
+
+    def test_refresh_index(self):
+        st = os.stat(TRACKED_FP)
+        os.utime(TRACKED_FP, (st.st_atime - 100, st.st_mtime - 100))
+        utils_lib.write_file(TRACKED_DIR_FP, contents='contents')
+        self.repo.refresh_index()
+        self.assertFalse(self.__stale_in_index(TRACKED_FP))
+        self.assertTrue(self.__stale_in_index(TRACKED_DIR_FP))
+
+    def test_status_files(self):
+        self.curr_b.untrack_file(TRACKED_DIR_FP)
+        os.remove(TRACKED_FP_WITH_SPACE)
+        fps = [fp for fp in ALL_FPS_IN_WD if fp != SYMLINK_GIT] + [
+            NONEXISTENT_FP, TRACKED_FP_WITH_SPACE]
+        expected = {}
+        for fp in fps:
+            try:
+                expected[fp] = self.curr_b.status_file(fp)
+            except KeyError:
+                pass
+        self.assertNotIn(NONEXISTENT_FP, expected)
+        self.assertEqual(expected, self.curr_b.status_files(fps))
+
+    def test_status_au_index_versions(self):
+        self.curr_b.untrack_file(TRACKED_FP)
+        self.curr_b.untrack_file(TRACKED_DIR_DIR_FP_WITH_SPACE)
+        au_fps = {TRACKED_FP, TRACKED_DIR_DIR_FP_WITH_SPACE.replace(os.sep, '/')}
+        for version in ['2', '3', '4']:
+            utils_lib.git('update-index', '--index-version', version)
+            if version == '3':  # entries with extended flags are only in v3+
+                utils_lib.git('update-index', '--skip-worktree', TRACKED_DIR_FP)
+            # No need to ask git about au files
+            with mock.patch.object(core, 'git', side_effect=AssertionError):
+                self.assertEqual(au_fps, self.curr_b._au_files())
+                for fp in [TRACKED_FP, TRACKED_DIR_DIR_FP_WITH_SPACE]:
+                    st = self.curr_b.status_file(fp)
+                    self.assertEqual(core.GL_STATUS_UNTRACKED, st.type)
+                    self.assertTrue(st.exists_at_head)
+                st_all = {st.fp: st for st in self.curr_b.status()}
+                self.assertEqual(
+                    core.GL_STATUS_UNTRACKED, st_all[TRACKED_FP].type)
+                self.assertNotIn(TRACKED_DIR_FP, st_all)
+
     def test_status_nonexistent_fp(self):
         self.assertRaises(KeyError, self.curr_b.status_file, NONEXISTENT_FP)
         self.assertRaises(
@@ -608,6 +963,163 @@ class TestFileStatus(TestFile):
                 fp, field, expected, field, got))
 
 
+class TestUntrackedCache(TestFile):
+
+    def setUp(self):
+        super(TestUntrackedCache, self).setUp()
+        self.start = time.time()
+
+    def test_invalidation(self):
+        exclude_fp = os.path.join(REPO_DIR, 'info', 'exclude')
+        changes = [
+            lambda: utils_lib.write_file(os.path.join(DIR_DIR, 'new')),
+            lambda: os.remove(UNTRACKED_DIR_DIR_FP),
+            lambda: utils_lib.write_file(
+                os.path.join(DIR, GITIGNORE_FP), contents='f1*\n'),
+            lambda: utils_lib.write_file(
+                os.path.join(DIR, GITIGNORE_FP), contents='!f1*\n'),
+            lambda: utils_lib.write_file(exclude_fp, contents='*space\n'),
+            lambda: utils_lib.git('rm', '--cached', TRACKED_DIR_DIR_FP),
+            lambda: utils_lib.git('add', UNTRACKED_DIR_FP),
+            lambda: utils_lib.write_file(os.path.join('new', 'dir', 'f')),
+            lambda: utils_lib.write_file(GITIGNORE_FP, contents='new/\n'),
+            lambda: utils_lib.git('init', os.path.join(DIR, 'repo')),
+            lambda: utils_lib.write_file(os.path.join(DIR, 'repo', 'f')),
+            lambda: shutil.rmtree('new'),
+        ]
+        for change in changes:
+            change()
+            self.__age_dirs()
+            self.assertEqual(self.__libgit2_status(), sorted(self.curr_b.status()))
+            # Nothing changed, so nothing needs to be listed again
+            with mock.patch.object(
+                    untracked_cache._Scan, '_list', side_effect=AssertionError):
+                self.assertEqual(
+                    self.__libgit2_status(), sorted(self.curr_b.status()))
+
+    def test_ignore_rules(self):
+        utils_lib.write_file(GITIGNORE_FP, contents='\n'.join([
+            '# comment', '*.o', '!keep.o', '/rooted', 'dir_only/', 'a/**/z',
+            '**/deep', 'b/**', 'q?.txt', '[xy]c', '[!m]n', '\\#hash',
+            'trailing\\ ', 'sub/exact']))
+        fps = [
+            'x.o', 'keep.o', os.path.join(DIR, 'y.o'), 'rooted',
+            os.path.join(DIR, 'rooted'), os.path.join('dir_only', 'f'),
+            os.path.join(DIR, 'dir_only'), os.path.join('a', 'z'),
+            os.path.join('a', 'b', 'c', 'z'), os.path.join('c', 'deep'),
+            os.path.join('b', 'f'), 'qa.txt', 'qab.txt', 'xc', 'zc', 'mn',
+            'nn', '#hash', 'trailing ', os.path.join('sub', 'exact'),
+            os.path.join(DIR, 'sub', 'exact')]
+        for fp in fps:
+            utils_lib.write_file(fp)
+        self.assertEqual(self.__libgit2_status(), sorted(self.curr_b.status()))
+
+    def test_sorted(self):
+        for fp in ['a-c', os.path.join('a', 'b'), 'a.txt', 'a0', 'b']:
+            utils_lib.write_file(fp)
+        utils_lib.git('init', 'a.d')
+        utils_lib.write_file(os.path.join('a.d', 'f'))
+        st = list(self.curr_b.status())
+        self.assertEqual(sorted(st), st)
+        self.assertEqual(self.__libgit2_status(), st)
+
+    def __libgit2_status(self):
+        utils_lib.git('config', 'gitless.untrackedCache', 'false')
+        try:
+            return sorted(self.curr_b.status())
+        finally:
+            utils_lib.git('config', '--unset', 'gitless.untrackedCache')
+
+    def __age_dirs(self):
+        # Dir mtimes within the granularity of the file system's timestamps
+        # are not trusted, so move back the dirs that changed
+        for curr_dir, dirs, _ in os.walk('.'):
+            if REPO_DIR in dirs:
+                dirs.remove(REPO_DIR)
+            st = os.stat(curr_dir)
+            if st.st_mtime > self.start - 1:
+                os.utime(curr_dir, (st.st_atime, st.st_mtime - 1000))
+
+
+@unittest.skipUnless(watcher.is_supported(), 'needs inotify')
+class TestWatcher(TestFile):
+
+    def setUp(self):
+        super(TestWatcher, self).setUp()
+        env = mock.patch.dict(os.environ, {'XDG_RUNTIME_DIR': self.path})
+        env.start()
+        self.addCleanup(env.stop)
+        self.thread = threading.Thread(target=watcher.serve, args=(self.repo.root,))
+        self.thread.start()
+        while watcher.changes(self.repo.root, None) is None:
+            time.sleep(0.01)
+
+    def tearDown(self):
+        watcher.stop(self.repo.root)
+        self.thread.join()
+        super(TestWatcher, self).tearDown()
+
+    def test_status(self):
+        changes = [
+            lambda: utils_lib.write_file(TRACKED_DIR_FP, contents='contents'),
+            lambda: utils_lib.write_file(os.path.join(DIR_DIR, 'new')),
+            lambda: os.remove(UNTRACKED_DIR_DIR_FP),
+            lambda: os.remove(TRACKED_DIR_DIR_FP),
+            lambda: utils_lib.write_file(os.path.join('new', 'dir', 'f')),
+            lambda: os.rename('new', 'renamed'),
+            lambda: utils_lib.write_file(os.path.join('renamed', 'dir', 'f2')),
+            lambda: shutil.rmtree('renamed'),
+            lambda: utils_lib.write_file(TRACKED_DIR_FP, contents=TRACKED_FP_CONTENTS_2),
+        ]
+        self.assertEqual(self.__full_status(), sorted(self.curr_b.status()))
+        # What gl writes to the Git dir is not reported
+        token, _ = watcher.changes(self.repo.root, None)
+        utils_lib.write_file(os.path.join(REPO_DIR, 'f'))
+        list(self.curr_b.status())
+        self.assertEqual([], watcher.changes(self.repo.root, token)[1])
+        for change in changes:
+            change()
+            # Only the paths that changed are looked at
+            with mock.patch.object(
+                    core.Repository, '_git_status_items',
+                    side_effect=AssertionError):
+                st = sorted(self.curr_b.status())
+            self.assertEqual(self.__full_status(), st)
+
+    def test_status_index_change(self):
+        self.assertEqual(self.__full_status(), sorted(self.curr_b.status()))
+        self.curr_b.track_file(UNTRACKED_DIR_FP)
+        utils_lib.write_file(GITIGNORE_FP, contents=UNTRACKED_FP)
+        self.assertEqual(self.__full_status(), sorted(self.curr_b.status()))
+
+    def test_status_scoped(self):
+        utils_lib.write_file(TRACKED_DIR_FP, contents='contents')
+        full_st = self.__full_status()
+        # What these look at is less than the whole working tree the watched
+        # status looks at if it can't be used
+        with mock.patch.object(
+                core.Repository, '_watched_status', side_effect=AssertionError):
+            self.assertEqual(
+                [f for f in full_st if f.fp.startswith(DIR + '/')],
+                list(self.curr_b.status([DIR])))
+            self.assertEqual(
+                [f for f in full_st if f.type == core.GL_STATUS_TRACKED],
+                list(self.curr_b.status(untracked=False)))
+            self.assertTrue(self.curr_b.has_modified_files())
+
+    def test_run_dir_not_private(self):
+        os.chmod(run_dir.path(), 0o755)
+        try:
+            # The watcher can't be trusted, so it's as if there was none
+            self.assertIsNone(watcher.changes(self.repo.root, None))
+        finally:
+            os.chmod(run_dir.path(), 0o700)
+
+    def __full_status(self):
+        with mock.patch.object(watcher, 'changes', return_value=None):
+            return sorted(self.curr_b.status())
+
+
 class TestFileDiff(TestFile):
 
     @assert_status_unchanged(
@@ -747,6 +1259,86 @@ class TestFileDiff(TestFile):
         self.assertEqual('+', hunk.lines[1].origin)
         self.assertEqual('new line', hunk.lines[1].content)
 
+    def __loose_objects(self):
+        objects_dir = os.path.join(self.repo.path, 'objects')
+        return sum(
+            len(os.listdir(os.path.join(objects_dir, d)))
+            for d in os.listdir(objects_dir) if len(d) == 2)
+
+    def test_diff_no_loose_objects(self):
+        utils_lib.write_file(TRACKED_FP, contents='new contents')
+        utils_lib.write_file(UNTRACKED_FP, contents='new contents')
+        os.remove(TRACKED_DIR_FP)
+        loose_objects = self.__loose_objects()
+        for fp, line_stats in [
+                (TRACKED_FP, (1, 1)), (UNTRACKED_FP, (1, 0)),
+                (TRACKED_DIR_FP, (0, 1)), (TRACKED_FP_WITH_SPACE, (0, 0))]:
+            self.assertEqual(
+                line_stats, self.curr_b.diff_file(fp).line_stats[1:], fp)
+        self.assertEqual(loose_objects, self.__loose_objects())
+
+    def test_diff_filtered(self):
+        utils_lib.git('config', 'core.autocrlf', 'input')
+        loose_objects = self.__loose_objects()
+        # The line endings are converted, so there are no changes
+        utils_lib.write_file(
+            TRACKED_FP, contents=TRACKED_FP_CONTENTS_2.replace('\n', '\r\n'))
+        self.assertEqual(
+            (0, 0), self.curr_b.diff_file(TRACKED_FP).line_stats[1:])
+
+        utils_lib.write_file(TRACKED_FP, contents='new contents\r\n')
+        patch = self.curr_b.diff_file(TRACKED_FP)
+        self.assertEqual((1, 1), patch.line_stats[1:])
+        hunk = list(patch.hunks)[0]
+        self.assertEqual('new contents\n', hunk.lines[1].content)
+        self.assertEqual(loose_objects, self.__loose_objects())
+
+    def test_diff_files(self):
+        utils_lib.write_file(TRACKED_FP, contents='new contents')
+        utils_lib.write_file(UNTRACKED_FP, contents='new contents')
+        utils_lib.write_file(IGNORED_FP, contents='new contents')
+        utils_lib.write_file('new', contents='new fp contents\n')
+        self.curr_b.track_file('new')
+        new_dir_fp = os.path.join('new_dir', 'new')
+        utils_lib.write_file(new_dir_fp, contents='new fp contents\n')
+        self.curr_b.untrack_file(TRACKED_FP_WITH_SPACE)
+        utils_lib.append_to_file(TRACKED_FP_WITH_SPACE, contents='new line')
+        os.remove(TRACKED_DIR_FP)
+        loose_objects = self.__loose_objects()
+        fps = [
+            UNTRACKED_FP, TRACKED_FP, NONEXISTENT_FP, IGNORED_FP, 'new',
+            new_dir_fp, TRACKED_FP_WITH_SPACE, TRACKED_DIR_FP, TRACKED_DIR_FP_WITH_SPACE]
+        diffs = list(self.curr_b.diff_files(fps))
+        self.assertEqual(fps, [fp for fp, _ in diffs])
+        for fp, patch in diffs:
+            if fp == NONEXISTENT_FP:
+                self.assertIsNone(patch)
+                continue
+            expected = self.curr_b.diff_file(fp)
+            self.assertEqual(expected.line_stats, patch.line_stats, fp)
+            self.assertEqual(
+                [[(l.origin, l.content) for l in h.lines]
+                 for h in expected.hunks],
+                [[(l.origin, l.content) for l in h.lines]
+                 for h in patch.hunks], fp)
+        self.assertEqual(loose_objects, self.__loose_objects())
+
+    def test_diff_stats(self):
+        utils_lib.write_file(TRACKED_FP, contents='new contents')
+        utils_lib.append_to_file(TRACKED_FP_WITH_SPACE, contents='new line')
+        utils_lib.write_file(UNTRACKED_FP, contents='new\ncontents\n')
+        with open(UNTRACKED_FP_WITH_SPACE, 'wb') as f:
+            f.write(b'\x00binary\ncontents\n')
+        os.remove(TRACKED_DIR_FP)
+        loose_objects = self.__loose_objects()
+        self.assertEqual(
+            [(TRACKED_FP, 1, 1), (TRACKED_FP_WITH_SPACE, 1, 0),
+             (UNTRACKED_FP, 2, 0), (TRACKED_DIR_FP, 0, 1)],
+            list(self.curr_b.diff_stats([
+                TRACKED_FP, TRACKED_FP_WITH_SPACE, UNTRACKED_FP,
+                UNTRACKED_FP_WITH_SPACE, NONEXISTENT_FP, TRACKED_DIR_FP])))
+        self.assertEqual(loose_objects, self.__loose_objects())
+
 
 class TestFileResolve(TestFile):
 
@@ -772,6 +1364,11 @@ class TestFileResolve(TestFile):
             # we expect the merge to fail
             pass
 
+    def test_status_workers(self):
+        expected = sorted(self.curr_b.status())
+        utils_lib.git('config', 'gitless.statusWorkers', '4')
+        self.assertEqual(expected, sorted(self.curr_b.status()))
+
     @assert_no_side_effects(TRACKED_FP)
     def test_resolve_fp_with_no_conflicts(self):
         self.assertRaisesRegexp(
@@ -787,6 +1384,14 @@ class TestFileResolve(TestFile):
     def test_resolve_fp_with_conflicts(self):
         self.__assert_resolve_fp(FP_IN_CONFLICT, DIR_FP_IN_CONFLICT)
 
+    def test_resolve_files(self):
+        errors = self.curr_b.resolve_files(
+            [FP_IN_CONFLICT, TRACKED_FP, DIR_FP_IN_CONFLICT])
+        self.assertEqual([TRACKED_FP], list(errors))
+        self.assertIn('no conflicts', str(errors[TRACKED_FP]))
+        for fp in [FP_IN_CONFLICT, DIR_FP_IN_CONFLICT]:
+            self.assertFalse(self.curr_b.status_file(fp).in_conflict)
+
     def test_resolve_relative(self):
         self.__assert_resolve_fp(DIR_FP_IN_CONFLICT)
         os.chdir(DIR)
@@ -866,6 +1471,273 @@ class TestFilePathProcessor(TestFile):
             self.assertTrue(SYMLINK_FP in files)
             self.assertFalse(SYMLINK_TARGET_FP in files)
 
+    def test_path_processor_track_dir(self):
+        args = self.parser.parse_args(['track', DIR])
+        # Only the files that can be tracked
+        self.assertEqual(
+            [UNTRACKED_DIR_FP, UNTRACKED_DIR_FP_WITH_SPACE, UNTRACKED_DIR_DIR_FP,
+             UNTRACKED_DIR_DIR_FP_WITH_SPACE],
+            list(args.files))
+
+    def test_path_processor_untrack_dir(self):
+        parser = gl.build_parser([gl_untrack], self.repo)
+        args = parser.parse_args(['untrack', DIR])
+        self.assertEqual(
+            [TRACKED_DIR_FP, TRACKED_DIR_FP_WITH_SPACE, TRACKED_DIR_DIR_FP,
+             TRACKED_DIR_DIR_FP_WITH_SPACE],
+            list(args.files))
+
+    def test_path_processor_track_ignored_dir(self):
+        ignored_dir_fp = os.path.join('node_modules', 'lib', 'f')
+        utils_lib.write_file(ignored_dir_fp)
+        utils_lib.append_to_file(GITIGNORE_FP, contents='\nnode_modules/\n')
+        skipped = []
+        parser = argparse.ArgumentParser()
+        parser.add_argument(
+            'files', nargs='+', action=helpers.PathProcessor, repo=self.repo,
+            skip_dir_cb=skipped.append, walk_filter={'tracked': False})
+        files = list(parser.parse_args(['.']).files)
+        self.assertFalse(list(parser.parse_args(['node_modules']).files))
+        self.assertEqual(['node_modules', 'node_modules'], skipped)
+        self.assertNotIn(ignored_dir_fp, files)
+        self.assertNotIn(IGNORED_FP, files)
+        self.assertIn(UNTRACKED_FP, files)
+        self.assertIn(UNTRACKED_DIR_DIR_FP, files)
+        self.assertNotIn(TRACKED_FP, files)
+        self.assertFalse([fp for fp in files if fp.startswith(REPO_DIR + os.sep)])
+
+    def test_path_processor_pathspec_from_file(self):
+        for nul in (False, True):
+            sep = '\0' if nul else '\n'
+            with tempfile.NamedTemporaryFile(mode='w', delete=False) as f:
+                f.write(sep.join([UNTRACKED_FP_WITH_SPACE, '', DIR_DIR]) + sep)
+            try:
+                argv = ['track', UNTRACKED_FP, '--pathspec-from-file', f.name]
+                if nul:
+                    argv.append('--pathspec-file-nul')
+                files = list(self.parser.parse_args(argv).files)
+            finally:
+                os.remove(f.name)
+            self.assertEqual(
+                [UNTRACKED_FP, UNTRACKED_FP_WITH_SPACE, UNTRACKED_DIR_DIR_FP,
+                 UNTRACKED_DIR_DIR_FP_WITH_SPACE], files)
+
+    def test_path_processor_pathspec_from_stdin(self):
+        paths = '\0'.join([UNTRACKED_FP, UNTRACKED_DIR_FP_WITH_SPACE]).encode()
+        stdin = mock.Mock()
+        stdin.buffer = io.BufferedReader(io.BytesIO(paths))
+        # (so that paths are split across reads)
+        with mock.patch.object(helpers, '_PATHSPEC_CHUNK_SIZE', 3), \
+                mock.patch.object(sys, 'stdin', stdin):
+            args = self.parser.parse_args(
+                ['track', '--pathspec-from-file', '-', '--pathspec-file-nul'])
+            files = list(args.files)
+        self.assertEqual([UNTRACKED_FP, UNTRACKED_DIR_FP_WITH_SPACE], files)
+
+    def test_path_processor_no_paths(self):
+        args = self.parser.parse_args(['track'])
+        with self.assertRaisesRegex(ValueError, 'arguments are required'):
+            list(args.files)
+        args = self.parser.parse_args(['track', '--pathspec-from-file', 'nope'])
+        with self.assertRaisesRegex(ValueError, 'can\'t read nope'):
+            list(args.files)
+
+    def test_build_parser_does_not_open_repo(self):
+        with mock.patch.object(core, 'Repository', side_effect=AssertionError):
+            parser = gl.build_parser(gl.load_subcommands())
+            self.assertRaises(SystemExit, parser.parse_args, ['--version'])
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'needs fork')
+class TestPrompt(TestCore):
+
+    def test_budget_kills_work(self):
+        def segments(repo, counts, add):
+            add('master')
+            time.sleep(60)  # (stuck, e.g., in libgit2)
+
+        pids = []
+        fork = os.fork
+
+        def record_fork():
+            pid = fork()
+            pids.append(pid)
+            return pid
+
+        args = argparse.Namespace(counts=False, budget=200)
+        t = time.monotonic()
+        with mock.patch.object(gl_prompt, '_segments', side_effect=segments), \
+                mock.patch('os.fork', side_effect=record_fork), \
+                mock.patch('sys.stdout', new_callable=io.StringIO) as out:
+            self.assertTrue(gl_prompt.main(args, self.repo))
+        self.assertLess(time.monotonic() - t, 10)
+        self.assertEqual('master ?\n', out.getvalue())
+        # The work was killed and waited for
+        self.assertRaises(ProcessLookupError, os.kill, pids[0], 0)
+
+    def test_read_only(self):
+        utils_lib.write_file('f', contents='f')
+        utils_lib.git('add', 'f')
+        utils_lib.git('commit', '-m', 'f')
+        # The stat data in the index is stale, so a status would refresh it
+        st = os.stat('f')
+        os.utime('f', ns=(st.st_atime_ns, st.st_mtime_ns - 10 * 10 ** 9))
+        utils_lib.write_file('u')
+        index_fp = os.path.join(self.repo.path, 'index')
+        index_mtime_ns = os.stat(index_fp).st_mtime_ns
+
+        def written():
+            return sorted(
+                fp for fp in os.listdir(self.repo.path)
+                if fp.endswith(('.lock', '.tmp')) or
+                fp == untracked_cache.CACHE_FILE)
+
+        list_dir = untracked_cache._Scan._list
+
+        def slow_list(scan, rel_dir):
+            ret = list_dir(scan, rel_dir)
+            time.sleep(60)
+            return ret
+
+        # Killed once the budget runs out
+        args = argparse.Namespace(counts=True, budget=500)
+        with mock.patch.object(
+                untracked_cache._Scan, '_list', autospec=True,
+                side_effect=slow_list), \
+                mock.patch('sys.stdout', new_callable=io.StringIO) as out:
+            gl_prompt.main(args, self.repo)
+        self.assertTrue(out.getvalue().endswith('?\n'))
+        self.assertEqual([], written())
+        # Done
+        args.budget = None
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as out:
+            gl_prompt.main(args, self.repo)
+        self.assertTrue(out.getvalue().endswith(' %1\n'))
+        self.assertEqual([], written())
+        self.assertEqual(index_mtime_ns, os.stat(index_fp).st_mtime_ns)
+
+        # (a status that can write does)
+        self.repo.read_only = False
+        list(self.repo.current_branch.status())
+        self.assertEqual([untracked_cache.CACHE_FILE], written())
+        self.assertNotEqual(index_mtime_ns, os.stat(index_fp).st_mtime_ns)
+
+
+@unittest.skipIf(sys.platform == 'win32', 'needs head')
+class TestPager(TestCore):
+
+    def __page(self, lines):
+        written = []
+        with tempfile.TemporaryFile(mode='w+') as stdout:
+            stdout.isatty = lambda: True
+            with mock.patch.object(sys, 'stdout', stdout), \
+                    helpers.Pager(self.repo) as out:
+                for i in range(0, lines):
+                    out.write('line {0}\n'.format(i))
+                    written.append(i)
+            stdout.seek(0)
+            return written, stdout.read()
+
+    def test_page(self):
+        utils_lib.git('config', 'core.pager', 'cat')
+        written, out = self.__page(1000)
+        self.assertEqual(1000, len(written))
+        self.assertEqual(
+            ''.join('line {0}\n'.format(i) for i in range(0, 1000)), out)
+
+    def test_pager_exits(self):
+        utils_lib.git('config', 'core.pager', 'head -n 2')
+        written, out = self.__page(10 ** 7)
+        self.assertTrue(len(written) < 10 ** 7)
+        self.assertEqual('line 0\nline 1\n', out)
+
+
+@unittest.skipUnless(run_dir.is_supported(), 'needs SO_PEERCRED')
+class TestRunDir(TestCore):
+
+    def setUp(self):
+        super(TestRunDir, self).setUp()
+        xdg_run_dir = tempfile.mkdtemp(prefix='gl-test-run')
+        self.addCleanup(utils_lib.rmtree, xdg_run_dir)
+        env = mock.patch.dict(os.environ, {'XDG_RUNTIME_DIR': xdg_run_dir})
+        env.start()
+        self.addCleanup(env.stop)
+
+    def __listen(self):
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(listener.close)
+        fp = os.path.join(run_dir.path(), 'test.sock')
+        listener.bind(fp)
+        listener.listen(1)
+        return fp
+
+    def test_make(self):
+        fp = run_dir.make()
+        self.assertEqual(0o700, os.stat(fp).st_mode & 0o777)
+        sock = run_dir.connect(self.__listen())
+        self.assertTrue(sock)
+        sock.close()
+
+    def test_not_private(self):
+        os.mkdir(run_dir.path())
+        os.chmod(run_dir.path(), 0o755)
+        self.assertRaises(run_dir.RunDirError, run_dir.make)
+        self.assertIsNone(run_dir.connect(self.__listen()))
+
+    def test_symlink(self):
+        target = tempfile.mkdtemp(prefix='gl-test-run')
+        self.addCleanup(utils_lib.rmtree, target)
+        os.symlink(target, run_dir.path())
+        self.assertRaises(run_dir.RunDirError, run_dir.make)
+
+    def test_peer_is_user(self):
+        a, b = socket.socketpair()
+        with a, b:
+            self.assertTrue(run_dir.peer_is_user(a))
+
+    def test_daemon_env(self):
+        self.assertEqual(
+            {'HOME': 'h', 'GIT_DIR': 'd', 'LC_ALL': 'C'},
+            gl.daemon_env({
+                'HOME': 'h', 'GIT_DIR': 'd', 'LC_ALL': 'C', 'GITHUB_TOKEN': 't',
+                'AWS_SECRET_ACCESS_KEY': 'k'}))
+
+
+class TestCompleters(TestCore):
+
+    def setUp(self):
+        super(TestCompleters, self).setUp()
+        utils_lib.git('branch', 'packed-b')
+        utils_lib.git('tag', 'packed-t')
+        utils_lib.git('pack-refs', '--all')
+        utils_lib.git('branch', 'loose-b')
+        utils_lib.git('tag', 'loose-t')
+        utils_lib.git('remote', 'add', 'origin', self.path)
+
+    def test_branches(self):
+        self.assertEqual(
+            ['loose-b', 'master', 'packed-b'], completers.branches(''))
+        self.assertEqual(['packed-b'], completers.branches('p'))
+
+    def test_tags(self):
+        self.assertEqual(['loose-t', 'packed-t'], completers.tags(''))
+        self.assertEqual(['loose-t'], completers.tags('l'))
+
+    def test_remotes(self):
+        self.assertEqual(['origin'], completers.remotes(''))
+        self.assertEqual([], completers.remotes('x'))
+
+    def test_packed_refs_change(self):
+        self.assertEqual(['packed-b'], completers.branches('p'))
+        utils_lib.git('branch', 'packed-b2')
+        utils_lib.git('pack-refs', '--all')
+        self.assertEqual(['packed-b', 'packed-b2'], completers.branches('p'))
+
+    def test_subdir(self):
+        os.mkdir(DIR)
+        os.chdir(DIR)
+        self.assertEqual(['loose-t', 'packed-t'], completers.tags(''))
+
 
 # Unit tests for branch related operations
 
@@ -4,14 +4,21 @@
 
 """End-to-end test."""
 
+import json
 import logging
 import os
 import re
+import subprocess
 import sys
 import tempfile
 import time
+import tracemalloc
+import unittest
 from subprocess import CalledProcessError
+from unittest import mock
 
+from gitless import core
+from gitless.cli import gl_diff
 from gitless.tests import utils
 
 
@@ -75,6 +82,195 @@ class TestNotInRepo(utils.TestBase):
             'publish', 'history', 'ignore')
 
 
+class TestSubcommands(TestEndToEnd):
+
+    def test_help_lists_all(self):
+        from gitless.cli import gl
+        for out in (utils.gl(), utils.gl('--help')):
+            for name, _, _ in gl.SUBCOMMANDS:
+                self.assertIn(name, out)
+
+    def test_alias(self):
+        utils.write_file('file1', 'Contents of file1')
+        utils.gl('tr', 'file1')
+        self.assertIn('file1', utils.gl('st'))
+        self.assertRaises(CalledProcessError, utils.gl, 'nonexistent-subcommand')
+
+
+class TestBatch(TestEndToEnd):
+
+    def test_batch(self):
+        utils.write_file('file1', 'Contents of file1')
+        utils.write_file('file 2', 'Contents of file 2')
+        out = utils.gl('batch', _in=(
+            '# a comment\n'
+            'track file1 "file 2"\n'
+            '\n'
+            'gl commit -m "first commit"\n'
+            'tag -c tag1\n'
+            'branch -c branch1\n'))
+        self.assertIn('2: gl track file1 \'file 2\'', out)
+        self.assertIn('6: gl branch -c branch1', out)
+        self.assertIn('first commit', utils.gl('history'))
+        self.assertIn('tag1', utils.gl('tag'))
+        self.assertIn('branch1', utils.gl('branch'))
+
+    def test_batch_errors(self):
+        utils.write_file('file1', 'Contents of file1')
+        cmds = 'track non-existent\ntrack file1\nbatch\n'
+        self.assertRaisesRegexp(
+            CalledProcessError, r'1: gl track non-existent \(exit status 1\)',
+            utils.gl, 'batch', _in=cmds)
+        self.assertIn('file1', utils.gl('status'))
+        self.assertRaisesRegexp(
+            CalledProcessError, 'can\'t be run from a batch', utils.gl, 'batch',
+            _in=cmds)
+
+        utils.gl('untrack', 'file1')
+        self.assertRaisesRegexp(
+            CalledProcessError, 'skipped the 2 remaining',
+            utils.gl, 'batch', '--stop-on-error', _in=cmds)
+        self.assertRaises(
+            CalledProcessError, utils.gl, 'untrack', 'file1')  # still untracked
+
+    def test_batch_path_errors(self):
+        # Errors in the paths are only found once the command runs, they
+        # shouldn't abort the batch
+        utils.write_file('file1', 'Contents of file1')
+        cmds = 'track\ntrack --pathspec-from-file non-existent\ntrack file1\n'
+        self.assertRaisesRegexp(
+            CalledProcessError, r'2: gl track --pathspec-from-file',
+            utils.gl, 'batch', _in=cmds)
+        self.assertIn('file1', utils.gl('status'))
+        utils.gl('untrack', 'file1')  # the last command was run
+
+    def test_batch_null(self):
+        utils.write_file('file\n1', 'Contents of file 1')
+        utils.gl('batch', '-z', _in='track\0file\n1\0\0commit\0-m\0first\0\0')
+        self.assertIn('first', utils.gl('history'))
+
+
+@unittest.skipIf(sys.platform == 'win32', 'gl daemon is not supported on Windows')
+class TestDaemon(TestEndToEnd):
+
+    def setUp(self):
+        super(TestDaemon, self).setUp()
+        self.run_dir = tempfile.mkdtemp(prefix='gl-e2e-test-run')
+        self.old_run_dir = os.environ.get('XDG_RUNTIME_DIR')
+        os.environ['XDG_RUNTIME_DIR'] = self.run_dir
+        self.daemon = subprocess.Popen(
+            ['gl', 'daemon'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        socket_fp = os.path.join(self.run_dir, 'gitless', 'daemon.sock')
+        for _ in range(100):
+            if os.path.exists(socket_fp):
+                break
+            time.sleep(0.1)
+
+    def tearDown(self):
+        utils.gl('daemon', '--stop')
+        self.daemon.wait()
+        if self.old_run_dir is None:
+            del os.environ['XDG_RUNTIME_DIR']
+        else:
+            os.environ['XDG_RUNTIME_DIR'] = self.old_run_dir
+        utils.rmtree(self.run_dir)
+        super(TestDaemon, self).tearDown()
+
+    def test_daemon(self):
+        utils.write_file('file1', 'Contents of file1')
+        self.assertIn('file1', utils.gl('status'))
+        # The index changes, so the daemon has to pick up the new state
+        utils.gl('track', 'file1')
+        utils.gl('commit', '-m', 'file1 commit')
+        self.assertIn('file1 commit', utils.gl('history'))
+        utils.git('branch', 'branch1')
+        self.assertIn('branch1', utils.gl('branch'))
+        self.assertRaises(CalledProcessError, utils.gl, 'track', 'file1')
+        self.assertRaisesRegexp(
+            CalledProcessError, 'not in a Gitless repository', utils.gl, 'status',
+            cwd=self.run_dir)
+        self.assertIsNone(self.daemon.poll())
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'needs inotify')
+class TestWatch(TestEndToEnd):
+
+    def setUp(self):
+        super(TestWatch, self).setUp()
+        self.run_dir = tempfile.mkdtemp(prefix='gl-e2e-test-run')
+        self.old_run_dir = os.environ.get('XDG_RUNTIME_DIR')
+        os.environ['XDG_RUNTIME_DIR'] = self.run_dir
+        self.watcher = subprocess.Popen(
+            ['gl', 'watch'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        wait_for_watcher(self.run_dir)
+
+    def tearDown(self):
+        utils.gl('watch', '--stop')
+        self.watcher.wait()
+        if self.old_run_dir is None:
+            del os.environ['XDG_RUNTIME_DIR']
+        else:
+            os.environ['XDG_RUNTIME_DIR'] = self.old_run_dir
+        utils.rmtree(self.run_dir)
+        super(TestWatch, self).tearDown()
+
+    def test_watch(self):
+        utils.write_file('file1', 'Contents of file1')
+        self.assertIn('file1', utils.gl('status'))
+        utils.gl('commit', 'file1', '-m', 'file1 commit')
+        self.assertNotIn('file1', utils.gl('status'))
+        utils.write_file('file1', 'New contents of file1')
+        utils.write_file(os.path.join('dir', 'file2'))
+        st = utils.gl('status', '--expand')
+        self.assertIn('file1', st)
+        self.assertIn(os.path.join('dir', 'file2'), st)
+        self.assertRaisesRegexp(
+            CalledProcessError, 'already running', utils.gl, 'watch')
+        self.assertIsNone(self.watcher.poll())
+
+
+def wait_for_watcher(run_dir):
+    """Wait until the watcher started with XDG_RUNTIME_DIR=run_dir listens."""
+    socket_dir = os.path.join(run_dir, 'gitless')
+    for _ in range(100):
+        if os.path.isdir(socket_dir) and os.listdir(socket_dir):
+            break
+        time.sleep(0.1)
+
+
+class TestPrompt(TestEndToEnd):
+
+    def test_prompt(self):
+        self.assertEqual('master\n', utils.gl('prompt'))
+        utils.write_file('file1', 'Contents of file1')
+        self.assertEqual('master %\n', utils.gl('prompt'))
+        utils.gl('commit', 'file1', '-m', 'file1 commit')
+        utils.write_file('file1', 'New contents of file1')
+        utils.write_file('file2')
+        utils.write_file('file3')
+        self.assertEqual('master * %\n', utils.gl('pr'))
+        self.assertEqual('master *1 %2\n', utils.gl('prompt', '--counts'))
+        # What isn't ready when the budget runs out is a ?
+        self.assertTrue(utils.gl('prompt', '--budget', '0').endswith('?\n'))
+
+    def test_prompt_upstream(self):
+        utils.gl('branch', '-c', 'other')
+        utils.git('branch', '--set-upstream-to', 'other')
+        utils.write_file('file1', 'Contents of file1')
+        utils.gl('commit', 'file1', '-m', 'file1 commit')
+        self.assertEqual('master ↑1\n', utils.gl('prompt'))
+
+    def test_prompt_not_in_repo(self):
+        not_repo_dir = tempfile.mkdtemp(prefix='gl-e2e-test-not-repo')
+        try:
+            with self.assertRaises(CalledProcessError) as cm:
+                utils.gl('prompt', cwd=not_repo_dir)
+            self.assertEqual('', cm.exception.stdout)
+            self.assertEqual('', cm.exception.stderr)
+        finally:
+            utils.rmtree(not_repo_dir)
+
+
 class TestBasic(TestEndToEnd):
 
     def test_basic_functionality(self):
@@ -180,6 +376,14 @@ class TestBasic(TestEndToEnd):
         utils.gl('commit', '-m', 'fixed conflicts')
 
 
+    def test_track_same_file_twice(self):
+        utils.write_file('file1', 'Contents of file1')
+        out = utils.gl('track', 'file1', 'file1', '.')
+        self.assertEqual(1, out.count('File file1 is now a tracked file'))
+        out = utils.gl('untrack', 'file1', 'file1')
+        self.assertEqual(1, out.count('File file1 is now an untracked file'))
+
+
 class TestCommit(TestEndToEnd):
     TRACKED_FP = 'file1'
     DIR_TRACKED_FP = 'dir/dir_file'
@@ -263,6 +467,26 @@ class TestCommit(TestEndToEnd):
         h = utils.gl('history', '-v')
         self.assertIn("Signed-off-by: ", h)
 
+    def test_commit_pathspec_from_file(self):
+        utils.gl(
+            'commit', '-m', 'msg', '--pathspec-from-file', '-',
+            _in='{0}\n{1}\n'.format(self.TRACKED_FP, self.UNTRACKED_FP))
+        self.__assert_commit(self.TRACKED_FP, self.UNTRACKED_FP)
+
+    def test_commit_pathspec_file_nul(self):
+        fp = 'dir/f\nnewline'
+        utils.write_file(fp)
+        utils.gl(
+            'untrack', '--pathspec-from-file', '-', '--pathspec-file-nul',
+            _in='{0}\0'.format(self.DIR_TRACKED_FP))
+        utils.gl(
+            'track', self.UNTRACKED_FP, '--pathspec-from-file', '-',
+            '--pathspec-file-nul', _in=fp)
+        utils.gl('commit', '-m', 'msg')
+        self.__assert_commit(self.TRACKED_FP, self.UNTRACKED_FP)
+        self.assertIn(
+            fp, utils.git('ls-tree', '-r', '-z', '--name-only', 'HEAD').split('\0'))
+
     def __assert_commit(self, *expected_committed):
         h = utils.gl('history', '-v')
         for fp in expected_committed:
@@ -304,6 +528,93 @@ class TestStatus(TestEndToEnd):
         if (self.UNTRACKED_DIR_FP in st) or (rel_untracked not in st):
             self.fail()
 
+    def test_status_paths(self):
+        utils.write_file('file3')
+        os.remove(self.TRACKED_DIR_FP)
+        st = utils.gl('status', self.DIR)
+        self.assertIn(self.TRACKED_DIR_FP + ' (deleted)', st)
+        self.assertIn(self.UNTRACKED_DIR_FP, st)
+        self.assertNotIn('file3', st)
+        st = utils.gl('status', 'file3')
+        self.assertIn('file3', st)
+        self.assertNotIn(self.UNTRACKED_DIR_FP, st)
+
+    def test_status_cwd(self):
+        utils.write_file('file3')
+        os.chdir(self.DIR)
+        self.assertIn('file3', utils.gl('status'))
+        st = utils.gl('status', '--cwd')
+        self.assertNotIn('file3', st)
+        self.assertIn('file2', st)
+        utils.git('config', 'gitless.statusCwdOnly', 'true')
+        self.assertNotIn('file3', utils.gl('status'))
+        self.assertIn('file3', utils.gl('status', '..'))
+
+    def test_status_modes(self):
+        utils.write_file('file3')
+        utils.write_file(self.TRACKED_DIR_FP, contents='contents')
+        st = utils.gl('status', '--tracked')
+        self.assertIn(self.TRACKED_DIR_FP, st)
+        self.assertNotIn('file3', st)
+        self.assertNotIn('Untracked files', st)
+        st = utils.gl('status', '--untracked')
+        self.assertIn('file3', st)
+        self.assertNotIn(self.TRACKED_DIR_FP, st)
+        self.assertNotIn('Tracked files', st)
+        self.assertRaises(
+            CalledProcessError, utils.gl, 'status', '--tracked', '--untracked')
+
+    def test_status_untracked_dirs(self):
+        utils.write_file(os.path.join('udir', 'f'))
+        utils.write_file(os.path.join('udir', 'sub', 'f'))
+        st = utils.gl('status')
+        self.assertIn('udir' + os.sep, st)
+        self.assertNotIn(os.path.join('udir', 'f'), st)
+        st = utils.gl('status', '--expand')
+        self.assertIn(os.path.join('udir', 'f'), st)
+        self.assertIn(os.path.join('udir', 'sub', 'f'), st)
+        os.chdir('udir')
+        self.assertIn('.' + os.sep, utils.gl('status'))
+
+    def test_status_porcelain(self):
+        utils.write_file(self.TRACKED_DIR_FP, contents='contents')
+        utils.write_file('file3')
+        utils.write_file(os.path.join('udir', 'f'))
+        self.assertEqual(
+            'TM dir/file1\n?  dir/file2\n?  file3\n?  udir/\n',
+            utils.gl('status', '--porcelain'))
+        self.assertEqual(
+            'TM dir/file1\n', utils.gl('status', '--porcelain', '--tracked'))
+        self.assertIn(
+            '?  udir/f\n', utils.gl('status', '--porcelain', '--expand'))
+        os.chdir(self.DIR)
+        self.assertEqual(
+            'TM dir/file1\n?  dir/file2\n',
+            utils.gl('status', '--porcelain', '--cwd'))
+
+    def test_status_json_lines(self):
+        os.remove(self.TRACKED_DIR_FP)
+        lines = utils.gl('status', '--json-lines').splitlines()
+        self.assertEqual(
+            [{'path': 'dir/file1', 'type': 'tracked', 'exists_at_head': True,
+              'exists_in_wd': False, 'in_conflict': False},
+             {'path': 'dir/file2', 'type': 'untracked', 'exists_at_head': False,
+              'exists_in_wd': True, 'in_conflict': False}],
+            [json.loads(line) for line in lines])
+        self.assertRaises(
+            CalledProcessError, utils.gl, 'status', '--json-lines', '--porcelain')
+
+    def test_status_refresh(self):
+        st = os.stat(self.TRACKED_DIR_FP)
+        os.utime(self.TRACKED_DIR_FP, (st.st_atime - 100, st.st_mtime - 100))
+        # (diff-files doesn't refresh the index, so it lists stat changes)
+        self.assertIn(self.TRACKED_DIR_FP, utils.git('diff-files', '--name-only'))
+        st = utils.gl('status', '--refresh')
+        self.assertNotIn(self.TRACKED_DIR_FP, st)
+        self.assertIn(self.UNTRACKED_DIR_FP, st)
+        self.assertNotIn(
+            self.TRACKED_DIR_FP, utils.git('diff-files', '--name-only'))
+
 
 class TestBranch(TestEndToEnd):
     BRANCH_1 = 'branch1'
@@ -439,6 +750,36 @@ class TestDiffFile(TestEndToEnd):
         if '+contents' not in out:
             self.fail()
 
+    def test_diff_jobs(self):
+        fps = ['f' + str(i) for i in range(0, 300)]
+        for fp in fps:
+            utils.write_file(fp, contents='contents')
+        utils.git('add', *fps)
+        utils.git('commit', '-m', 'commit')
+        for fp in fps[::2]:
+            utils.write_file(fp, contents='new contents')
+        out = utils.gl('diff', '-j', '1')
+        self.assertIn('Total of 150 lines added', out)
+        self.assertEqual(out, utils.gl('diff', '-j', '2'))
+
+    def test_diff_jobs_tmp_files(self):
+        fps = ['f' + str(i) for i in range(0, 4)]
+        for fp in fps:
+            utils.write_file(fp, contents='contents')
+        utils.git('add', *fps)
+        utils.git('commit', '-m', 'commit')
+        for fp in fps:
+            utils.write_file(fp, contents='new contents')
+        tmp_dir = tempfile.mkdtemp(dir=self.path)
+        # (the worker processes are forked, so they get the mocks too)
+        with mock.patch.object(tempfile, 'tempdir', tmp_dir), \
+                mock.patch.object(gl_diff, '_BATCH_SIZE', 1), \
+                mock.patch('gitless.core.Branch.diff_files',
+                           side_effect=RuntimeError('boom')):
+            with self.assertRaisesRegex(RuntimeError, 'boom'):
+                gl_diff._parallel_diff(fps, 2, core.Repository())
+        self.assertEqual([], os.listdir(tmp_dir))
+
     def test_diff_non_ascii(self):
         if sys.platform == 'win32':
             # Skip this test on Windows until we fix Unicode support
@@ -773,6 +1114,253 @@ class TestPerformance(TestEndToEnd):
         logging.info('Done')
         assert_status_performance()
 
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'needs inotify')
+    def test_status_watcher_performance(self):
+        utils.git('add', '.')
+        utils.git('commit', '-m', 'commit')
+
+        def time_status(runs=3):
+            ts = []
+            for _ in range(runs):
+                t = time.time()
+                utils.gl('status')
+                ts.append(time.time() - t)
+            return min(ts)
+
+        no_watcher_t = time_status()
+        run_dir = tempfile.mkdtemp(prefix='gl-e2e-test-run')
+        old_run_dir = os.environ.get('XDG_RUNTIME_DIR')
+        os.environ['XDG_RUNTIME_DIR'] = run_dir
+        watcher = subprocess.Popen(
+            ['gl', 'watch'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_watcher(run_dir)
+            time_status(1)  # the first status with the watcher looks at everything
+            watcher_t = time_status()
+        finally:
+            utils.gl('watch', '--stop')
+            watcher.wait()
+            if old_run_dir is None:
+                del os.environ['XDG_RUNTIME_DIR']
+            else:
+                os.environ['XDG_RUNTIME_DIR'] = old_run_dir
+            utils.rmtree(run_dir)
+        logging.info('status: {0} without watcher, {1} with watcher'.format(
+            no_watcher_t, watcher_t))
+        self.assertTrue(
+            watcher_t < no_watcher_t,
+            msg='watcher_t {0}, no_watcher_t {1}'.format(watcher_t, no_watcher_t))
+
+    def test_status_untracked_cache_performance(self):
+        # A tree with many dirs (where the cache saves listing each one).
+        # Timed in-process, the time of a gl status subprocess is mostly that
+        # of starting it
+        for i in range(0, 500):
+            for j in range(0, 10):
+                utils.write_file(os.path.join('d' + str(i), 'e', 'f' + str(j)))
+        # Dir mtimes within the granularity of the file system's timestamps are
+        # not trusted by the cache, so move them back
+        old = time.time() - 100
+        for curr_dir, dirs, _ in os.walk('.'):
+            if '.git' in dirs:
+                dirs.remove('.git')
+            os.utime(curr_dir, (old, old))
+        repo = core.Repository()
+        cache_fp = os.path.join(repo.path, 'GL_UNTRACKED_CACHE')
+
+        def time_untracked_files(cold):
+            if cold and os.path.exists(cache_fp):
+                os.remove(cache_fp)
+            t = time.time()
+            fps = list(repo._untracked_files())
+            return time.time() - t, fps
+
+        cold_t, cold_fps = min(time_untracked_files(True) for _ in range(0, 3))
+        time_untracked_files(False)
+        # Nothing changed, so no dir is listed again
+        with mock.patch(
+                'gitless.untracked_cache._Scan._list',
+                side_effect=AssertionError):
+            warm_t, warm_fps = min(
+                time_untracked_files(False) for _ in range(0, 3))
+            st = list(repo.current_branch.status())
+        logging.info('untracked files: {0} cold, {1} warm'.format(
+            cold_t, warm_t))
+        self.assertEqual(cold_fps, warm_fps)
+        self.assertEqual(
+            warm_fps,
+            [f.fp for f in st if f.type == core.GL_STATUS_UNTRACKED])
+        self.assertTrue(
+            warm_t < cold_t,
+            msg='warm_t {0}, cold_t {1}'.format(warm_t, cold_t))
+
+    def test_status_workers_performance(self):
+        # Simulate a file system where each stat is a round trip to a server
+        # (e.g., NFS). libgit2's stats can't be slowed down, so this compares
+        # the parallel status with one worker to the one with many workers
+        LATENCY = 0.0005
+        WORKERS = 16
+
+        utils.git('add', '.')
+        utils.git('commit', '-m', 'commit')
+        utils.write_file('f1', contents='modified')
+        lstat = os.lstat
+
+        def slow_lstat(*args, **kwargs):
+            time.sleep(LATENCY)
+            return lstat(*args, **kwargs)
+
+        def time_status(workers):
+            utils.git('config', 'gitless.statusWorkers', str(workers))
+            repo = core.Repository()
+            t = time.time()
+            with mock.patch('os.lstat', side_effect=slow_lstat):
+                st = sorted(repo.current_branch.status())
+            return time.time() - t, st
+
+        serial_t, serial_st = time_status(1)
+        parallel_t, parallel_st = time_status(WORKERS)
+        logging.info('status: {0} with 1 worker, {1} with {2} workers'.format(
+            serial_t, parallel_t, WORKERS))
+        self.assertEqual(serial_st, parallel_st)
+        self.assertTrue(
+            parallel_t < serial_t / 4,
+            msg='parallel_t {0}, serial_t {1}'.format(parallel_t, serial_t))
+
+    def test_status_list_memory(self):
+        def memory(status):
+            tracemalloc.start()
+            try:
+                st = status()
+                return tracemalloc.get_traced_memory(), st
+            finally:
+                tracemalloc.stop()
+
+        utils.write_file(os.path.join('dir', 'tracked'))
+        utils.git('add', os.path.join('dir', 'tracked'))
+        for i in range(0, self.FPS_QTY):
+            utils.write_file(os.path.join('dir', 'f' + str(i)))
+        curr_b = core.Repository().current_branch
+        list(curr_b.status())  # so that both find the untracked cache warm
+        (list_mem, list_peak), st = memory(lambda: list(curr_b.status()))
+        (st_list_mem, st_list_peak), st_list = memory(curr_b.status_list)
+        logging.info(
+            'status memory (retained/peak): {0}/{1} (list), {2}/{3} '
+            '(StatusList)'.format(list_mem, list_peak, st_list_mem, st_list_peak))
+        self.assertEqual(st, list(st_list))
+        self.assertTrue(
+            st_list_mem < list_mem / 2,
+            msg='st_list_mem {0}, list_mem {1}'.format(st_list_mem, list_mem))
+        # The statuses are streamed into the StatusList, so there's never a
+        # list of them
+        self.assertTrue(
+            st_list_peak < list_peak,
+            msg='st_list_peak {0}, list_peak {1}'.format(st_list_peak, list_peak))
+
+    def test_track_dir_performance(self):
+        # A tree with a large ignored node_modules, where most files are already
+        # tracked. Before, all the files under the dir given were processed
+        # (asking libgit2 if each dir is ignored) and gl track rejected the
+        # tracked ones one by one
+        for i in range(0, 200):
+            for j in range(0, 25):
+                utils.write_file(
+                    os.path.join('node_modules', 'p' + str(i), 'lib', str(j)))
+        utils.write_file('.gitignore', contents='node_modules/\n')
+        utils.git('add', '.')
+        utils.git('commit', '-m', 'commit')
+        new_fps = ['new' + str(i) for i in range(0, 10)]
+        for fp in new_fps:
+            utils.write_file(fp)
+        repo = core.Repository()
+        curr_b = repo.current_branch
+
+        def os_walk_files():
+            root = repo.root
+            for curr_dir, dirs, fps in os.walk(root):
+                curr_dir_rel = os.path.relpath(curr_dir, root)
+                if curr_dir_rel == '.':
+                    dirs.remove('.git')
+                elif repo.git_repo.path_is_ignored(curr_dir_rel):
+                    dirs[:] = []
+                    continue
+                for fp in fps:
+                    yield os.path.normpath(os.path.join(curr_dir_rel, fp))
+
+        def time_track(walk):
+            t = time.time()
+            fps = list(walk())
+            errors = curr_b.track_files(fps)
+            return time.time() - t, fps, errors
+
+        os_walk_t, fps, errors = time_track(os_walk_files)
+        self.assertEqual(len(fps) - len(new_fps), len(errors))
+        utils.git('reset', '-q')  # untrack the new files
+        walk_t, fps, errors = time_track(
+            lambda: repo.walk_files('.', tracked=False))
+        logging.info('track: {0} with os.walk, {1} with walk_files'.format(
+            os_walk_t, walk_t))
+        self.assertEqual(new_fps, fps)
+        self.assertEqual({}, errors)
+        self.assertTrue(
+            walk_t < os_walk_t / 4,
+            msg='walk_t {0}, os_walk_t {1}'.format(walk_t, os_walk_t))
+
+    def test_diff_performance(self):
+        utils.git('add', '.')
+        utils.git('commit', '-m', 'commit')
+        fps = sorted('f' + str(i) for i in range(0, self.FPS_QTY))
+        for fp in fps:
+            utils.append_to_file(fp, contents='\nmodified')
+        curr_b = core.Repository().current_branch
+
+        def time_diff(diff):
+            t = time.time()
+            stats = [(fp, patch.line_stats) for fp, patch in diff()]
+            return time.time() - t, stats
+
+        # Diffing all the files one by one takes too long, so diff_files diffs
+        # all of them and diff_file a tenth
+        sample = fps[:len(fps) // 10]
+        diff_file_t, diff_file_stats = time_diff(
+            lambda: ((fp, curr_b.diff_file(fp)) for fp in sample))
+        diff_files_t, diff_files_stats = time_diff(
+            lambda: curr_b.diff_files(fps))
+        logging.info(
+            'diff: {0} with diff_file ({1} files), {2} with diff_files ({3} '
+            'files)'.format(diff_file_t, len(sample), diff_files_t, len(fps)))
+        self.assertEqual(diff_file_stats, diff_files_stats[:len(sample)])
+        self.assertTrue(
+            diff_files_t < diff_file_t,
+            msg='diff_files_t {0}, diff_file_t {1}'.format(
+                diff_files_t, diff_file_t))
+
+    @unittest.skipUnless(
+        (os.cpu_count() or 1) >= 4, 'needs a few CPUs to run diffs on')
+    def test_diff_jobs_performance(self):
+        # A change touching 20k files
+        fps = ['f' + str(i) for i in range(0, 2 * self.FPS_QTY)]
+        for fp in fps[self.FPS_QTY:]:
+            utils.write_file(fp, fp)
+        utils.git('add', '.')
+        utils.git('commit', '-m', 'commit')
+        for fp in fps:
+            utils.append_to_file(fp, contents='\nmodified')
+
+        def time_diff(jobs):
+            t = time.time()
+            out = utils.gl('diff', '-j', str(jobs))
+            return time.time() - t, out
+
+        serial_t, serial_out = time_diff(1)
+        parallel_t, parallel_out = time_diff(4)
+        logging.info('diff: {0} with 1 job, {1} with 4 jobs'.format(
+            serial_t, parallel_t))
+        self.assertEqual(serial_out, parallel_out)
+        self.assertTrue(
+            parallel_t < serial_t,
+            msg='parallel_t {0}, serial_t {1}'.format(parallel_t, serial_t))
+
     def test_branch_switch_performance(self):
         MAX_TOLERANCE = 100
 
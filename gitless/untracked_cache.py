@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+# Gitless - a version control system built on top of Git
+# Licensed under MIT
+
+"""A cache of the untracked files of the working tree.
+
+Finding the untracked files requires listing every directory of the working
+tree and matching what's in it against the ignore rules. Most of the time,
+nothing changed since the last time, so the result of that is cached (in the
+Git dir) per directory. A directory is only listed again if:
+  - its mtime changed (a file or dir was created, removed or renamed in it);
+  - the ignore rules that apply to it changed (its .gitignore, the .gitignore
+    of one of its parents, .git/info/exclude or core.excludesFile).
+The entries of directories that are not in the working tree anymore are
+dropped.
+
+Since the mtime of a directory doesn't change if a file in it is added to (or
+removed from) the index, the cache has the files that are not ignored, and
+which of those are untracked is worked out again if the index changed.
+"""
+
+import hashlib
+import heapq
+import json
+import os
+import time
+
+from gitless import ignore
+
+
+CACHE_FILE = 'GL_UNTRACKED_CACHE'
+_CACHE_VERSION = 1
+
+# The fields of the entry of a dir in the cache
+(_MTIME, _GITIGNORE_STAT, _GITIGNORE_HASH, _RULES_KEY, _FILES, _DIRS,
+ _INDEX_STAMP, _UNTRACKED) = range(8)
+
+
+def untracked_files(
+        root, git_dir, exclude_fps, index_stamp, index_paths, write=True):
+    """Return an iterator of the untracked files in the working tree at root.
+
+    Untracked files are the files that are not in the index and are not
+    ignored. Paths are relative to root, use '/' as separator and come sorted
+    (in the order of the index). As libgit2 does, a nested repository is
+    reported as a single path ending in '/' (its files are not looked at).
+
+    The working tree is scanned (and the cache updated) before this returns,
+    the paths are built as the iterator is consumed.
+
+    Args:
+      root: the root of the working tree.
+      git_dir: the Git dir (where the cache is).
+      exclude_fps: the paths of the ignore files that apply to the whole
+        working tree (in order of precedence).
+      index_stamp: a value that changes when the index changes.
+      index_paths: a function that returns the set of paths in the index (only
+        called if the index changed since the cache was written).
+      write: if False, the cache is used but not updated (nothing is written).
+    """
+    cache_fp = os.path.join(git_dir, CACHE_FILE)
+    excludes_hash = _hash(b''.join(_read(fp) or b'\0' for fp in exclude_fps))
+    cache = _load(cache_fp)
+    if not cache or cache['excludes'] != excludes_hash:
+        cache = {'excludes': excludes_hash, 'dirs': {}}
+
+    scan = _Scan(root, cache['dirs'], exclude_fps, index_stamp, index_paths)
+    scan.dir('', excludes_hash)
+    if write and (scan.changed or len(scan.entries) != len(cache['dirs'])):
+        _store(cache_fp, {'excludes': excludes_hash, 'dirs': scan.entries})
+    return _untracked(root, scan.entries, '')
+
+
+# Private functions
+
+
+class _Scan(object):
+    """A walk of the working tree that uses (and updates) the cached entries."""
+
+    def __init__(self, root, cached, exclude_fps, index_stamp, index_paths):
+        self.root = root
+        self.cached = cached
+        self.entries = {}
+        self.changed = False
+        self.index_stamp = list(index_stamp) if index_stamp else None
+        self._index_paths = index_paths
+        self._index_paths_memo = None
+        self._rules = ignore.Rules(root, exclude_fps)
+        # The mtime of a dir that changes after it is listed but within the
+        # granularity of the file system's timestamps looks unchanged. So the
+        # mtimes of the dirs modified after we started are not trusted
+        self.start_ns = time.time_ns()
+
+    def dir(self, rel_dir, parent_key):
+        full_dir = os.path.join(self.root, rel_dir)
+        try:
+            mtime = os.stat(full_dir).st_mtime_ns
+        except OSError:  # removed while we were at it
+            return
+        cached = self.cached.get(rel_dir)
+
+        gitignore_fp = os.path.join(full_dir, '.gitignore')
+        gitignore_stat = _stat(gitignore_fp)
+        if cached and gitignore_stat and cached[_GITIGNORE_STAT] == gitignore_stat:
+            gitignore_hash = cached[_GITIGNORE_HASH]
+        else:
+            content = _read(gitignore_fp) if gitignore_stat else None
+            gitignore_hash = _hash(content) if content is not None else None
+        key = _hash((parent_key + (gitignore_hash or '')).encode('ascii'))
+        if gitignore_stat and gitignore_stat[0] >= self.start_ns:
+            gitignore_stat = None  # hash it again next time
+
+        if (cached and cached[_MTIME] == mtime and cached[_RULES_KEY] == key and
+                cached[_MTIME] is not None):
+            entry = list(cached)
+            if entry[_GITIGNORE_STAT] != gitignore_stat:
+                entry[_GITIGNORE_STAT] = gitignore_stat
+                self.changed = True
+        else:
+            files, dirs = self._list(rel_dir)
+            if mtime >= self.start_ns:
+                mtime = None
+            entry = [
+                mtime, gitignore_stat, gitignore_hash, key, files, dirs, None,
+                None]
+            self.changed = True
+
+        if entry[_INDEX_STAMP] != self.index_stamp or entry[_INDEX_STAMP] is None:
+            index_paths = self.index_paths()
+            entry[_UNTRACKED] = [
+                fp for fp in entry[_FILES]
+                if _join(rel_dir, fp.rstrip('/')) not in index_paths]
+            entry[_INDEX_STAMP] = self.index_stamp
+            self.changed = True
+        self.entries[rel_dir] = entry
+        for name in entry[_DIRS]:
+            self.dir(_join(rel_dir, name), key)
+
+    def index_paths(self):
+        if self._index_paths_memo is None:
+            self._index_paths_memo = self._index_paths()
+        return self._index_paths_memo
+
+    def _list(self, rel_dir):
+        """Return the files and dirs in rel_dir that are not ignored."""
+        rule_sets = self._rules.rule_sets(rel_dir)
+        files = []
+        dirs = []
+        with os.scandir(os.path.join(self.root, rel_dir)) as it:
+            for e in it:
+                name = e.name
+                if name == '.git':
+                    continue
+                rel_path = rel_dir + '/' + name if rel_dir else name
+                is_dir = e.is_dir(follow_symlinks=False)
+                if rule_sets and ignore.is_ignored(
+                        rule_sets, rel_path, name, is_dir):
+                    continue
+                if not is_dir:
+                    files.append(name)
+                elif os.path.lexists(os.path.join(e.path, '.git')):
+                    files.append(name + '/')  # a nested repository
+                else:
+                    dirs.append(name)
+        files.sort()
+        dirs.sort()
+        return files, dirs
+
+
+def _untracked(root, entries, rel_dir):
+    """Generate the untracked files in rel_dir (and its subdirs), sorted.
+
+    The entries of the dirs are dropped as they are done with, so that the
+    cache is freed as the paths are consumed.
+    """
+    entry = entries.pop(rel_dir, None)
+    if entry is None:  # removed while we were scanning
+        return
+    # The untracked files (and nested repositories, that end in '/') are
+    # sorted, a dir sorts as if it had a trailing '/' (like the paths in it do)
+    dirs = sorted(name + '/' for name in entry[_DIRS])
+    dirs_set = set(dirs)
+    prefix = rel_dir + '/' if rel_dir else ''
+    names = heapq.merge(entry[_UNTRACKED], dirs) if dirs else entry[_UNTRACKED]
+    for name in names:
+        if name in dirs_set:
+            yield from _untracked(root, entries, prefix + name[:-1])
+        elif name.endswith('/') and not _has_files(
+                os.path.join(root, rel_dir, name)):
+            # Like empty dirs, nested repositories without files are not
+            # reported. What's in them doesn't change the mtime of rel_dir, so
+            # this is checked every time
+            continue
+        else:
+            yield prefix + name
+
+
+def _has_files(nested_repo_dir):
+    try:
+        with os.scandir(nested_repo_dir) as it:
+            return any(e.name != '.git' for e in it)
+    except OSError:
+        return False
+
+
+def _join(rel_dir, name):
+    return rel_dir + '/' + name if rel_dir else name
+
+
+def _stat(fp):
+    try:
+        st = os.stat(fp)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+
+def _read(fp):
+    try:
+        with open(fp, 'rb') as f:
+            return f.read()
+    except (OSError, IOError):
+        return None
+
+
+def _hash(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+def _load(cache_fp):
+    try:
+        with open(cache_fp, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        if cache['version'] != _CACHE_VERSION:
+            return None
+        return cache
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _store(cache_fp, cache):
+    cache['version'] = _CACHE_VERSION
+    try:
+        tmp_fp = cache_fp + '.tmp'
+        with open(tmp_fp, 'w', encoding='utf-8') as f:
+            # (dumps is a lot faster than dump)
+            f.write(json.dumps(cache, separators=(',', ':')))
+        os.replace(tmp_fp, cache_fp)
+    except (IOError, OSError):
+        pass  # the cache is just an optimization
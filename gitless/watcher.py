@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+# Gitless - a version control system built on top of Git
+# Licensed under MIT
+
+"""A file watcher for the working tree (like Git's fsmonitor).
+
+Doing a status requires a stat of every file in the working tree, even if
+nothing changed. The watcher (see serve) uses inotify to learn which paths
+changed, and answers the question "what changed since token T?" over a Unix
+socket (see changes). With that, the status of the last time only needs to be
+updated for the paths that changed.
+
+Tokens are opaque strings. If the watcher can't tell what changed since a
+token (because it was started after the token was given out, or because it
+lost events), it says so and the caller has to look at everything.
+
+The socket is in the private run dir of the user (see run_dir): gl status
+only listens to a watcher run by the same user, and the watcher only answers
+processes of that user.
+
+inotify is only available on Linux. Anywhere else, there's never a watcher
+running.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import hashlib
+import json
+import os
+import select
+import socket
+import struct
+import sys
+
+from gitless import run_dir
+
+
+# inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR |
+    IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+
+# Past this many changed paths, the watcher forgets them (and answers that it
+# doesn't know what changed): at that point, looking at everything is cheaper
+# than looking at each path
+MAX_CHANGED_PATHS = 50000
+
+_EVENT = struct.Struct('iIII')
+_LENGTH = struct.Struct('!I')
+
+
+class WatcherError(Exception):
+    pass
+
+
+def is_supported():
+    return sys.platform.startswith('linux') and run_dir.is_supported()
+
+
+def address(root):
+    """Return the path of the Unix socket of the watcher of the tree at root."""
+    tree_id = hashlib.sha1(os.fsencode(os.path.abspath(root))).hexdigest()
+    return os.path.join(run_dir.path(), 'watch-{0}.sock'.format(tree_id[:16]))
+
+
+def changes(root, token):
+    """Ask the watcher of the tree at root what changed since token.
+
+    Returns a (new token, paths) pair, where paths is the list of paths
+    (relative to root) that changed or None if the watcher doesn't know what
+    changed since token (token can be None to just get a token). Files created
+    in a new directory might only be reported as the directory. Returns None
+    if there's no watcher running.
+    """
+    if not is_supported():
+        return None
+    reply = _request(address(root), {'since': token})
+    if reply is None:
+        return None
+    return reply['token'], reply['paths']
+
+
+def stop(root):
+    """Ask the watcher of the tree at root to exit.
+
+    Returns False if there's no watcher running.
+    """
+    return is_supported() and _request(address(root), {'stop': True}) is not None
+
+
+def serve(root):
+    """Watch the tree at root and serve the requests until asked to stop."""
+    if not is_supported():
+        raise WatcherError('File watching is only supported on Linux')
+    fp = address(root)
+    try:
+        run_dir.make()
+    except run_dir.RunDirError as e:
+        raise WatcherError(str(e))
+    if _request(fp, {'since': None}) is not None:
+        raise WatcherError('There\'s already a watcher running for this tree')
+    if os.path.lexists(fp):  # left behind by a watcher that crashed
+        os.unlink(fp)
+
+    tree = _Tree(root)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        listener.bind(fp)
+        listener.listen(16)
+        while True:
+            ready, _, _ = select.select([tree.fd, listener], [], [])
+            if tree.fd in ready:
+                tree.read_events()
+            if listener in ready:
+                conn, _ = listener.accept()
+                with conn:
+                    if not run_dir.peer_is_user(conn):
+                        continue  # someone else
+                    if not _handle(conn, tree):
+                        break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        os.unlink(fp)
+        tree.close()
+
+
+# Private functions
+
+
+class _Tree(object):
+    """The inotify watches of the working tree and what changed in it."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise WatcherError(os.strerror(ctypes.get_errno()))
+        self.wds = {}  # watch descriptor -> dir (relative to root)
+        self.dirs = {}  # dir (relative to root) -> watch descriptor
+        self._reset()
+        self._watch('')
+
+    def close(self):
+        os.close(self.fd)
+
+    def changes(self, token):
+        """Return the paths that changed since token (None if unknown)."""
+        self.read_events()  # anything done before the request is reported
+        if not token:
+            return None
+        instance, _, seq = token.partition(':')
+        if instance != self.instance or not seq.isdigit():
+            return None
+        seq = int(seq)
+        return [p for p, p_seq in self.changed.items() if p_seq > seq]
+
+    @property
+    def token(self):
+        return '{0}:{1}'.format(self.instance, self.seq)
+
+    def read_events(self):
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, pos)
+                pos += _EVENT.size
+                name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+                pos += length
+                self._event(wd, mask, name)
+
+    def _event(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:  # events were lost
+            self._reset()
+            return
+        if mask & IN_IGNORED:  # the watch was removed
+            rel_dir = self.wds.pop(wd, None)
+            if rel_dir is not None and self.dirs.get(rel_dir) == wd:
+                del self.dirs[rel_dir]
+            return
+        rel_dir = self.wds.get(wd)
+        if rel_dir is None or mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            return  # reported by the event on the parent dir
+        if not name:
+            return
+        if not rel_dir and name == '.git':
+            return
+        path = rel_dir + '/' + name if rel_dir else name
+        if mask & IN_ISDIR:
+            if mask & (IN_MOVED_FROM | IN_DELETE):
+                self._unwatch(path)
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                # What's created in the dir before the watch is added is not
+                # reported, but reporting the dir covers it
+                self._watch(path)
+        self._changed(path)
+
+    def _changed(self, path):
+        if len(self.changed) >= MAX_CHANGED_PATHS:
+            self._reset()
+        self.seq += 1
+        self.changed[path] = self.seq
+
+    def _reset(self):
+        """Forget what changed, tokens given out before this are unknown."""
+        self.instance = os.urandom(8).hex()
+        self.seq = 0
+        self.changed = {}
+
+    def _watch(self, rel_dir):
+        """Watch rel_dir and all dirs under it (but not the Git dir)."""
+        top = os.path.join(self.root, rel_dir) if rel_dir else self.root
+        for curr_dir, dirs, _ in os.walk(top):
+            if curr_dir == self.root and '.git' in dirs:
+                dirs.remove('.git')
+            wd = self._libc.inotify_add_watch(
+                self.fd, os.fsencode(curr_dir), WATCH_MASK)
+            if wd < 0:
+                if ctypes.get_errno() == errno.ENOSPC:
+                    raise WatcherError(
+                        'Reached the limit of inotify watches (see '
+                        '/proc/sys/fs/inotify/max_user_watches)')
+                continue  # removed while we were at it
+            rel = os.path.relpath(curr_dir, self.root).replace(os.sep, '/')
+            rel = '' if rel == '.' else rel
+            self.wds[wd] = rel
+            self.dirs[rel] = wd
+
+    def _unwatch(self, rel_dir):
+        """Stop watching rel_dir and all dirs under it."""
+        prefix = rel_dir + '/'
+        for curr in [d for d in self.dirs if d == rel_dir or d.startswith(prefix)]:
+            wd = self.dirs.pop(curr)
+            self.wds.pop(wd, None)
+            self._libc.inotify_rm_watch(self.fd, wd)
+
+
+def _handle(conn, tree):
+    """Handle the request sent through conn. Returns False to stop serving."""
+    try:
+        request = json.loads(_recv(conn).decode('utf-8'))
+        if request.get('stop'):
+            _send(conn, {})
+            return False
+        paths = tree.changes(request.get('since'))
+        _send(conn, {'token': tree.token, 'paths': paths})
+    except (EOFError, ValueError, OSError):
+        pass  # bad request or the client went away
+    return True
+
+
+def _request(fp, request):
+    sock = run_dir.connect(fp)
+    if not sock:
+        return None
+    try:
+        _send(sock, request)
+        return json.loads(_recv(sock).decode('utf-8'))
+    except (OSError, EOFError, ValueError):
+        return None
+    finally:
+        sock.close()
+
+
+def _send(sock, message):
+    data = json.dumps(message).encode('utf-8')
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+
+
+def _recv(sock):
+    length = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))[0]
+    return _recv_exactly(sock, length)
+
+
+def _recv_exactly(sock, n):
+    data = b''
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data